@@ -1,144 +1,423 @@
-from fastapi import FastAPI, Form
-import json, random
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Form, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
+import asyncio, json, random, time
 import numpy as np
 from datetime import datetime
 
-from features import extract_features
-from model import rf_model, online_model
-
-app = FastAPI(title="Risk-Aware Fraud Detection")
-
-DATA_FILE = "user_transactions.json"
+from config import (
+    DATA_FILE, STORAGE_BACKEND, LOG_FILE, SNAPSHOT_FILE,
+    LOG_COMMIT_WINDOW_MS, LOG_COMPACT_EVERY, SQLITE_FILE, USER_LOCK_FILE,
+    MICROBATCH, MICROBATCH_MAX_ROWS, MICROBATCH_WINDOW_MS,
+    MODEL_SNAPSHOT_INTERVAL_S, ONLINE_LEARNING, ONLINE_LEARNING_MAX_BATCH,
+    ONLINE_LEARNING_INTERVAL_S, WORKERS, MODEL_SYNC_INTERVAL_S, USER_LOCK_STRIPES,
+    PROFILER, PROFILER_INTERVAL_MS, PENDING_TTL_S, PENDING_WHEEL_TICK_S, PENDING_WHEEL_SLOTS,
+    TIMEOUT_LABEL_WEIGHT, CASCADE, CASCADE_MAX_AMOUNT_RATIO, CASCADE_MAX_SCORE,
+    DEVICE_INDEX_HALF_LIFE_S, DEVICE_INDEX_MAX_DEVICES, DEVICE_INDEX_MAX_USERS,
+    RETRAIN_INTERVAL_S, RETRAIN_TREES, RETRAIN_JOBS, RETRAIN_HOLDOUT, RETRAIN_MIN_ROWS,
+    RETRAIN_MIN_AUC_GAIN, RETRAIN_LABELS, RETRAIN_NICE, SHADOW_MODELS, SHADOW_LOG_DIR,
+    SHADOW_QUEUE, SHADOW_BATCH, SHADOW_FLUSH_ROWS, SHADOW_FLUSH_S,
+    RESPONSE_CACHE_ENTRIES, RESPONSE_CACHE_MB, EVENTS_BUFFER, EVENTS_HEARTBEAT_S,
+    EVENTS_MAX_STREAM_S, POLICY_FILE, POLICY_RELOAD_S
+)
+from batching import MicroBatcher
+from caching import ResponseCache, etag_matches, make_etag
+from cascade import Cascade
+from cluster import ModelSync
+from concurrency import StripedLocks, TxnIds
+from crossuser import DeviceIndex, SqliteDeviceIndex
+from events import EventBus, format_sse
+from expiry import PendingExpiry
+from features import (
+    FEATURE_KEYS, FeatureState, extract_features, extract_features_batch,
+    features_from_row, to_epoch
+)
+from learner import OnlineLearner
+from metrics import Registry, RequestMetrics
+from model import models
+from policy import RISK_FLAGS, PolicyFile
+from profiler import SamplingProfiler
+from retrain import ForestRetrainer
+from shadow import Challenger, ShadowRunner, parse_challengers
+from scoring import online_proba_many
+from storage import (
+    PENDING_SCOPE, USERS_SCOPE, JsonStore, LogStore, SqliteStore, user_scope
+)
 
 # -------------------------------
 # Load / Save
 # -------------------------------
+# several uvicorn workers share users/history/pending through SQLite
+# (the json and log stores keep state in one process) and models through
+# MODEL_DIR snapshots, see cluster.py
+SHARED = WORKERS > 1
+
 def load_data():
-    with open(DATA_FILE) as f:
-        return json.load(f)
+    if SHARED and STORAGE_BACKEND != "sqlite":
+        raise ValueError("FRAUD_WORKERS > 1 needs FRAUD_STORAGE=sqlite")
+    if STORAGE_BACKEND == "log":
+        s = LogStore(
+            DATA_FILE, LOG_FILE, SNAPSHOT_FILE,
+            commit_window_ms=LOG_COMMIT_WINDOW_MS,
+            compact_every=LOG_COMPACT_EVERY
+        )
+    elif STORAGE_BACKEND == "sqlite":
+        s = SqliteStore(SQLITE_FILE, seed_path=DATA_FILE)
+    elif STORAGE_BACKEND == "json":
+        s = JsonStore(DATA_FILE)
+    else:
+        raise ValueError(f"Unknown storage backend: {STORAGE_BACKEND}")
+    s.load()
+    return s
+
+store = load_data()
 
-def save_data(d):
-    with open(DATA_FILE, "w") as f:
-        json.dump(d, f, indent=2)
+@asynccontextmanager
+async def lifespan(app):
+    models.start_autosave(MODEL_SNAPSHOT_INTERVAL_S)
+    pending_expiry.track_existing(store.iter_pending())
+    if STORAGE_BACKEND != "sqlite":
+        device_index.warm(recent_device_rows(time.time() - device_index.window))
+    if PROFILER:
+        profiler.start(PROFILER_INTERVAL_MS)
+    yield
+    pending_events.close()
+    profiler.stop()
+    pending_expiry.close()
+    device_index.close()
+    if batcher is not None:
+        batcher.close()
+    retrainer.close()
+    if shadow is not None:
+        shadow.close()
+    policies.close()
+    if model_sync is not None:
+        model_sync.close()
+    # applies whatever labels are still queued before the final snapshot
+    if learner is not None:
+        learner.close()
+    models.close()
+    store.close()
+    user_locks.close()
 
-data = load_data()
-users = {u["user_id"]: u for u in data["users"]}
+app = FastAPI(title="Risk-Aware Fraud Detection", lifespan=lifespan)
 
 # -------------------------------
-# Risk flags
+# Concurrency
 # -------------------------------
-def get_risk_flag(score):
-    if score <= 20: return "LOW"
-    if score <= 40: return "MEDIUM"
-    if score <= 60: return "HIGH"
-    if score <= 80: return "CRITICAL"
-    return "SEVERE"
+# Sync endpoints run on the threadpool. Everything that reads a user's
+# state and writes it back (/transaction, /transactions/batch,
+# /verify-otp, /decision, pending expiry) holds that user's lock stripe
+# for the whole read-score-commit sequence, while requests for different
+# users run in parallel. In one process the stripe is a thread lock. With
+# several workers it is also a byte-range lock on USER_LOCK_FILE, so it
+# holds across processes: a worker takes it, catches its feature state
+# up on what other workers committed (sync_feature_state), scores and
+# commits before another worker can score the same user. Either way two
+# requests for one user never score against the same feature state or
+# pop the same pending entry twice. Stores serialize their own writes;
+# models are swapped whole (see learner.py) and only read on the request
+# path.
+#
+# Transaction ids come from TxnIds instead of the user's transaction
+# count, which two concurrent requests (or two workers) could both see.
+user_locks = StripedLocks(USER_LOCK_STRIPES, USER_LOCK_FILE if SHARED else None)
+txn_ids = TxnIds()
 
 # -------------------------------
-# Transaction endpoint
+# Metrics
 # -------------------------------
-@app.post("/transaction")
-def evaluate_transaction(txn: dict):
+# Served as Prometheus text at /metrics. Stage names are grouped by
+# prefix: store.* (persistence), features.*, score.* and learn.*.
+metrics = Registry()
+STAGE_SECONDS = metrics.histogram(
+    "fraud_stage_seconds", "Time spent in each request stage", ["stage"]
+)
+DECISION_PATHS = metrics.counter(
+    "fraud_decision_path_total", "Transactions by the policy path they took", ["path"]
+)
+RISK_FLAGS_SCORED = metrics.counter(
+    "fraud_risk_flag_total", "Model-scored transactions by risk flag", ["flag"]
+)
+REVIEWS = metrics.counter(
+    "fraud_review_decisions_total", "Decisions on pending transactions (TIMEOUT = expired)",
+    ["decision", "otp_verified"]
+)
+REQUEST_SECONDS = metrics.histogram(
+    "fraud_http_request_seconds", "Request latency by route", ["method", "route"]
+)
+REQUESTS = metrics.counter(
+    "fraud_http_requests_total", "Requests by route and status", ["method", "route", "status"]
+)
 
-    user_id = txn["user_id"]
-    amount = txn["amount"]
-    device_id = txn["device_id"]
-
-    user = users[user_id]
-    user.setdefault("history", [])
-    user.setdefault("pending", {})
-    user.setdefault("profile", {"avg_amount": amount})
+# store sizes are read once per scrape (see /metrics)
+store_stats = {}
+for key, help in [
+    ("users", "Users in the store"),
+    ("pending", "Transactions waiting for review"),
+    ("history_rows", "Committed transactions"),
+    ("file_bytes", "Bytes the store occupies on disk")
+]:
+    metrics.gauge(f"fraud_store_{key}", help, lambda key=key: store_stats.get(key))
+CASCADE_DECISIONS = metrics.counter(
+    "fraud_cascade_decisions_total",
+    "First-stage cascade decisions by the full ensemble's flag (skipped = not scored)",
+    ["cascade", "full"]
+)
+CASCADE_MODEL_SECONDS = metrics.counter(
+    "fraud_cascade_model_seconds_total",
+    "Full ensemble scoring time by cascade decision", ["cascade"]
+)
+device_index_stats = {}
+metrics.gauge("fraud_device_index_devices", "Devices in the cross-user device index",
+              lambda: device_index_stats.get("devices"))
+metrics.gauge("fraud_device_index_entries", "(device, user) pairs in the cross-user device index",
+              lambda: device_index_stats.get("entries"))
+metrics.gauge("fraud_pending_expiry_tracked", "Pending transactions with a TTL running",
+              lambda: len(pending_expiry.wheel))
+CACHED_READS = metrics.counter(
+    "fraud_cached_reads_total",
+    "Versioned reads by outcome (not_modified = 304, hit = cached body, miss = built)",
+    ["route", "result"]
+)
+RETRAIN_RUNS = metrics.counter(
+    "fraud_retrain_runs_total", "Forest retraining runs by result", ["result"]
+)
+metrics.gauge("fraud_shadow_queue_depth", "Transactions waiting for the shadow models",
+              lambda: shadow.stats()["queue_depth"] if shadow is not None else None)
+SHADOW_DROPPED = metrics.counter(
+    "fraud_shadow_dropped_total", "Transactions the full shadow queue dropped"
+)
+metrics.gauge("fraud_pending_event_streams", "Open /pending/events streams waiting for events",
+              lambda: pending_events.stats()["waiting_streams"])
+POLICY_RELOADS = metrics.counter(
+    "fraud_policy_reloads_total", "Risk policy reloads in this process"
+)
+POLICY_RELOAD_FAILURES = metrics.counter(
+    "fraud_policy_reload_failures_total", "Risk policy files that failed to load"
+)
+metrics.gauge("fraud_model_snapshot_version", "Loaded model snapshot", lambda: models.version)
+metrics.gauge("fraud_model_online_version", "Online model updates in this process",
+              lambda: models.online_version)
 
-    transaction = {
-        "amount": amount,
-        "device_id": device_id,
-        "location": "INDIA",
-        "timestamp": datetime.utcnow().isoformat()
-    }
+app.add_middleware(RequestMetrics, histogram=REQUEST_SECONDS, counter=REQUESTS)
 
-    features = extract_features(transaction, user)
+profiler = SamplingProfiler()
 
-    txn_id = f"{user_id}_{len(user['history']) + len(user['pending'])}"
+# -------------------------------
+# Scoring
+# -------------------------------
+# the risk policy, reloaded when its file changes (policy.py); a request
+# reads policies.current once and decides with it throughout
+policies = PolicyFile(
+    POLICY_FILE, POLICY_RELOAD_S,
+    on_reload=POLICY_RELOADS.inc, on_failure=POLICY_RELOAD_FAILURES.inc
+)
 
-    # -------------------------------------------------
-    # HARD BLOCK: account limit exceeded
-    # -------------------------------------------------
-    if features["account_amount_flag"] == 1:
-        transaction["fraud"] = 1
-        transaction["block_reason"] = "AMOUNT_EXCEEDS_ACCOUNT_LIMIT"
-        user["history"].append(transaction)
-        save_data(data)
+# first-stage fast path, see cascade.py
+if CASCADE in ("shadow", "on"):
+    cascade = Cascade(CASCADE_MAX_AMOUNT_RATIO, CASCADE_MAX_SCORE)
+elif CASCADE == "off":
+    cascade = None
+else:
+    raise ValueError(f"Unknown cascade mode: {CASCADE}")
 
-        return {
-            "transaction_id": txn_id,
-            "risk_score": 100,
-            "risk_flag": "SEVERE",
-            "action": "BLOCK",
-            "message": (
-                f"Transaction blocked: amount exceeds limit for "
-                f"{features['_meta']['account_type']} account"
-            )
-        }
+def cascade_outcome(approve, full_flag, model_seconds):
+    decision = "approve" if approve else "escalate"
+    CASCADE_DECISIONS.inc(decision, full_flag)
+    CASCADE_MODEL_SECONDS.inc(decision, amount=model_seconds)
 
-    # -------------------------------------------------
-    # ML scoring
-    # -------------------------------------------------
-    X_rf = np.array([[features[k] for k in [
-        "amount",
-        "txn_velocity",
-        "device_change",
-        "location_change",
-        "amount_ratio",
-        "account_amount_flag",
-        "rapid_txn"
-    ]]])
-
-    rf_prob = float(rf_model.predict_proba(X_rf)[0][1])
-
-    online_prob = float(
-        online_model.predict_proba_one(
-            {k:v for k,v in features.items() if not k.startswith("_")}
+def online_proba_one(features):
+    return float(
+        models.online_model.predict_proba_one(
+            {k: v for k, v in features.items() if not k.startswith("_")}
         ).get(1, 0)
     )
 
-    risk_score = (0.6 * online_prob + 0.4 * rf_prob) * 100
+def score_rows(X):
+    rf_probs = models.rf_engine.predict_proba(X)[:, 1]
+    online_probs = online_proba_many(models.online_model, X)
+    return [(float(r), float(o)) for r, o in zip(rf_probs, online_probs)]
 
-    # Explainable boosts
-    if amount > user["profile"]["avg_amount"] * 3:
-        risk_score += 10
-    if amount % 10 != 0:
-        risk_score += 5
-    if features["location_change"] == 1:
-        risk_score += 10
+# opt-in: coalesce concurrent /transaction requests into one model call
+batcher = (
+    MicroBatcher(score_rows, max_rows=MICROBATCH_MAX_ROWS, window_ms=MICROBATCH_WINDOW_MS)
+    if MICROBATCH else None
+)
 
-    risk_score = round(min(risk_score, 100), 2)
-    risk_flag = get_risk_flag(risk_score)
+# /decision labels go to a background learner unless ONLINE_LEARNING=sync
+if ONLINE_LEARNING == "background":
+    learner = OnlineLearner(
+        models, max_batch=ONLINE_LEARNING_MAX_BATCH, interval_s=ONLINE_LEARNING_INTERVAL_S
+    )
+elif ONLINE_LEARNING == "sync":
+    learner = None
+else:
+    raise ValueError(f"Unknown online learning mode: {ONLINE_LEARNING}")
 
-    # -------------------------------------------------
-    # Risk policy
-    # -------------------------------------------------
-    if risk_flag == "LOW":
+# with several workers labels go through the store to the sync leader
+if SHARED:
+    if learner is None:
+        raise ValueError("FRAUD_WORKERS > 1 needs FRAUD_ONLINE_LEARNING=background")
+    model_sync = ModelSync(
+        models, store, learner,
+        interval_s=MODEL_SYNC_INTERVAL_S, batch=ONLINE_LEARNING_MAX_BATCH
+    )
+else:
+    model_sync = None
+
+# periodic forest retraining (retrain.py); with several workers only the
+# model-sync leader trains, the others load the snapshot it writes
+retrainer = ForestRetrainer(
+    models, store, RETRAIN_INTERVAL_S,
+    should_run=(lambda: model_sync.leader) if SHARED else None,
+    n_estimators=RETRAIN_TREES, n_jobs=RETRAIN_JOBS, holdout=RETRAIN_HOLDOUT,
+    min_rows=RETRAIN_MIN_ROWS, min_auc_gain=RETRAIN_MIN_AUC_GAIN,
+    labels=RETRAIN_LABELS, nice=RETRAIN_NICE, on_result=RETRAIN_RUNS.inc, policies=policies
+)
+
+# challenger models scored off the request path (shadow.py)
+if SHADOW_MODELS:
+    shadow = ShadowRunner(
+        [Challenger(name, path) for name, path in parse_challengers(SHADOW_MODELS)],
+        models, SHADOW_LOG_DIR, max_queue=SHADOW_QUEUE, max_batch=SHADOW_BATCH,
+        flush_rows=SHADOW_FLUSH_ROWS, flush_s=SHADOW_FLUSH_S, policies=policies,
+        on_drop=SHADOW_DROPPED.inc
+    )
+else:
+    shadow = None
+
+def learn(x, y, w=1.0):
+    if model_sync is not None:
+        store.add_label(x, y, w)
+    elif learner is not None:
+        learner.submit(x, y, w=w)
+    else:
+        models.learn_one(x, y, w)
+
+# -------------------------------
+# Cross-user device index
+# -------------------------------
+# Which other users each device has been used by (crossuser.py). Every
+# scored transaction is observed, before its features are built. The
+# sqlite store keeps the index in the database, shared by all workers and
+# kept across restarts; the json and log stores hold it in memory and
+# rebuild the last window from history and pending at startup.
+if STORAGE_BACKEND == "sqlite":
+    device_index = SqliteDeviceIndex(store, DEVICE_INDEX_HALF_LIFE_S, DEVICE_INDEX_MAX_USERS)
+else:
+    device_index = DeviceIndex(
+        DEVICE_INDEX_HALF_LIFE_S, DEVICE_INDEX_MAX_DEVICES, DEVICE_INDEX_MAX_USERS
+    )
+
+# (device_id, user_id, epoch) of every stored transaction since `since`, in time order
+def recent_device_rows(since):
+    after = datetime.utcfromtimestamp(since).isoformat()
+    rows = []
+    for u in store.list_users():
+        for t in store.iter_history(u["user_id"], after=after):
+            if "device_id" in t:
+                rows.append((to_epoch(t["timestamp"]), t["device_id"], u["user_id"]))
+    for uid, _, entry in store.iter_pending():
+        t = entry["transaction"]
+        if to_epoch(t["timestamp"]) > since:
+            rows.append((to_epoch(t["timestamp"]), t["device_id"], uid))
+    rows.sort()
+    return [(device_id, uid, epoch) for epoch, device_id, uid in rows]
+
+# -------------------------------
+# Per-user feature state
+# -------------------------------
+# Built from stored history the first time a user is seen, then kept
+# current by commit_history, so scoring never reads the history list.
+#
+# With several workers other processes append history too: each state
+# remembers the last history row id folded into it and catches up on
+# newer rows (usually none or one, via the (user_id, id) index) on
+# every access instead.
+feature_states = {}
+feature_rows = {}
+
+def get_feature_state(user_id):
+    if SHARED:
+        return sync_feature_state(user_id)
+    state = feature_states.get(user_id)
+    if state is None:
+        state = FeatureState.from_history(store.history(user_id))
+        feature_states[user_id] = state
+    return state
+
+def sync_feature_state(user_id):
+    with user_locks.lock(user_id):
+        state = feature_states.setdefault(user_id, FeatureState())
+        while True:
+            rows = store.history_after(user_id, feature_rows.get(user_id, 0))
+            for _, t in rows:
+                state.update(t)
+            if not rows:
+                return state
+            feature_rows[user_id] = rows[-1][0]
+
+# -------------------------------
+# Commit
+# -------------------------------
+def commit_history(user_id, transaction, epoch=None):
+    with STAGE_SECONDS.time("store.append_history"):
+        store.append_history(user_id, transaction)
+    if SHARED:
+        sync_feature_state(user_id)
+    else:
+        get_feature_state(user_id).update(transaction, epoch)
+
+def block_limit_exceeded(user_id, txn_id, transaction, features, epoch):
+    transaction["fraud"] = 1
+    transaction["block_reason"] = "AMOUNT_EXCEEDS_ACCOUNT_LIMIT"
+    commit_history(user_id, transaction, epoch)
+    DECISION_PATHS.inc("hard_block")
+
+    return {
+        "transaction_id": txn_id,
+        "risk_score": 100,
+        "risk_flag": "SEVERE",
+        "action": "BLOCK",
+        "message": (
+            f"Transaction blocked: amount exceeds limit for "
+            f"{features['_meta']['account_type']} account"
+        )
+    }
+
+# changes to the pending queue, streamed by /pending/events (events.py)
+pending_events = EventBus(EVENTS_BUFFER)
+
+# `action` is the policy's action for `risk_flag` (policy.py)
+def apply_risk_policy(user_id, txn_id, transaction, features, epoch,
+                      risk_score, risk_flag, action, rf_prob, online_prob):
+    RISK_FLAGS_SCORED.inc(risk_flag)
+
+    if action == "AUTO_APPROVE":
         transaction["fraud"] = 0
-        user["history"].append(transaction)
-        save_data(data)
+        commit_history(user_id, transaction, epoch)
+        DECISION_PATHS.inc("auto_approve")
         return {"action": "AUTO_APPROVE"}
 
-    if risk_flag == "MEDIUM":
+    if action == "APPROVE_MONITOR":
         transaction["fraud"] = 0
-        user["history"].append(transaction)
-        save_data(data)
+        commit_history(user_id, transaction, epoch)
+        DECISION_PATHS.inc("approve_monitor")
         return {"action": "APPROVE_MONITOR"}
 
-    if risk_flag == "SEVERE":
+    if action == "BLOCK":
         transaction["fraud"] = 1
-        user["history"].append(transaction)
-        save_data(data)
+        commit_history(user_id, transaction, epoch)
+        DECISION_PATHS.inc("block")
         return {"action": "BLOCK"}
 
-    # HIGH / CRITICAL → OTP + Admin
+    # OTP_REQUIRED → OTP + Admin
     otp = random.randint(100000, 999999)
+    expires_at = pending_expiry.deadline(risk_flag, time.time())
 
-    user["pending"][txn_id] = {
+    entry = {
         "transaction": transaction,
         "features": features,
         "risk_score": risk_score,
@@ -148,8 +427,13 @@ def evaluate_transaction(txn: dict):
         "otp": otp,
         "otp_verified": False
     }
-
-    save_data(data)
+    if expires_at is not None:
+        entry["expires_at"] = expires_at
+    with STAGE_SECONDS.time("store.add_pending"):
+        store.add_pending(user_id, txn_id, entry)
+    pending_expiry.track(user_id, txn_id, expires_at)
+    pending_events.publish("pending_add", pending_item(user_id, txn_id, entry))
+    DECISION_PATHS.inc("otp_issued")
 
     return {
         "transaction_id": txn_id,
@@ -159,6 +443,259 @@ def evaluate_transaction(txn: dict):
         "otp": otp
     }
 
+def load_profile(user_id, amount):
+    user = store.get_user(user_id)
+    if "profile" not in user:
+        user["profile"] = {"avg_amount": amount}
+        store.set_profile(user_id, user["profile"])
+    return user["profile"]
+
+# -------------------------------
+# Transaction endpoint
+# -------------------------------
+@app.post("/transaction")
+def evaluate_transaction(txn: dict):
+
+    user_id = txn["user_id"]
+    amount = txn["amount"]
+    device_id = txn["device_id"]
+
+    policy = policies.current
+    with user_locks.hold(user_id):
+        with STAGE_SECONDS.time("store.load_profile"):
+            profile = load_profile(user_id, amount)
+        with STAGE_SECONDS.time("features.state"):
+            state = get_feature_state(user_id)
+
+        now = datetime.utcnow()
+        epoch = to_epoch(now)
+        transaction = {
+            "amount": amount,
+            "device_id": device_id,
+            "location": "INDIA",
+            "timestamp": now.isoformat()
+        }
+
+        with STAGE_SECONDS.time("features.device_index"):
+            shared = device_index.observe(device_id, user_id, epoch)
+        with STAGE_SECONDS.time("features.extract"):
+            features = extract_features(
+                transaction, profile, state, epoch, shared, policy.account_limits
+            )
+
+        txn_id = txn_ids.next(user_id)
+
+        # -------------------------------------------------
+        # HARD BLOCK: account limit exceeded
+        # -------------------------------------------------
+        if features["account_amount_flag"] == 1:
+            return block_limit_exceeded(user_id, txn_id, transaction, features, epoch)
+
+        # -------------------------------------------------
+        # ML scoring
+        # -------------------------------------------------
+        X_rf = np.array([[features[k] for k in FEATURE_KEYS]])
+
+        # cascade: the online model first, the forest only if the
+        # transaction can't be shown LOW without it
+        online_prob = None
+        if cascade is not None:
+            with STAGE_SECONDS.time("score.online"):
+                online_prob = online_proba_one(features)
+            with STAGE_SECONDS.time("score.cascade"):
+                approve, bound = cascade.check(
+                    X_rf, [online_prob], [features["_meta"]["avg_amount"]], models.rf_engine,
+                    policy
+                )
+            if approve[0] and CASCADE == "on":
+                cascade_outcome(True, "skipped", 0.0)
+                result = apply_risk_policy(
+                    user_id, txn_id, transaction, features, epoch,
+                    round(float(bound[0]), 2), "LOW", policy.actions["LOW"], None, online_prob
+                )
+                if shadow is not None:
+                    shadow.submit(
+                        user_id, txn_id, X_rf[0], features["_meta"]["avg_amount"],
+                        None, online_prob, round(float(bound[0]), 2), "LOW", 0.0
+                    )
+                return result
+
+        # each model call has its own stage timer and none encloses another,
+        # so bench.py can sum the score.* stages without counting twice
+        start = time.perf_counter()
+        if batcher is not None:
+            with STAGE_SECONDS.time("score.batched"):
+                rf_prob, online_prob = batcher.score(X_rf[0])
+        else:
+            if online_prob is None:
+                with STAGE_SECONDS.time("score.online"):
+                    online_prob = online_proba_one(features)
+            with STAGE_SECONDS.time("score.rf"):
+                rf_prob = float(models.rf_engine.predict_proba(X_rf)[0][1])
+        model_seconds = time.perf_counter() - start
+
+        with STAGE_SECONDS.time("score.policy"):
+            scores, flags, actions = policy.evaluate(
+                X_rf, [rf_prob], [online_prob], [features["_meta"]["avg_amount"]]
+            )
+        risk_score, risk_flag, action = float(scores[0]), str(flags[0]), str(actions[0])
+        if cascade is not None:
+            cascade_outcome(bool(approve[0]), risk_flag, model_seconds)
+
+        # -------------------------------------------------
+        # Risk policy
+        # -------------------------------------------------
+        result = apply_risk_policy(
+            user_id, txn_id, transaction, features, epoch,
+            risk_score, risk_flag, action, rf_prob, online_prob
+        )
+        if shadow is not None:
+            shadow.submit(
+                user_id, txn_id, X_rf[0], features["_meta"]["avg_amount"],
+                rf_prob, online_prob, risk_score, risk_flag, model_seconds
+            )
+        return result
+
+# -------------------------------
+# Batch transaction endpoint
+# -------------------------------
+# Scores N transactions with one feature pass and one predict call per
+# model. A user's k-th transaction in the batch is scored after their
+# (k-1)-th has been committed, so velocity/device/location change see the
+# same feature state they would if the rows arrived one by one;
+# each round covers the k-th transaction of every user in the batch.
+@app.post("/transactions/batch")
+def evaluate_batch(txns: list[dict]):
+    results = [None] * len(txns)
+
+    queues = {}
+    for i, t in enumerate(txns):
+        queues.setdefault(t["user_id"], []).append(i)
+
+    policy = policies.current
+    with user_locks.hold(*queues):
+        with STAGE_SECONDS.time("store.load_profile"):
+            profiles = {uid: load_profile(uid, txns[q[0]]["amount"]) for uid, q in queues.items()}
+        with STAGE_SECONDS.time("features.state"):
+            states = {uid: get_feature_state(uid) for uid in queues}
+        now = datetime.utcnow()
+        now_iso, now_epoch = now.isoformat(), to_epoch(now)
+
+        depth = 0
+        while True:
+            rows = [q[depth] for q in queues.values() if len(q) > depth]
+            if not rows:
+                break
+            depth += 1
+
+            transactions = [{
+                "amount": txns[i]["amount"],
+                "device_id": txns[i]["device_id"],
+                "location": "INDIA",
+                "timestamp": txns[i].get("timestamp", now_iso)
+            } for i in rows]
+            epochs = [
+                to_epoch(txns[i]["timestamp"]) if "timestamp" in txns[i] else now_epoch
+                for i in rows
+            ]
+            row_uids = [txns[i]["user_id"] for i in rows]
+
+            with STAGE_SECONDS.time("features.device_index"):
+                shared = [
+                    device_index.observe(t["device_id"], uid, e)
+                    for t, uid, e in zip(transactions, row_uids, epochs)
+                ]
+            with STAGE_SECONDS.time("features.extract_batch"):
+                X, metas = extract_features_batch(
+                    transactions,
+                    [profiles[uid] for uid in row_uids],
+                    [states[uid] for uid in row_uids],
+                    epochs, shared, policy.account_limits
+                )
+            features = [
+                features_from_row(X[j], metas[j], transactions[j]["amount"])
+                for j in range(len(rows))
+            ]
+
+            # -------------------------------------------------
+            # ML scoring (non-blocked rows only)
+            # -------------------------------------------------
+            blocked = X[:, FEATURE_KEYS.index("account_amount_flag")] == 1
+            scored = np.flatnonzero(~blocked)
+
+            rf_probs = np.zeros(len(rows))
+            online_probs = np.zeros(len(rows))
+            scores = np.full(len(rows), 100.0)
+            flags = np.full(len(rows), "SEVERE", dtype=RISK_FLAGS.dtype)
+            actions = np.full(len(rows), "BLOCK", dtype=policy.flag_actions.dtype)
+            # forest time split evenly over the rows it scored; NaN = not scored
+            row_seconds = np.full(len(rows), np.nan)
+            if len(scored):
+                Xs = X[scored]
+                avg_amounts = np.array([metas[j]["avg_amount"] for j in scored], dtype=float)
+                with STAGE_SECONDS.time("score.online"):
+                    online_probs[scored] = online_proba_many(models.online_model, Xs)
+
+                # cascade: in "on" mode only rows it can't approve reach the forest
+                approve = np.zeros(len(scored), dtype=bool)
+                if cascade is not None:
+                    with STAGE_SECONDS.time("score.cascade"):
+                        approve, bounds = cascade.check(
+                            Xs, online_probs[scored], avg_amounts, models.rf_engine, policy
+                        )
+                full = ~approve if CASCADE == "on" else np.ones(len(scored), dtype=bool)
+
+                start = time.perf_counter()
+                if full.any():
+                    with STAGE_SECONDS.time("score.rf"):
+                        rf_probs[scored[full]] = models.rf_engine.predict_proba(Xs[full])[:, 1]
+                model_seconds = time.perf_counter() - start
+                row_seconds[scored[full]] = model_seconds / max(int(full.sum()), 1)
+
+                with STAGE_SECONDS.time("score.policy"):
+                    scores[scored], flags[scored], actions[scored] = policy.evaluate(
+                        Xs, rf_probs[scored], online_probs[scored], avg_amounts
+                    )
+                if CASCADE == "on" and approve.any():
+                    scores[scored[approve]] = np.round(bounds[approve], 2)
+                    flags[scored[approve]] = "LOW"
+                    actions[scored[approve]] = policy.actions["LOW"]
+
+                if cascade is not None:
+                    for k, j in enumerate(scored):
+                        cascade_outcome(
+                            bool(approve[k]), str(flags[j]) if full[k] else "skipped",
+                            row_seconds[j] if full[k] else 0.0
+                        )
+
+            # -------------------------------------------------
+            # Commit in arrival order
+            # -------------------------------------------------
+            for j, i in enumerate(rows):
+                uid = txns[i]["user_id"]
+                txn_id = txn_ids.next(uid)
+
+                if blocked[j]:
+                    results[i] = block_limit_exceeded(
+                        uid, txn_id, transactions[j], features[j], epochs[j]
+                    )
+                else:
+                    results[i] = apply_risk_policy(
+                        uid, txn_id, transactions[j], features[j], epochs[j],
+                        float(scores[j]), str(flags[j]), str(actions[j]),
+                        float(rf_probs[j]), float(online_probs[j])
+                    )
+                    if shadow is not None:
+                        skipped = np.isnan(row_seconds[j])
+                        shadow.submit(
+                            uid, txn_id, X[j], metas[j]["avg_amount"],
+                            None if skipped else float(rf_probs[j]), float(online_probs[j]),
+                            float(scores[j]), str(flags[j]),
+                            0.0 if skipped else float(row_seconds[j])
+                        )
+
+        return results
+
 # -------------------------------
 # OTP verification
 # -------------------------------
@@ -168,13 +705,19 @@ def verify_otp(
     transaction_id: str = Form(...),
     otp: int = Form(...)
 ):
-    txn = users[user_id]["pending"][transaction_id]
-    if txn["otp"] != otp:
-        return {"verified": False}
+    with user_locks.hold(user_id):
+        txn = store.get_pending(user_id, transaction_id)
+        if txn is None:
+            raise HTTPException(status_code=404, detail="Transaction not found")
+        if txn["otp"] != otp:
+            return {"verified": False}
 
-    txn["otp_verified"] = True
-    save_data(data)
-    return {"verified": True}
+        with STAGE_SECONDS.time("store.verify_pending"):
+            store.verify_pending(user_id, transaction_id)
+        pending_events.publish("pending_verify", {
+            "transaction_id": transaction_id, "user_id": user_id, "otp_verified": True
+        })
+        return {"verified": True}
 
 # -------------------------------
 # Admin decision
@@ -185,88 +728,433 @@ def decision(
     transaction_id: str = Form(...),
     decision: str = Form(...)
 ):
-    user = users[user_id]
+    with user_locks.hold(user_id):
+        txn = store.get_pending(user_id, transaction_id)
+        if txn is None:
+            return {"error": "Transaction not found"}
 
-    if transaction_id not in user.get("pending", {}):
-        return {"error": "Transaction not found"}
+        otp_verified = txn.get("otp_verified", False)
 
-    txn = user["pending"].pop(transaction_id)
+        # -----------------------------------------
+        # STRICT POLICY
+        # -----------------------------------------
+        if decision == "APPROVE":
+            if not otp_verified:
+                return {
+                    "error": "OTP verification required before approval"
+                }
+            fraud_label = 0
 
-    otp_verified = txn.get("otp_verified", False)
+        elif decision == "REJECT":
+            # ❗ ALWAYS fraud, OTP or not
+            fraud_label = 1
 
-    # -----------------------------------------
-    # STRICT POLICY
-    # -----------------------------------------
-    if decision == "APPROVE":
-        if not otp_verified:
-            return {
-                "error": "OTP verification required before approval"
-            }
-        fraud_label = 0
+        else:
+            return {"error": "Invalid decision"}
 
-    elif decision == "REJECT":
-        # ❗ ALWAYS fraud, OTP or not
-        fraud_label = 1
+        with STAGE_SECONDS.time("store.pop_pending"):
+            popped = store.pop_pending(user_id, transaction_id)
+        if popped is None:
+            return {"error": "Transaction not found"}
+        pending_expiry.untrack(transaction_id)
+        REVIEWS.inc(decision, str(otp_verified).lower())
 
-    else:
-        return {"error": "Invalid decision"}
-
-    # -----------------------------------------
-    # Online learning (only trusted labels)
-    # -----------------------------------------
-    if otp_verified:
-        online_model.learn_one(
-            {k: v for k, v in txn["features"].items() if not k.startswith("_")},
-            fraud_label
-        )
+        # -----------------------------------------
+        # Online learning (only trusted labels)
+        # -----------------------------------------
+        if otp_verified:
+            with STAGE_SECONDS.time("learn.submit"):
+                learn(
+                    {k: v for k, v in txn["features"].items() if not k.startswith("_")},
+                    fraud_label
+                )
 
-    # -----------------------------------------
-    # Save transaction
-    # -----------------------------------------
-    txn["transaction"]["fraud"] = fraud_label
-    txn["transaction"]["decision"] = decision
-    txn["transaction"]["otp_verified"] = otp_verified
+        # -----------------------------------------
+        # Save transaction
+        # -----------------------------------------
+        commit_history(user_id, dict(
+            txn["transaction"],
+            fraud=fraud_label,
+            decision=decision,
+            otp_verified=otp_verified
+        ))
+        pending_events.publish("pending_resolve", {
+            "transaction_id": transaction_id, "user_id": user_id, "decision": decision
+        })
 
-    user["history"].append(txn["transaction"])
-    save_data(data)
+        return {
+            "transaction_id": transaction_id,
+            "decision": decision,
+            "fraud": fraud_label,
+            "otp_verified": otp_verified,
+            "saved": True
+        }
 
-    return {
-        "transaction_id": transaction_id,
-        "decision": decision,
-        "fraud": fraud_label,
-        "otp_verified": otp_verified,
-        "saved": True
-    }
+# -------------------------------
+# Pending expiry
+# -------------------------------
+# OTP transactions nobody decides within PENDING_TTL_S[risk_flag] are
+# handed over by the timer wheel (expiry.py): history gets decision
+# TIMEOUT and no fraud label, since nobody reviewed it. The decision alone
+# keeps the amount out of the user's baseline (features.in_baseline), and
+# retraining never reads it as a reviewed label. With
+# TIMEOUT_LABEL_WEIGHT > 0 a timeout whose OTP was never verified is also
+# a weak fraud label for the online model.
+def expire_pending(user_id, txn_id):
+    with user_locks.hold(user_id):
+        with STAGE_SECONDS.time("store.pop_pending"):
+            txn = store.pop_pending(user_id, txn_id)
+        if txn is None:
+            return False
+
+        otp_verified = txn.get("otp_verified", False)
+        REVIEWS.inc("TIMEOUT", str(otp_verified).lower())
+
+        if TIMEOUT_LABEL_WEIGHT > 0 and not otp_verified:
+            with STAGE_SECONDS.time("learn.submit"):
+                learn(
+                    {k: v for k, v in txn["features"].items() if not k.startswith("_")},
+                    1, TIMEOUT_LABEL_WEIGHT
+                )
+
+        commit_history(user_id, dict(
+            txn["transaction"],
+            decision="TIMEOUT",
+            otp_verified=otp_verified
+        ))
+        pending_events.publish("pending_resolve", {
+            "transaction_id": txn_id, "user_id": user_id, "decision": "TIMEOUT"
+        })
+        return True
+
+pending_expiry = PendingExpiry(
+    PENDING_TTL_S, expire_pending, tick_s=PENDING_WHEEL_TICK_S, slots=PENDING_WHEEL_SLOTS
+)
+
+# -------------------------------
+# Versioned reads
+# -------------------------------
+# see caching.py; `scope` is the store version the response depends on
+response_cache = ResponseCache(RESPONSE_CACHE_ENTRIES, int(RESPONSE_CACHE_MB * (1 << 20)))
+
+def versioned_json(request, route, scope, build, headers=None):
+    etag = make_etag(store.generation, store.version(scope))
+    headers = {**(headers or {}), "ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        CACHED_READS.inc(route, "not_modified")
+        return Response(status_code=304, headers=headers)
+
+    key = request.url.path + "?" + request.url.query
+    body = response_cache.get(key, etag)
+    if body is None:
+        CACHED_READS.inc(route, "miss")
+        body = json.dumps(
+            build(), ensure_ascii=False, allow_nan=False, separators=(",", ":")
+        ).encode()
+        response_cache.put(key, etag, body)
+    else:
+        CACHED_READS.inc(route, "hit")
+    return Response(body, media_type="application/json", headers=headers)
 
 # -------------------------------
 # Views
 # -------------------------------
+# X-Pending-Cursor is read before the page, so the page already reflects
+# every event up to it: a client streams /pending/events from there. With
+# several workers the cursor also carries the store's pending version
+# ("<bus cursor>:<version>", see stream_pending_events), read before the
+# bus cursor so it never counts an event the stream will send again.
+def pending_cursor():
+    if not SHARED:
+        return pending_events.cursor()
+    version = store.version(PENDING_SCOPE)
+    return f"{pending_events.cursor()}:{version}"
+
+def split_cursor(cursor):
+    cursor, _, version = (cursor or "").partition(":")
+    return cursor, int(version) if version.isdigit() else None
+
 @app.get("/pending")
-def pending():
-    out = []
-    for uid, u in users.items():
-        for tid, t in u.get("pending", {}).items():
-            out.append({
-                "transaction_id": tid,
-                "user_id": uid,
-                "risk_score": t["risk_score"],
-                "risk_flag": t["risk_flag"],
-                "rf_probability": t["rf_probability"],
-                "online_probability": t["online_probability"],
-                "otp_verified": t["otp_verified"]
-            })
-    return out
+def pending(
+    request: Request,
+    risk_flag: str | None = None,
+    otp_verified: bool | None = None,
+    limit: int = Query(50, ge=1, le=500),
+    cursor: str | None = None
+):
+    return versioned_json(
+        request, "/pending", PENDING_SCOPE,
+        lambda: pending_page(risk_flag, otp_verified, limit, cursor),
+        headers={"X-Pending-Cursor": pending_cursor()}
+    )
+
+def pending_page(risk_flag, otp_verified, limit, cursor):
+    try:
+        rows, next_cursor = store.list_pending(risk_flag, otp_verified, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return {
+        "items": [pending_item(uid, tid, t) for uid, tid, t in rows],
+        "next_cursor": next_cursor
+    }
+
+def pending_item(user_id, txn_id, entry):
+    return {
+        "transaction_id": txn_id,
+        "user_id": user_id,
+        "risk_score": entry["risk_score"],
+        "risk_flag": entry["risk_flag"],
+        "rf_probability": entry["rf_probability"],
+        "online_probability": entry["online_probability"],
+        "otp_verified": entry["otp_verified"],
+        "timestamp": entry["transaction"]["timestamp"],
+        "expires_at": entry.get("expires_at")
+    }
+
+# Server-sent events: pending_add (a /pending item), pending_verify and
+# pending_resolve, each with id = the cursor after it. Resume with
+# ?cursor= or the Last-Event-ID header; without one, or with one this
+# process can't continue from, the stream starts with a `reset` event:
+# reload /pending, then apply what follows. A stream ends after max_s
+# seconds (at most FRAUD_EVENTS_MAX_STREAM_S; 0 = only what is buffered)
+# and the client reconnects with its cursor.
+@app.get("/pending/events")
+async def pending_events_stream(
+    request: Request,
+    cursor: str | None = None,
+    max_s: float | None = Query(None, ge=0)
+):
+    cursor = cursor or request.headers.get("last-event-id")
+    max_s = EVENTS_MAX_STREAM_S if max_s is None else min(max_s, EVENTS_MAX_STREAM_S)
+    return StreamingResponse(
+        stream_pending_events(cursor, max_s),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+async def stream_pending_events(cursor, max_s):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + max_s
+    # With several workers the bus only has this worker's events. A cursor
+    # then also names the store's pending version the client's queue
+    # reflects, and each event id adds the events sent since, so a resumed
+    # stream knows what its client has seen from the cursor alone (a cursor
+    # without a version starts with a reset). A quiet stream compares the
+    # store's version with that and resets when another worker changed the
+    # queue.
+    if SHARED:
+        cursor, seen = split_cursor(cursor)
+        delivered = 0
+        if seen is None:
+            cursor = None
+
+    def event_id():
+        return f"{cursor}:{seen + delivered}" if SHARED else cursor
+
+    while not pending_events.closed:
+        timeout = max(0.0, min(EVENTS_HEARTBEAT_S, deadline - loop.time()))
+        events, reset = await pending_events.next_events(cursor, timeout)
+        if reset is not None:
+            cursor = reset
+            if SHARED:
+                cursor, seen = split_cursor(await run_in_threadpool(pending_cursor))
+                delivered = 0
+            yield format_sse("reset", {"cursor": event_id()}, event_id())
+        for seq, kind, data in events:
+            cursor = f"{pending_events.generation}.{seq}"
+            if SHARED:
+                delivered += 1
+            yield format_sse(kind, data, event_id())
+        # checked when quiet and before the stream ends
+        if SHARED and reset is None and (not events or loop.time() >= deadline):
+            version = await run_in_threadpool(store.version, PENDING_SCOPE)
+            if version > seen + delivered:
+                cursor, seen = split_cursor(await run_in_threadpool(pending_cursor))
+                delivered = 0
+                reset = cursor
+                yield format_sse("reset", {"cursor": event_id()}, event_id())
+        if loop.time() >= deadline:
+            break
+        if not events and reset is None:
+            yield ": keep-alive\n\n"
+
+def project(rows, fields):
+    if not fields:
+        yield from rows
+        return
+    keys = [f.strip() for f in fields.split(",") if f.strip()]
+    for row in rows:
+        yield {k: row[k] for k in keys if k in row}
 
 @app.get("/history/{user_id}")
-def history(user_id: str):
-    return users[user_id].get("history", [])
+def history(
+    request: Request,
+    user_id: str,
+    limit: int | None = Query(None, ge=1),
+    before: str | None = None,
+    after: str | None = None,
+    fields: str | None = None
+):
+    return versioned_json(
+        request, "/history/{user_id}", user_scope(user_id),
+        lambda: history_page(user_id, limit, before, after, fields)
+    )
+
+def history_page(user_id, limit, before, after, fields):
+    try:
+        rows = store.list_history(user_id, after, before, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid timestamp: {e}")
+    return list(project(rows, fields))
+
+# NDJSON, one history entry per line, read from the store as it is sent
+@app.get("/history/{user_id}/stream")
+def history_stream(
+    user_id: str,
+    before: str | None = None,
+    after: str | None = None,
+    fields: str | None = None
+):
+    try:
+        rows = store.iter_history(user_id, after, before)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid timestamp: {e}")
+    return StreamingResponse(
+        (json.dumps(row) + "\n" for row in project(rows, fields)),
+        media_type="application/x-ndjson"
+    )
+
+@app.get("/metrics")
+def metrics_endpoint():
+    store_stats.update(store.stats())
+    device_index_stats.update(device_index.stats())
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+# -------------------------------
+# Profiler
+# -------------------------------
+@app.post("/debug/profiler/start")
+def profiler_start(interval_ms: float = Query(PROFILER_INTERVAL_MS, gt=0), reset: bool = True):
+    profiler.start(interval_ms, reset=reset)
+    return profiler.stats()
+
+@app.post("/debug/profiler/stop")
+def profiler_stop():
+    profiler.stop()
+    return profiler.stats()
+
+# collapsed stacks ("a;b;c count" per line), most frequent first
+@app.get("/debug/profiler")
+def profiler_report(limit: int | None = Query(None, ge=1)):
+    return PlainTextResponse(profiler.report(limit))
+
+@app.get("/debug/batching")
+def debug_batching():
+    if batcher is None:
+        return {"enabled": False}
+    return {"enabled": True, **batcher.stats()}
+
+@app.get("/debug/models")
+def debug_models():
+    return {
+        "snapshot_version": models.version,
+        "online_version": models.online_version,
+        "rf_engine": models.engine,
+        "online_learning": ONLINE_LEARNING,
+        **(learner.stats() if learner is not None else {}),
+        **(model_sync.stats() if model_sync is not None else {})
+    }
+
+# runs one retraining in the background; the outcome shows up under
+# "last" in GET /debug/retrain
+@app.post("/debug/retrain")
+def retrain_now():
+    if SHARED and not model_sync.leader:
+        raise HTTPException(status_code=409, detail="only the model-sync leader retrains")
+    return {"started": retrainer.start(), **retrainer.stats()}
+
+@app.get("/debug/retrain")
+def debug_retrain():
+    return retrainer.stats()
+
+# the policy in use and its file's reload state (policy.py)
+@app.get("/debug/policy")
+def debug_policy():
+    return {**policies.stats(), "policy": policies.current.spec}
+
+# loads the file now, changed or not; a file that fails keeps the old policy
+@app.post("/debug/policy/reload")
+def debug_policy_reload():
+    return {"reloaded": policies.reload(force=True), **policies.stats()}
+
+# cascade report: "agreement" counts approvals the ensemble also scored
+# LOW plus escalations it scored above LOW (shadow mode), "unsafe" any
+# approval it didn't score LOW (should stay 0), "model_seconds_saved" the
+# ensemble time spent on rows the cascade approves (shadow) or, for rows
+# it skipped ("on"), the average per-row ensemble time
+@app.get("/debug/cascade")
+def debug_cascade():
+    if cascade is None:
+        return {"mode": CASCADE}
+
+    counts = CASCADE_DECISIONS.values()
+    seconds = CASCADE_MODEL_SECONDS.values()
+    total = sum(counts.values())
+    approved = sum(n for (c, _), n in counts.items() if c == "approve")
+    compared = {k: n for k, n in counts.items() if k[1] != "skipped"}
+    agree = sum(n for (c, full), n in compared.items() if (c == "approve") == (full == "LOW"))
+    model_total = sum(seconds.values())
+    skipped = sum(n for (_, full), n in counts.items() if full == "skipped")
+    per_row = model_total / sum(compared.values()) if compared else 0.0
+
+    return {
+        "mode": CASCADE,
+        "rf_cap": cascade.rf_cap(models.rf_engine),
+        "max_score": min(cascade.max_score, policies.current.low_bound),
+        "safe_box": cascade.box,
+        "transactions": total,
+        "approved": approved,
+        "approve_rate": round(approved / total, 4) if total else None,
+        "compared": sum(compared.values()),
+        "agreement": round(agree / sum(compared.values()), 4) if compared else None,
+        "unsafe": sum(n for (c, full), n in compared.items() if c == "approve" and full != "LOW"),
+        "missed_low": sum(n for (c, full), n in compared.items() if c == "escalate" and full == "LOW"),
+        "model_seconds": round(model_total, 6),
+        "model_seconds_saved": round(seconds.get(("approve",), 0.0) + skipped * per_row, 6),
+        "decisions": {f"{c}/{full}": n for (c, full), n in sorted(counts.items())}
+    }
+
+# live counters; agreement and latency come from `python shadow.py report`
+@app.get("/debug/shadow")
+def debug_shadow():
+    if shadow is None:
+        return {"enabled": False}
+    return {"enabled": True, **shadow.stats()}
+
+@app.get("/debug/pending-events")
+def debug_pending_events():
+    return pending_events.stats()
+
+@app.get("/debug/response-cache")
+def debug_response_cache():
+    return {"generation": store.generation, **response_cache.stats()}
+
+@app.get("/debug/device-index")
+def debug_device_index():
+    return {
+        "half_life_s": device_index.half_life,
+        "window_s": device_index.window,
+        "max_users_per_device": device_index.max_users,
+        **device_index.stats()
+    }
 
 @app.get("/debug/users")
-def debug_users():
-    return [
+def debug_users(request: Request):
+    return versioned_json(request, "/debug/users", USERS_SCOPE, lambda: [
         {
             "user_id": u["user_id"],
             "account_type": u.get("profile", {}).get("account_type", "SAVINGS")
         }
-        for u in users.values()
-    ]
+        for u in store.list_users()
+    ])
@@ -0,0 +1,128 @@
+import threading, time
+from collections import deque
+from concurrent.futures import Future
+
+import numpy as np
+
+# -------------------------------
+# Micro-batching scheduler
+# -------------------------------
+# Request threads hand in one feature row each and block on a future; a
+# scheduler thread coalesces rows that arrive within `window_ms` (or until
+# `max_rows` are queued) into one score_fn call and fans the results back
+# out. score_fn takes an N x F matrix and returns N results.
+#
+# When a caller is the only request in flight it scores inline, so a
+# quiet service never pays the batching window.
+class MicroBatcher:
+    def __init__(self, score_fn, max_rows=64, window_ms=2.0):
+        self.score_fn = score_fn
+        self.max_rows = max_rows
+        self.window = window_ms / 1000.0
+
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._inflight = 0
+        self._closed = False
+
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._batched_rows = 0
+        self._inline = 0
+        self._max_batch = 0
+        self._batch_sizes = {}
+
+        self._thread = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+        self._thread.start()
+
+    # ---------- callers ----------
+    def score(self, row):
+        with self._cond:
+            self._inflight += 1
+            inline = self._inflight == 1 and not self._queue
+            if not inline:
+                future = Future()
+                self._queue.append((row, future))
+                self._cond.notify()
+
+        try:
+            if inline:
+                with self._stats_lock:
+                    self._inline += 1
+                return self.score_fn(np.asarray(row, dtype=float).reshape(1, -1))[0]
+            return future.result()
+        finally:
+            with self._cond:
+                self._inflight -= 1
+
+    # ---------- scheduler ----------
+    def _take_batch(self):
+        with self._cond:
+            while not self._queue and not self._closed:
+                self._cond.wait()
+            if not self._queue:
+                return None
+
+            # wait for more rows, but stop early once every request that
+            # is in flight has queued up -- nobody else is coming
+            deadline = time.monotonic() + self.window
+            while len(self._queue) < min(self.max_rows, self._inflight) and not self._closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            n = min(self.max_rows, len(self._queue))
+            return [self._queue.popleft() for _ in range(n)]
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if batch is None:
+                return
+
+            rows, futures = zip(*batch)
+            try:
+                results = self.score_fn(np.vstack(rows).astype(float))
+            except Exception as e:
+                for f in futures:
+                    f.set_exception(e)
+            else:
+                for f, r in zip(futures, results):
+                    f.set_result(r)
+
+            size = len(batch)
+            with self._stats_lock:
+                self._batches += 1
+                self._batched_rows += size
+                self._max_batch = max(self._max_batch, size)
+                bucket = 1 << (size - 1).bit_length()
+                self._batch_sizes[bucket] = self._batch_sizes.get(bucket, 0) + 1
+
+    # ---------- stats ----------
+    def stats(self):
+        with self._cond:
+            depth = len(self._queue)
+            inflight = self._inflight
+        with self._stats_lock:
+            return {
+                "queue_depth": depth,
+                "inflight": inflight,
+                "inline_scored": self._inline,
+                "batches": self._batches,
+                "batched_rows": self._batched_rows,
+                "mean_batch_size": (
+                    round(self._batched_rows / self._batches, 2) if self._batches else 0
+                ),
+                "max_batch_size": self._max_batch,
+                # batch-size histogram, keyed by power-of-two upper bound
+                "batch_size_histogram": {
+                    str(k): v for k, v in sorted(self._batch_sizes.items())
+                }
+            }
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
@@ -0,0 +1,329 @@
+import argparse, json, os, random, shutil, subprocess, sys, tempfile, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import numpy as np
+
+# -------------------------------
+# Replay benchmark
+# -------------------------------
+# python bench.py --mode asgi --requests 5000 --concurrency 16 --out results.json
+# python bench.py --mode http --workers 4 --storage sqlite
+# python bench.py --replay stream.ndjson
+#
+# Replays a transaction stream against the service and reports, per
+# endpoint, throughput and p50/p95/p99 latency as seen by the client.
+# "asgi" drives app.app in this process through Starlette's TestClient
+# (no sockets); "http" starts uvicorn on a local port. Both also report
+# the app's per-stage timings, grouped into persistence (store.*),
+# features.*, score.* and learn.*.
+#
+# Each run gets a fresh data directory seeded with --users synthetic
+# users, so results don't depend on (or modify) user_transactions.json.
+ACCOUNT_TYPES = [("student", 1000), ("salary", 15000), ("freelancer", 7000), ("business", 60000)]
+
+# -------------------------------
+# Workload
+# -------------------------------
+def make_seed(n_users, rng):
+    users = []
+    start = datetime(2026, 1, 1)
+    for i in range(n_users):
+        account_type, avg = ACCOUNT_TYPES[i % len(ACCOUNT_TYPES)]
+        history = [{
+            "amount": round(avg * rng.lognormvariate(0, 0.4)),
+            "device_id": f"dev_{i}_0",
+            "location": "INDIA",
+            "timestamp": (start + timedelta(hours=6 * k, minutes=i % 60)).isoformat()
+        } for k in range(rng.randint(1, 5))]
+        users.append({
+            "user_id": f"bench_{i:06d}",
+            "profile": {"account_type": account_type, "avg_amount": avg},
+            "history": history
+        })
+    return {"users": users}
+
+# user picked with Zipf-like weights 1 / rank^skew (0 = uniform)
+def synthetic_stream(seed, n, skew, rng):
+    users = seed["users"]
+    weights = [1 / (r + 1) ** skew for r in range(len(users))]
+    for u in rng.choices(users, weights=weights, k=n):
+        avg = u["profile"]["avg_amount"]
+        i = int(u["user_id"].split("_")[1])
+        spike = rng.random() < 0.05
+        yield {
+            "user_id": u["user_id"],
+            "amount": round(avg * (rng.uniform(3, 8) if spike else rng.lognormvariate(0, 0.5))),
+            "device_id": f"dev_{i}_{0 if rng.random() < 0.9 else rng.randint(1, 3)}"
+        }
+
+# NDJSON or a JSON list of {"user_id", "amount", "device_id"} objects;
+# users not in the seed are added to it
+def recorded_stream(path, seed):
+    with open(path) as f:
+        text = f.read()
+    rows = json.loads(text) if text.lstrip().startswith("[") else [
+        json.loads(line) for line in text.splitlines() if line.strip()
+    ]
+    known = {u["user_id"] for u in seed["users"]}
+    for r in rows:
+        if r["user_id"] not in known:
+            seed["users"].append({"user_id": r["user_id"], "history": []})
+            known.add(r["user_id"])
+    return rows
+
+# -------------------------------
+# Measurements
+# -------------------------------
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = {}
+        self.errors = {}
+
+    def add(self, name, seconds, ok=True):
+        with self._lock:
+            self.samples.setdefault(name, []).append(seconds)
+            if not ok:
+                self.errors[name] = self.errors.get(name, 0) + 1
+
+    def summary(self, wall):
+        out = {}
+        for name, values in sorted(self.samples.items()):
+            ms = np.array(values) * 1000
+            out[name] = {
+                "count": len(values),
+                "errors": self.errors.get(name, 0),
+                "throughput_rps": round(len(values) / wall, 1),
+                "mean_ms": round(float(ms.mean()), 3),
+                "p50_ms": round(float(np.percentile(ms, 50)), 3),
+                "p95_ms": round(float(np.percentile(ms, 95)), 3),
+                "p99_ms": round(float(np.percentile(ms, 99)), 3),
+                "total_ms": round(float(ms.sum()), 1)
+            }
+        return out
+
+# Stage timings come from the app's own fraud_stage_seconds histogram:
+# read directly in asgi mode, scraped from /metrics in http mode (with
+# several workers that is whichever worker answers the scrape). The app
+# never times a stage inside another, so a group's total is the sum of
+# its stages.
+def scrape_stages(text):
+    out = {}
+    for line in text.splitlines():
+        if not line.startswith(("fraud_stage_seconds_sum{", "fraud_stage_seconds_count{")):
+            continue
+        name, value = line.rsplit(" ", 1)
+        stage = name.split('stage="', 1)[1].split('"', 1)[0]
+        count, total = out.get(stage, (0, 0.0))
+        if name.startswith("fraud_stage_seconds_sum"):
+            total = float(value)
+        else:
+            count = int(float(value))
+        out[stage] = (count, total)
+    return {(stage,): v for stage, v in out.items()}
+
+def stage_summary(before, after):
+    stages, groups = {}, {}
+    for (stage,), (count, total) in sorted(after.items()):
+        count -= before.get((stage,), (0, 0.0))[0]
+        total -= before.get((stage,), (0, 0.0))[1]
+        if count <= 0:
+            continue
+        stages[stage] = {
+            "count": count,
+            "total_ms": round(total * 1000, 1),
+            "mean_ms": round(total * 1000 / count, 3)
+        }
+        group = stage.split(".")[0]
+        groups[group] = round(groups.get(group, 0) + total * 1000, 1)
+    return stages, groups
+
+# -------------------------------
+# Driver
+# -------------------------------
+# One closed-loop client per --concurrency thread. A transaction that
+# needs an OTP is verified with probability --otp-ratio, and decided with
+# probability --decision-ratio (approved with --approve-ratio when
+# verified, otherwise rejected). --read-ratio of the events also read
+# /pending and the user's /history.
+def run_events(client, events, args, recorder, seed):
+    rng = random.Random(seed)
+
+    def call(name, method, url, **kwargs):
+        start = time.perf_counter()
+        try:
+            r = getattr(client, method)(url, **kwargs)
+            ok = r.status_code < 400
+            body = r.json() if ok else None
+        except Exception:
+            ok, body = False, None
+        recorder.add(name, time.perf_counter() - start, ok)
+        return body
+
+    for e in events:
+        res = call("POST /transaction", "post", "/transaction", json=e)
+        if res and res.get("otp_required"):
+            form = {"user_id": e["user_id"], "transaction_id": res["transaction_id"]}
+            verified = rng.random() < args.otp_ratio
+            if verified:
+                call("POST /verify-otp", "post", "/verify-otp", data=dict(form, otp=res["otp"]))
+            if rng.random() < args.decision_ratio:
+                approve = verified and rng.random() < args.approve_ratio
+                call("POST /decision", "post", "/decision",
+                     data=dict(form, decision="APPROVE" if approve else "REJECT"))
+
+        if rng.random() < args.read_ratio:
+            call("GET /pending", "get", "/pending", params={"limit": 50})
+            call("GET /history", "get", f"/history/{e['user_id']}", params={"limit": 100})
+
+# make_client is called once per thread; own_clients says whether each
+# thread closes the client it got (not when they share one TestClient)
+def drive(make_client, stream, args, recorder, own_clients=True):
+    lock = threading.Lock()
+    it = iter(stream)
+
+    def events():
+        while True:
+            with lock:
+                e = next(it, None)
+            if e is None:
+                return
+            yield e
+
+    def worker(k):
+        client = make_client()
+        try:
+            run_events(client, events(), args, recorder, args.seed + k)
+        finally:
+            if own_clients:
+                client.close()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(args.concurrency) as ex:
+        list(ex.map(worker, range(args.concurrency)))
+    return time.perf_counter() - start
+
+def run_asgi(stream, args):
+    from fastapi.testclient import TestClient
+    import app as appmod
+
+    recorder = Recorder()
+    with TestClient(appmod.app) as c:
+        before = appmod.STAGE_SECONDS.totals()
+        wall = drive(lambda: c, stream, args, recorder, own_clients=False)
+        after = appmod.STAGE_SECONDS.totals()
+    return wall, recorder, stage_summary(before, after)
+
+def run_http(stream, args, env):
+    import httpx
+
+    port = args.port
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--port", str(port),
+         "--workers", str(args.workers), "--log-level", "warning"],
+        cwd=os.path.dirname(os.path.abspath(__file__)), env=env
+    )
+    try:
+        url = f"http://127.0.0.1:{port}"
+        deadline = time.time() + 60
+        while True:
+            try:
+                httpx.get(url + "/debug/batching", timeout=1)
+                break
+            except httpx.HTTPError:
+                if time.time() > deadline or proc.poll() is not None:
+                    raise SystemExit("uvicorn did not start")
+                time.sleep(0.2)
+
+        recorder = Recorder()
+        before = scrape_stages(httpx.get(url + "/metrics").text)
+        wall = drive(lambda: httpx.Client(base_url=url, timeout=30), stream, args, recorder)
+        after = scrape_stages(httpx.get(url + "/metrics").text)
+    finally:
+        proc.terminate()
+        proc.wait()
+    return wall, recorder, stage_summary(before, after)
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    p = argparse.ArgumentParser(description="Replay benchmark for the fraud service")
+    p.add_argument("--mode", choices=["asgi", "http"], default="asgi")
+    p.add_argument("--requests", type=int, default=2000, help="transactions to send")
+    p.add_argument("--concurrency", type=int, default=8)
+    p.add_argument("--users", type=int, default=1000)
+    p.add_argument("--skew", type=float, default=1.0, help="Zipf exponent for user choice")
+    p.add_argument("--otp-ratio", type=float, default=0.8)
+    p.add_argument("--decision-ratio", type=float, default=0.9)
+    p.add_argument("--approve-ratio", type=float, default=0.7)
+    p.add_argument("--read-ratio", type=float, default=0.05)
+    p.add_argument("--replay", help="NDJSON / JSON list of transactions to send instead")
+    p.add_argument("--storage", choices=["json", "log", "sqlite"], default="log")
+    p.add_argument("--workers", type=int, default=1, help="uvicorn workers (http mode)")
+    p.add_argument("--port", type=int, default=10099)
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--out", help="write results as JSON here")
+    args = p.parse_args()
+
+    rng = random.Random(args.seed)
+    seed = make_seed(args.users, rng)
+    if args.replay:
+        stream = recorded_stream(args.replay, seed)
+    else:
+        stream = list(synthetic_stream(seed, args.requests, args.skew, rng))
+
+    workdir = tempfile.mkdtemp(prefix="fraud-bench-")
+    try:
+        data_file = os.path.join(workdir, "user_transactions.json")
+        with open(data_file, "w") as f:
+            json.dump(seed, f)
+        env = dict(
+            os.environ,
+            FRAUD_DATA_FILE=data_file,
+            FRAUD_MODEL_DIR=os.path.join(workdir, "models"),
+            FRAUD_STORAGE=args.storage,
+            FRAUD_WORKERS=str(args.workers if args.mode == "http" else 1)
+        )
+
+        if args.mode == "asgi":
+            os.environ.update(env)
+            wall, recorder, stages = run_asgi(stream, args)
+        else:
+            wall, recorder, stages = run_http(stream, args, env)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    endpoints = recorder.summary(wall)
+    result = {
+        "commit": git_commit(),
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "config": {k: v for k, v in vars(args).items() if k != "out"},
+        "wall_seconds": round(wall, 3),
+        "throughput_rps": round(sum(e["count"] for e in endpoints.values()) / wall, 1),
+        "endpoints": endpoints,
+        "stages": stages[0],
+        "stage_totals_ms": stages[1]
+    }
+
+    print(f"{result['throughput_rps']} req/s over {result['wall_seconds']} s ({args.mode}, {args.storage})")
+    for name, e in endpoints.items():
+        print(f"  {name:20s} n={e['count']:6d} err={e['errors']:4d} "
+              f"p50={e['p50_ms']:8.2f} p95={e['p95_ms']:8.2f} p99={e['p99_ms']:8.2f} ms")
+    for group, ms in result["stage_totals_ms"].items():
+        print(f"  {group:20s} {ms:10.1f} ms total")
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
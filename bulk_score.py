@@ -0,0 +1,372 @@
+import argparse, json, os, pickle, shutil, sys, tempfile, time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+from crossuser import SHARED_DEVICE_KEYS, replay
+from features import FEATURE_KEYS, FeatureState, extract_features_batch
+from policy import load_policy
+from scoring import freeze_online, online_proba_many
+
+# -------------------------------
+# Offline bulk scoring
+# -------------------------------
+# python bulk_score.py transactions.csv scored.csv --workers 8
+# python bulk_score.py history.parquet scored.ndjson --profiles user_transactions.json
+#
+# Scores a file of historical transactions with the same features, models
+# and risk policy as POST /transaction, without the service:
+#
+#   1. the input is read in --chunk-rows chunks and each row is appended to
+#      one of --partitions spill files by a hash of its user_id
+#   2. the cross-user device features (crossuser.py) need every user's
+#      rows, so they are computed first, in one pass over all rows in
+#      timestamp order, into an array by row id
+#   3. a process pool scores whole partitions: rows are sorted by user and
+#      timestamp, and the k-th transaction of every user in the partition
+#      is featurized and scored as one vectorized batch, after the
+#      (k-1)-th has been committed to that user's FeatureState
+#   4. results are appended to the output as each partition finishes
+#
+# Input columns: user_id, amount, device_id, timestamp (ISO, naive = UTC),
+# optional location (default "INDIA") and fraud (0/1). Models are the
+# latest snapshot in FRAUD_MODEL_DIR and stay frozen for the run, as does
+# the risk policy (--policy, default FRAUD_POLICY_FILE; policy.py).
+#
+# Commits follow the service: approved rows are committed with fraud=0,
+# blocked rows with fraud=1. Rows the service would hold for OTP review
+# only enter the user's history if the input carries a fraud label (the
+# reviewer's decision); otherwise they are left out, as an undecided
+# pending transaction would be.
+STRING_COLUMNS = {"user_id": str, "device_id": str, "location": str}
+EPOCH = pd.Timestamp("1970-01-01", tz="UTC")
+
+# -------------------------------
+# Input / output formats
+# -------------------------------
+def _format(path):
+    ext = os.path.splitext(path)[1].lower()
+    if ext in (".csv", ".parquet"):
+        return ext[1:]
+    if ext in (".ndjson", ".jsonl", ".json"):
+        return "ndjson"
+    raise SystemExit(f"unsupported file type: {path} (use .csv, .ndjson/.jsonl or .parquet)")
+
+def _pyarrow():
+    try:
+        import pyarrow, pyarrow.parquet
+    except ImportError:
+        raise SystemExit("Parquet files need pyarrow (pip install pyarrow)")
+    return pyarrow
+
+def read_chunks(path, rows):
+    fmt = _format(path)
+    if fmt == "csv":
+        yield from pd.read_csv(path, chunksize=rows, dtype=STRING_COLUMNS)
+    elif fmt == "ndjson":
+        yield from pd.read_json(path, lines=True, chunksize=rows, dtype=STRING_COLUMNS)
+    else:
+        pa = _pyarrow()
+        for batch in pa.parquet.ParquetFile(path).iter_batches(batch_size=rows):
+            yield batch.to_pandas().astype({k: str for k in STRING_COLUMNS if k in batch.schema.names})
+
+class ResultWriter:
+    def __init__(self, path):
+        self.path = path
+        self.fmt = _format(path)
+        self._file = None
+        self._parquet = None
+        self.rows = 0
+
+    def write(self, df):
+        if self.fmt == "csv":
+            df.to_csv(self.path, mode="a" if self.rows else "w", header=not self.rows, index=False)
+        elif self.fmt == "ndjson":
+            if self._file is None:
+                self._file = open(self.path, "w")
+            df.to_json(self._file, orient="records", lines=True)
+            if not df.empty:
+                self._file.write("\n")
+        else:
+            pa = _pyarrow()
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            if self._parquet is None:
+                self._parquet = pa.parquet.ParquetWriter(self.path, table.schema)
+            self._parquet.write_table(table)
+        self.rows += len(df)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+        if self._parquet is not None:
+            self._parquet.close()
+
+# -------------------------------
+# Pass 1: partition by user
+# -------------------------------
+# Each spill file is a sequence of pickled DataFrame chunks. The
+# (user, device, time) of every row is also kept, for the device pass.
+def partition(input_path, workdir, partitions, chunk_rows):
+    paths = [os.path.join(workdir, f"part-{p:05d}.pkl") for p in range(partitions)]
+    files = {}
+    keys = []
+    offset = 0
+    try:
+        for chunk in read_chunks(input_path, chunk_rows):
+            missing = {"user_id", "amount", "device_id", "timestamp"} - set(chunk.columns)
+            if missing:
+                raise SystemExit(f"input is missing columns: {', '.join(sorted(missing))}")
+
+            chunk = chunk.reset_index(drop=True)
+            chunk.insert(0, "row_id", np.arange(offset, offset + len(chunk)))
+            offset += len(chunk)
+            keys.append(pd.DataFrame({
+                "epoch": _epochs(chunk["timestamp"]),
+                "user_id": chunk["user_id"].to_numpy(),
+                "device_id": chunk["device_id"].to_numpy()
+            }))
+
+            part = pd.util.hash_pandas_object(chunk["user_id"], index=False).to_numpy() % partitions
+            for p, rows in chunk.groupby(part, sort=False):
+                if p not in files:
+                    files[p] = open(paths[p], "wb")
+                pickle.dump(rows, files[p], protocol=pickle.HIGHEST_PROTOCOL)
+    finally:
+        for f in files.values():
+            f.close()
+    keys = pd.concat(keys, ignore_index=True) if keys else pd.DataFrame(
+        columns=["epoch", "user_id", "device_id"]
+    )
+    return [paths[p] for p in sorted(files)], offset, keys
+
+def _epochs(timestamps):
+    return (pd.to_datetime(timestamps, utc=True) - EPOCH).dt.total_seconds().to_numpy()
+
+def _read_partition(path):
+    chunks = []
+    with open(path, "rb") as f:
+        while True:
+            try:
+                chunks.append(pickle.load(f))
+            except EOFError:
+                break
+    return pd.concat(chunks, ignore_index=True)
+
+# -------------------------------
+# Device pass: cross-user features
+# -------------------------------
+# Rows are observed in (timestamp, row id) order, as the service would
+# observe them arriving; the result is a len(SHARED_DEVICE_KEYS) column
+# array indexed by row id, saved for the workers to memory-map.
+def device_pass(keys, path, half_life, max_devices, max_users):
+    epochs = keys["epoch"].to_numpy()
+    order = np.lexsort((np.arange(len(keys)), epochs))
+    np.save(path, replay(
+        keys["device_id"].to_numpy(), keys["user_id"].to_numpy(), epochs, order,
+        half_life, max_devices, max_users
+    ))
+    return path
+
+# -------------------------------
+# Pass 2: score a partition
+# -------------------------------
+_rf_engine = None
+_online_proba = None
+_profiles = {}
+_policy = None
+
+def _init_worker(engine, profiles_path, policy_path):
+    global _rf_engine, _online_proba, _profiles, _policy
+    from model import ModelRegistry
+    from config import MODEL_DIR
+    registry = ModelRegistry(MODEL_DIR, engine=engine)
+    _rf_engine = registry.rf_engine
+    online_model = registry.online_model
+    _online_proba = freeze_online(online_model) or (lambda X: online_proba_many(online_model, X))
+    _profiles = load_profiles(profiles_path)
+    _policy = load_policy(policy_path)
+
+def load_profiles(path):
+    if not path:
+        return {}
+    with open(path) as f:
+        data = json.load(f)
+    return {u["user_id"]: u["profile"] for u in data["users"] if "profile" in u}
+
+def score_partition(path, shared_path, with_features=False):
+    df = _read_partition(path)
+    if "location" not in df:
+        df["location"] = "INDIA"
+    has_labels = "fraud" in df
+    df["epoch"] = _epochs(df["timestamp"])
+    df = df.sort_values(["user_id", "epoch", "row_id"], kind="stable", ignore_index=True)
+
+    users = df["user_id"].to_numpy()
+    amounts = df["amount"].to_numpy(dtype=float)
+    devices = df["device_id"].to_numpy()
+    locations = df["location"].to_numpy()
+    timestamps = df["timestamp"].astype(str).to_numpy()
+    epochs = df["epoch"].to_numpy()
+    labels = df["fraud"].to_numpy() if has_labels else None
+    rank = df.groupby("user_id", sort=False).cumcount().to_numpy()
+    shared = np.load(shared_path, mmap_mode="r")[df["row_id"].to_numpy()]
+
+    # a user without a stored profile gets the one POST /transaction
+    # would create: avg_amount = their first amount
+    states, profiles = {}, {}
+    for i in np.flatnonzero(rank == 0):
+        states[users[i]] = FeatureState()
+        profiles[users[i]] = _profiles.get(users[i]) or {"avg_amount": amounts[i]}
+
+    n = len(df)
+    out_scores = np.zeros(n)
+    out_rf = np.zeros(n)
+    out_online = np.zeros(n)
+    out_flags = np.empty(n, dtype=object)
+    out_actions = np.empty(n, dtype=object)
+    out_X = np.zeros((n, len(FEATURE_KEYS))) if with_features else None
+
+    order = np.argsort(rank, kind="stable")
+    bounds = np.searchsorted(rank[order], np.arange(rank.max() + 2))
+    for k in range(len(bounds) - 1):
+        rows = order[bounds[k]:bounds[k + 1]]
+        transactions = [{
+            "amount": amounts[i],
+            "device_id": devices[i],
+            "location": locations[i],
+            "timestamp": timestamps[i]
+        } for i in rows]
+
+        X, metas = extract_features_batch(
+            transactions,
+            [profiles[users[i]] for i in rows],
+            [states[users[i]] for i in rows],
+            epochs[rows],
+            [dict(zip(SHARED_DEVICE_KEYS, shared[i])) for i in rows],
+            _policy.account_limits
+        )
+
+        blocked = X[:, FEATURE_KEYS.index("account_amount_flag")] == 1
+        scored = np.flatnonzero(~blocked)
+        scores = np.full(len(rows), 100.0)
+        flags = np.full(len(rows), "SEVERE", dtype=object)
+        actions = np.full(len(rows), "BLOCK", dtype=object)
+        rf = np.zeros(len(rows))
+        online = np.zeros(len(rows))
+        if len(scored):
+            Xs = X[scored]
+            rf[scored] = _rf_engine.predict_proba(Xs)[:, 1]
+            online[scored] = _online_proba(Xs)
+            avg = np.array([metas[j]["avg_amount"] for j in scored], dtype=float)
+            scores[scored], flags[scored], actions[scored] = _policy.evaluate(
+                Xs, rf[scored], online[scored], avg
+            )
+
+        out_scores[rows] = scores
+        out_rf[rows] = rf
+        out_online[rows] = online
+        out_flags[rows] = flags
+        out_actions[rows] = actions
+        if with_features:
+            out_X[rows] = X
+
+        # commit what the service would commit before the next round
+        for j, i in enumerate(rows):
+            if actions[j] == "OTP_REQUIRED":
+                if labels is None or pd.isna(labels[i]):
+                    continue
+                fraud = int(labels[i])
+            else:
+                fraud = 1 if actions[j] == "BLOCK" else 0
+            states[users[i]].update(dict(transactions[j], fraud=fraud), epochs[i])
+
+    result = pd.DataFrame({
+        "row_id": df["row_id"].to_numpy(),
+        "user_id": users,
+        "timestamp": timestamps,
+        "amount": df["amount"].to_numpy(),
+        "risk_score": out_scores,
+        "risk_flag": out_flags,
+        "action": out_actions,
+        "rf_probability": out_rf,
+        "online_probability": out_online
+    })
+    if with_features:
+        for c, key in enumerate(FEATURE_KEYS):
+            result[key] = out_X[:, c]
+    return result
+
+# -------------------------------
+# CLI
+# -------------------------------
+def main():
+    p = argparse.ArgumentParser(description="Score a transaction file offline")
+    p.add_argument("input", help=".csv, .ndjson/.jsonl or .parquet")
+    p.add_argument("output", help=".csv, .ndjson/.jsonl or .parquet")
+    p.add_argument("--workers", type=int, default=os.cpu_count())
+    p.add_argument("--partitions", type=int, default=0,
+                   help="user partitions (default: 4 per worker)")
+    p.add_argument("--chunk-rows", type=int, default=200000)
+    p.add_argument("--profiles", help="store JSON (user_transactions.json) to take profiles from")
+    p.add_argument("--engine", choices=["sklearn", "compiled"], default="compiled")
+    p.add_argument("--policy", help="risk policy file (default FRAUD_POLICY_FILE)")
+    p.add_argument("--features", action="store_true", help="also write the feature columns")
+    p.add_argument("--sort", action="store_true",
+                   help="write rows in input order (holds all results in memory)")
+    args = p.parse_args()
+
+    partitions = args.partitions or 4 * args.workers
+    workdir = tempfile.mkdtemp(prefix="bulk-score-")
+    start = time.perf_counter()
+    try:
+        paths, total, keys = partition(args.input, workdir, partitions, args.chunk_rows)
+        print(f"partitioned {total} rows into {len(paths)} files "
+              f"in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+
+        from config import (
+            DEVICE_INDEX_HALF_LIFE_S, DEVICE_INDEX_MAX_DEVICES, DEVICE_INDEX_MAX_USERS
+        )
+        shared_path = device_pass(
+            keys, os.path.join(workdir, "shared.npy"),
+            DEVICE_INDEX_HALF_LIFE_S, DEVICE_INDEX_MAX_DEVICES, DEVICE_INDEX_MAX_USERS
+        )
+        del keys
+        print(f"device index pass done at {time.perf_counter() - start:.1f}s", file=sys.stderr)
+
+        # make sure a snapshot exists before workers load it
+        from model import ModelRegistry
+        from config import MODEL_DIR, POLICY_FILE
+        ModelRegistry(MODEL_DIR, engine=args.engine).version
+        # and that the policy compiles
+        policy_path = args.policy or POLICY_FILE
+        load_policy(policy_path)
+
+        writer = ResultWriter(args.output)
+        held = []
+        try:
+            with ProcessPoolExecutor(
+                args.workers, initializer=_init_worker, initargs=(args.engine, args.profiles, policy_path)
+            ) as pool:
+                futures = [pool.submit(score_partition, path, shared_path, args.features) for path in paths]
+                for done, future in enumerate(as_completed(futures), 1):
+                    result = future.result()
+                    if args.sort:
+                        held.append(result)
+                    else:
+                        writer.write(result)
+                    print(f"\r{done}/{len(paths)} partitions", end="", file=sys.stderr)
+            if args.sort:
+                writer.write(pd.concat(held, ignore_index=True).sort_values("row_id"))
+        finally:
+            writer.close()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    elapsed = time.perf_counter() - start
+    print(f"\nscored {total} rows in {elapsed:.1f}s ({total / max(elapsed, 1e-9):.0f} rows/s)",
+          file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+import threading
+from collections import OrderedDict
+
+# -------------------------------
+# Conditional GETs and response cache
+# -------------------------------
+# Read endpoints (app.py) tag their response with the store's version of
+# the scope they read (storage.record_scopes): the ETag is
+# "<generation>-<version>", which changes with every mutation the
+# response could reflect. A request whose If-None-Match still holds it
+# gets a 304 without the data being read; otherwise the serialized body
+# is served from an LRU cache keyed by URL when it was built at the same
+# version, and built (and cached) when it wasn't. The version is read
+# before the data, so a body is never cached under a version older than
+# what it shows; at worst a body newer than its tag is rebuilt once.
+def make_etag(generation, version):
+    return f'"{generation}-{version}"'
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*" or tag.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+class ResponseCache:
+    def __init__(self, max_entries=1024, max_bytes=64 << 20):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # least recently used first
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+    def get(self, key, etag):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != etag:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, etag, body):
+        if self.max_entries <= 0 or len(body) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old[1])
+            self._entries[key] = (etag, body)
+            self._bytes += len(body)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, dropped) = self._entries.popitem(last=False)
+                self._bytes -= len(dropped)
+                self.evicted += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evicted": self.evicted
+            }
@@ -0,0 +1,106 @@
+import threading
+import numpy as np
+
+from features import FEATURE_KEYS
+from forest import CompiledForest
+
+# -------------------------------
+# Cascade fast path
+# -------------------------------
+# The risk score is the policy's (policy.py) 100 x (w_online online +
+# w_rf rf) plus its rules. The online model (linear) and the rules are
+# cheap; the forest is the expensive part. The first stage replaces the forest's output by
+# an upper bound and auto-approves when even that bound scores LOW:
+#
+#   rf_cap    the highest probability the forest can give any row inside
+#             SAFE_BOX, found by walking every branch the box can reach
+#             in every tree (recomputed whenever the forest changes)
+#   bound     policy.raw_scores(x, rf_cap, online, avg_amount)
+#
+# A row inside the box has rf <= rf_cap, and the score is monotone in rf
+# (policy weights are >= 0 and rules don't read rf), so bound <= max_score,
+# and no higher than the policy's LOW bound, guarantees the full ensemble
+# would also have flagged it LOW. Everything else is escalated unchanged.
+# How much traffic qualifies depends on how tight rf_cap is for the
+# current forest and how confident the online model is.
+
+# the "clearly safe" region, a repeat payment from the same device and
+# place at a normal pace, on a device no other user has touched: (low, high) per feature, unlisted ones are
+# unbounded; amount_ratio's ceiling is configurable. Each bound also
+# tightens rf_cap, by cutting off branches the box can't reach.
+def safe_box(max_amount_ratio):
+    return {
+        "device_change": (0, 0),
+        "location_change": (0, 0),
+        "rapid_txn": (0, 0),
+        "account_amount_flag": (0, 0),
+        "amount_ratio": (0, max_amount_ratio),
+        "txn_count_1m": (0, 1),
+        "txn_count_1h": (0, 3),
+        "distinct_devices_24h": (0, 1),
+        "device_users_24h": (0, 0)
+    }
+
+
+# the forest compares features as float32 (x <= threshold goes left), so
+# the box is rounded the same way; the per-tree maxima are summed in
+# estimator order like predict_proba, so the cap can't round below any
+# reachable prediction
+def forest_cap(forest, lo, hi):
+    lo = lo.astype(np.float32)
+    hi = hi.astype(np.float32)
+    best = []
+    for root in forest.roots:
+        top = 0.0
+        stack = [int(root)]
+        while stack:
+            node = stack.pop()
+            f = forest.feature[node]
+            if f < 0:
+                top = max(top, float(forest.proba[node, 1]))
+                continue
+            t = forest.threshold[node]
+            if lo[f] <= t:
+                stack.append(int(forest.left[node]))
+            if hi[f] > t:
+                stack.append(int(forest.right[node]))
+        best.append(top)
+    return float(np.cumsum(best)[-1] / len(forest.roots))
+
+
+class Cascade:
+    def __init__(self, max_amount_ratio=1.5, max_score=20.0):
+        self.max_score = max_score
+        self.box = safe_box(max_amount_ratio)
+        self.lo = np.full(len(FEATURE_KEYS), -np.inf)
+        self.hi = np.full(len(FEATURE_KEYS), np.inf)
+        for key, (low, high) in self.box.items():
+            self.lo[FEATURE_KEYS.index(key)] = low
+            self.hi[FEATURE_KEYS.index(key)] = high
+        self._lock = threading.Lock()
+        self._engine = None
+        self._cap = None
+
+    # cached per forest object; models swap the whole engine on change
+    def rf_cap(self, rf_engine):
+        with self._lock:
+            if rf_engine is not self._engine:
+                forest = (
+                    rf_engine if isinstance(rf_engine, CompiledForest)
+                    else CompiledForest.from_sklearn(rf_engine)
+                )
+                self._cap = forest_cap(forest, self.lo, self.hi)
+                self._engine = rf_engine
+            return self._cap
+
+    def in_box(self, X):
+        X32 = np.asarray(X, dtype=np.float32)
+        return ((X32 >= self.lo.astype(np.float32)) & (X32 <= self.hi.astype(np.float32))).all(axis=1)
+
+    # (approve mask, score upper bounds); rows outside the box get +inf
+    def check(self, X, online_probs, avg_amounts, rf_engine, policy):
+        X = np.asarray(X, dtype=float)
+        cap = self.rf_cap(rf_engine)
+        bounds = policy.raw_scores(X, np.full(len(X), cap), online_probs, avg_amounts)
+        bounds = np.where(self.in_box(X), bounds, np.inf)
+        return bounds <= min(self.max_score, policy.low_bound), bounds
@@ -0,0 +1,98 @@
+import fcntl, logging, os, threading
+
+log = logging.getLogger(__name__)
+
+# -------------------------------
+# Multi-worker model sync
+# -------------------------------
+# With several uvicorn workers every process scores with its own copy of
+# the online model, so labels can't be learned where they arrive. Instead
+# /decision appends them to the shared labels table (store.add_label) and
+# exactly one worker -- whoever holds the flock on MODEL_DIR/LEADER --
+# feeds them to its OnlineLearner and snapshots each published model.
+# The other workers poll for a newer snapshot and load it (the forest is
+# memory-mapped, so only the small online model is actually read).
+#
+# A snapshot records the last label it has learned (label_seq), so a
+# worker that takes over after the leader exits resumes right after it
+# and labels already in a snapshot are never applied twice.
+class ModelSync:
+    def __init__(self, registry, store, learner, interval_s=1.0, batch=256):
+        self.registry = registry
+        self.store = store
+        self.learner = learner
+        self.interval = interval_s
+        self.batch = batch
+
+        self._lock_file = None
+        self._next_seq = 0
+        self._refreshes = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="model-sync", daemon=True)
+        self._thread.start()
+
+    @property
+    def leader(self):
+        return self._lock_file is not None
+
+    def _try_lead(self):
+        os.makedirs(self.registry.root, exist_ok=True)
+        f = open(os.path.join(self.registry.root, "LEADER"), "a")
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            return False
+        self._lock_file = f
+        # start from the newest snapshot the previous leader left
+        self.registry.refresh()
+        self._next_seq = self.registry.label_seq
+        log.info("model sync: leading from label %d", self._next_seq)
+        return True
+
+    def _lead(self):
+        while True:
+            rows = self.store.labels_after(self._next_seq, self.batch)
+            for seq, x, y, w in rows:
+                self.learner.submit(x, y, seq, w)
+            if rows:
+                self._next_seq = rows[-1][0]
+            if len(rows) < self.batch:
+                break
+
+        # labels up to `saved` are in the snapshot written below
+        saved = self.registry.label_seq
+        self.registry.save()
+        self.store.prune_labels(saved)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                if self.leader or self._try_lead():
+                    self._lead()
+                elif self.registry.refresh():
+                    self._refreshes += 1
+            except Exception:
+                log.exception("model sync failed")
+
+    def stats(self):
+        return {
+            "role": "leader" if self.leader else "follower",
+            "pid": os.getpid(),
+            "label_seq": self.registry.label_seq,
+            "snapshot_refreshes": self._refreshes
+        }
+
+    # leadership is held until the last labels are applied and snapshotted,
+    # so the next leader resumes after them
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+        if self.leader:
+            self._lead()
+            self.learner.close()
+            saved = self.registry.label_seq
+            self.registry.save()
+            self.store.prune_labels(saved)
+            self._lock_file.close()
+            self._lock_file = None
@@ -0,0 +1,97 @@
+import fcntl, itertools, os, threading, time
+from contextlib import ExitStack, contextmanager
+from zlib import crc32
+
+# -------------------------------
+# Striped per-user locks
+# -------------------------------
+# A fixed pool of re-entrant locks; a user_id always maps to the same
+# stripe, so requests for one user run their read-score-commit sequence
+# one at a time while other users proceed in parallel. Two users can
+# share a stripe (then they just serialize); no lock is ever created or
+# freed per user. Batches take their stripes in index order, so two
+# batches touching the same users can't deadlock.
+#
+# With `path` (several workers) a stripe is also a one-byte range of that
+# file, locked with fcntl.lockf, so the stripe is held across processes:
+# every worker maps a user to the same byte. fcntl locks belong to the
+# process, not the thread, so the byte is locked by the outermost
+# acquisition and unlocked by the outermost release; the thread lock
+# keeps the process's other threads out in between.
+class _Stripe:
+    __slots__ = ("index", "rlock", "fd", "depth")
+
+    def __init__(self, index, fd):
+        self.index = index
+        self.rlock = threading.RLock()
+        self.fd = fd
+        self.depth = 0
+
+    def __enter__(self):
+        self.rlock.acquire()
+        if self.fd is not None and self.depth == 0:
+            try:
+                fcntl.lockf(self.fd, fcntl.LOCK_EX, 1, self.index)
+            except BaseException:
+                self.rlock.release()
+                raise
+        self.depth += 1
+        return self
+
+    def __exit__(self, *exc):
+        self.depth -= 1
+        try:
+            if self.fd is not None and self.depth == 0:
+                fcntl.lockf(self.fd, fcntl.LOCK_UN, 1, self.index)
+        finally:
+            self.rlock.release()
+
+
+class StripedLocks:
+    def __init__(self, stripes=64, path=None):
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644) if path else None
+        self.locks = [_Stripe(i, self._fd) for i in range(stripes)]
+
+    def _stripe(self, key):
+        return crc32(key.encode()) % len(self.locks)
+
+    def lock(self, key):
+        return self.locks[self._stripe(key)]
+
+    @contextmanager
+    def hold(self, *keys):
+        with ExitStack() as stack:
+            for i in sorted({self._stripe(k) for k in keys}):
+                stack.enter_context(self.locks[i])
+            yield
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+# -------------------------------
+# Transaction ids
+# -------------------------------
+# <user_id>_<ms since epoch, hex>-<pid, hex>-<sequence, hex>
+#
+# Unique without consulting the store: the (ms, sequence) pair never
+# repeats inside a process (the clock is clamped so it never goes
+# backwards and the sequence restarts only when the millisecond moves
+# on), and the pid separates worker processes running at the same time.
+# Ids sort by creation time.
+class TxnIds:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._last_ms = 0
+        self._seq = itertools.count()
+
+    def next(self, user_id):
+        with self._lock:
+            ms = max(int(time.time() * 1000), self._last_ms)
+            if ms != self._last_ms:
+                self._last_ms = ms
+                self._seq = itertools.count()
+            seq = next(self._seq)
+        return f"{user_id}_{ms:x}-{self._pid:x}-{seq:x}"
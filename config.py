@@ -0,0 +1,165 @@
+import os
+
+# -------------------------------
+# Processes
+# -------------------------------
+# uvicorn --workers; more than one needs FRAUD_STORAGE=sqlite (see app.py)
+WORKERS = int(os.environ.get("FRAUD_WORKERS", "1"))
+
+# lock stripes guarding per-user read-score-commit sequences (app.py)
+USER_LOCK_STRIPES = int(os.environ.get("FRAUD_USER_LOCK_STRIPES", "64"))
+
+# -------------------------------
+# Storage
+# -------------------------------
+DATA_FILE = os.environ.get("FRAUD_DATA_FILE", "user_transactions.json")
+
+# "json" rewrites DATA_FILE on every change (original behaviour),
+# "log" appends one record per change and snapshots in the background,
+# "sqlite" keeps users/history/pending in indexed tables (seeded from DATA_FILE)
+STORAGE_BACKEND = os.environ.get("FRAUD_STORAGE", "json")
+
+LOG_FILE = os.environ.get("FRAUD_LOG_FILE", DATA_FILE + ".log")
+SNAPSHOT_FILE = os.environ.get("FRAUD_SNAPSHOT_FILE", DATA_FILE + ".snapshot")
+
+# group commit: writers arriving within this window share one fsync
+LOG_COMMIT_WINDOW_MS = float(os.environ.get("FRAUD_LOG_COMMIT_WINDOW_MS", "2"))
+# compact (snapshot + truncate log) once this many records are in the log
+LOG_COMPACT_EVERY = int(os.environ.get("FRAUD_LOG_COMPACT_EVERY", "10000"))
+
+SQLITE_FILE = os.environ.get("FRAUD_SQLITE_FILE", os.path.splitext(DATA_FILE)[0] + ".db")
+# with several workers the per-user lock stripes are byte ranges of this
+# file, so they hold across processes (concurrency.py)
+USER_LOCK_FILE = os.environ.get("FRAUD_USER_LOCK_FILE", SQLITE_FILE + ".locks")
+
+# -------------------------------
+# Scoring
+# -------------------------------
+# risk policy (policy.py): weights, rules, flag bounds, actions and
+# account limits; a missing file is the built-in default. Checked for
+# changes every FRAUD_POLICY_RELOAD_S seconds (0 = only through
+# POST /debug/policy/reload)
+POLICY_FILE = os.environ.get("FRAUD_POLICY_FILE", "policy.json")
+POLICY_RELOAD_S = float(os.environ.get("FRAUD_POLICY_RELOAD_S", "2"))
+
+# coalesce concurrent /transaction model calls into micro-batches
+MICROBATCH = os.environ.get("FRAUD_MICROBATCH", "0") == "1"
+MICROBATCH_MAX_ROWS = int(os.environ.get("FRAUD_MICROBATCH_MAX_ROWS", "64"))
+MICROBATCH_WINDOW_MS = float(os.environ.get("FRAUD_MICROBATCH_WINDOW_MS", "2"))
+
+# "sklearn" calls RandomForestClassifier.predict_proba, "compiled" evaluates
+# the same forest from flat arrays (forest.py) with identical output
+# (with several workers the compiled forest is the default: its memory-mapped
+# snapshot arrays are shared by every process through the page cache)
+RF_ENGINE = os.environ.get("FRAUD_RF_ENGINE", "compiled" if WORKERS > 1 else "sklearn")
+
+# first-stage cascade (cascade.py): "off"; "shadow" scores everything with
+# the full ensemble and reports what the cascade would have decided; "on"
+# auto-approves provably LOW transactions without calling the forest
+CASCADE = os.environ.get("FRAUD_CASCADE", "off")
+CASCADE_MAX_AMOUNT_RATIO = float(os.environ.get("FRAUD_CASCADE_MAX_AMOUNT_RATIO", "1.5"))
+# approve when the score's upper bound is at most this (and never above
+# the policy's LOW bound, 20 by default)
+CASCADE_MAX_SCORE = float(os.environ.get("FRAUD_CASCADE_MAX_SCORE", "20"))
+
+# cross-user device index (crossuser.py): half-life of the per-user
+# activity weights, devices held in memory (json/log stores; sqlite keeps
+# the index in the database) and users kept per device
+DEVICE_INDEX_HALF_LIFE_S = float(os.environ.get("FRAUD_DEVICE_INDEX_HALF_LIFE_S", "3600"))
+DEVICE_INDEX_MAX_DEVICES = int(os.environ.get("FRAUD_DEVICE_INDEX_MAX_DEVICES", "100000"))
+DEVICE_INDEX_MAX_USERS = int(os.environ.get("FRAUD_DEVICE_INDEX_MAX_USERS", "64"))
+
+# shadow (challenger) models (shadow.py): "name=path,..." where path is a
+# model snapshot directory or a model root like MODEL_DIR. Each scored
+# transaction is queued for them after its response; a full queue drops
+# the row. Results go to FRAUD_SHADOW_LOG_DIR as compressed column files,
+# one per FRAUD_SHADOW_FLUSH_ROWS rows or FRAUD_SHADOW_FLUSH_S seconds.
+SHADOW_MODELS = os.environ.get("FRAUD_SHADOW_MODELS", "")
+SHADOW_LOG_DIR = os.environ.get("FRAUD_SHADOW_LOG_DIR", "shadow")
+SHADOW_QUEUE = int(os.environ.get("FRAUD_SHADOW_QUEUE", "10000"))
+SHADOW_BATCH = int(os.environ.get("FRAUD_SHADOW_BATCH", "256"))
+SHADOW_FLUSH_ROWS = int(os.environ.get("FRAUD_SHADOW_FLUSH_ROWS", "50000"))
+SHADOW_FLUSH_S = float(os.environ.get("FRAUD_SHADOW_FLUSH_S", "60"))
+
+# -------------------------------
+# Read caching
+# -------------------------------
+# serialized /history, /pending and /debug/users responses kept per
+# process, keyed by URL and the store version they were built at (0 = off;
+# ETag / If-None-Match work either way)
+RESPONSE_CACHE_ENTRIES = int(os.environ.get("FRAUD_RESPONSE_CACHE_ENTRIES", "1024"))
+RESPONSE_CACHE_MB = float(os.environ.get("FRAUD_RESPONSE_CACHE_MB", "64"))
+
+# pending review event stream (GET /pending/events, events.py): events
+# kept for resuming, seconds between keep-alive comments, and the longest
+# a stream stays open before the client reconnects with its cursor
+EVENTS_BUFFER = int(os.environ.get("FRAUD_EVENTS_BUFFER", "10000"))
+EVENTS_HEARTBEAT_S = float(os.environ.get("FRAUD_EVENTS_HEARTBEAT_S", "15"))
+EVENTS_MAX_STREAM_S = float(os.environ.get("FRAUD_EVENTS_MAX_STREAM_S", "300"))
+
+# -------------------------------
+# Pending expiry
+# -------------------------------
+# seconds an OTP transaction may wait for a decision, per risk flag
+# ("FLAG=seconds,..."; a flag left out, or 0, never expires; empty, the
+# default, turns expiry off). Expired entries go to history with decision
+# TIMEOUT and no fraud label.
+PENDING_TTL_S = {
+    flag.strip().upper(): float(ttl)
+    for flag, _, ttl in (
+        item.partition("=")
+        for item in os.environ.get("FRAUD_PENDING_TTL", "").split(",")
+        if item.strip()
+    )
+    if float(ttl) > 0
+}
+# timer wheel resolution and size (one rotation = tick x slots seconds)
+PENDING_WHEEL_TICK_S = float(os.environ.get("FRAUD_PENDING_WHEEL_TICK_S", "1"))
+PENDING_WHEEL_SLOTS = int(os.environ.get("FRAUD_PENDING_WHEEL_SLOTS", "1024"))
+# > 0: also teach the online model each timeout as a fraud label with this
+# sample weight (an abandoned OTP is weak evidence, not a reviewer's call)
+TIMEOUT_LABEL_WEIGHT = float(os.environ.get("FRAUD_TIMEOUT_LABEL_WEIGHT", "0"))
+
+# -------------------------------
+# Model snapshots
+# -------------------------------
+MODEL_DIR = os.environ.get("FRAUD_MODEL_DIR", "models")
+# seconds between snapshots of a changed online model (0 = only on shutdown)
+MODEL_SNAPSHOT_INTERVAL_S = float(os.environ.get("FRAUD_MODEL_SNAPSHOT_INTERVAL_S", "300"))
+MODEL_SNAPSHOT_KEEP = int(os.environ.get("FRAUD_MODEL_SNAPSHOT_KEEP", "5"))
+
+# "background" queues /decision labels for a learner thread that applies
+# mini-batches to a copy of the online model and swaps it in; "sync"
+# calls learn_one inside the request
+ONLINE_LEARNING = os.environ.get("FRAUD_ONLINE_LEARNING", "background")
+ONLINE_LEARNING_MAX_BATCH = int(os.environ.get("FRAUD_ONLINE_LEARNING_MAX_BATCH", "256"))
+ONLINE_LEARNING_INTERVAL_S = float(os.environ.get("FRAUD_ONLINE_LEARNING_INTERVAL_S", "1"))
+
+# forest retraining (retrain.py): every FRAUD_RETRAIN_INTERVAL_S seconds
+# (0 = only through POST /debug/retrain) a child process trains a new
+# forest on stored history with FRAUD_RETRAIN_JOBS cores (-1 = all) and
+# swaps it in if its ROC AUC on the newest FRAUD_RETRAIN_HOLDOUT of the
+# rows is at least the current forest's + FRAUD_RETRAIN_MIN_AUC_GAIN.
+# FRAUD_RETRAIN_LABELS=reviewed (the default) trains only on rows a
+# reviewer approved or rejected; "all" also uses the policy's own labels.
+RETRAIN_INTERVAL_S = float(os.environ.get("FRAUD_RETRAIN_INTERVAL_S", "3600"))
+RETRAIN_TREES = int(os.environ.get("FRAUD_RETRAIN_TREES", "100"))
+RETRAIN_JOBS = int(os.environ.get("FRAUD_RETRAIN_JOBS", "-1"))
+RETRAIN_HOLDOUT = float(os.environ.get("FRAUD_RETRAIN_HOLDOUT", "0.2"))
+RETRAIN_MIN_ROWS = int(os.environ.get("FRAUD_RETRAIN_MIN_ROWS", "200"))
+RETRAIN_MIN_AUC_GAIN = float(os.environ.get("FRAUD_RETRAIN_MIN_AUC_GAIN", "0"))
+RETRAIN_LABELS = os.environ.get("FRAUD_RETRAIN_LABELS", "reviewed")
+# niceness of the training process, so serving keeps the CPU it needs
+RETRAIN_NICE = int(os.environ.get("FRAUD_RETRAIN_NICE", "10"))
+
+# multi-worker: how often followers look for a newer model snapshot and the
+# leader drains the shared label queue
+MODEL_SYNC_INTERVAL_S = float(os.environ.get("FRAUD_MODEL_SYNC_INTERVAL_S", "1"))
+
+# -------------------------------
+# Profiling
+# -------------------------------
+# start the sampling profiler at boot (it can also be switched on at
+# runtime through /debug/profiler/start)
+PROFILER = os.environ.get("FRAUD_PROFILER", "0") == "1"
+PROFILER_INTERVAL_MS = float(os.environ.get("FRAUD_PROFILER_INTERVAL_MS", "5"))
@@ -0,0 +1,194 @@
+import threading, time
+from collections import OrderedDict
+
+import numpy as np
+
+# -------------------------------
+# Cross-user device index
+# -------------------------------
+# An inverted index device_id -> {user_id: (last_seen, weight)} over every
+# scored transaction (blocked and held ones included: a device that keeps
+# trying other accounts is the signal). `weight` is the user's transaction
+# count on the device with a half-life decay, so a burst an hour ago counts
+# half as much as one now. observe() returns the device's features for the
+# transaction and then records it, so a transaction never counts itself:
+#
+#   device_users_24h        other users seen on the device in the window
+#   device_new_shared       1 if the device is new to this user (not seen
+#                           with them in the window) but known to others
+#   device_shared_activity  decayed transaction count of those other users
+#
+# Both the lookup and the update touch one device's entries, at most
+# max_users of them, so a transaction costs O(max_users) whatever the
+# index size. Entries older than the window are dropped when their device
+# is touched; whole devices are evicted least recently observed first,
+# beyond max_devices or once their newest entry has left the window.
+SHARED_DEVICE_KEYS = ["device_users_24h", "device_new_shared", "device_shared_activity"]
+NO_SHARING = {"device_users_24h": 0, "device_new_shared": 0, "device_shared_activity": 0.0}
+
+DEVICE_INDEX_WINDOW = 86400
+
+def decayed(weight, last_seen, epoch, half_life):
+    return weight * 0.5 ** (max(epoch - last_seen, 0.0) / half_life)
+
+# features for `user_id` from one device's {user_id: (last_seen, weight)}
+def device_features(users, user_id, epoch, window, half_life):
+    since = epoch - window
+    others = 0
+    activity = 0.0
+    for uid, (last_seen, weight) in users.items():
+        if uid == user_id or last_seen <= since:
+            continue
+        others += 1
+        activity += decayed(weight, last_seen, epoch, half_life)
+    own = users.get(user_id)
+    new = own is None or own[0] <= since
+    return {
+        "device_users_24h": others,
+        "device_new_shared": int(new and others > 0),
+        "device_shared_activity": activity
+    }
+
+# (last_seen, weight) after one more transaction at `epoch`; a late
+# (out of order) transaction is decayed to the newer last_seen instead
+def bumped(entry, epoch, half_life):
+    if entry is None:
+        return epoch, 1.0
+    last_seen, weight = entry
+    if epoch >= last_seen:
+        return epoch, decayed(weight, last_seen, epoch, half_life) + 1.0
+    return last_seen, weight + decayed(1.0, epoch, last_seen, half_life)
+
+# user ids to drop from a device: out of the window, then the least
+# recently seen beyond max_users
+def stale_users(users, since, max_users):
+    drop = [uid for uid, (last_seen, _) in users.items() if last_seen <= since]
+    over = len(users) - len(drop) - max_users
+    if over == 1:
+        drop.append(min((e[0], uid) for uid, e in users.items() if e[0] > since)[1])
+    elif over > 1:
+        kept = sorted((e[0], uid) for uid, e in users.items() if e[0] > since)
+        drop += [uid for _, uid in kept[:over]]
+    return drop
+
+
+class DeviceIndex:
+    def __init__(self, half_life=3600.0, max_devices=100000, max_users=64,
+                 window=DEVICE_INDEX_WINDOW):
+        self.half_life = half_life
+        self.max_devices = max_devices
+        self.max_users = max_users
+        self.window = window
+        self._lock = threading.Lock()
+        # least recently observed first
+        self.devices = OrderedDict()
+        self.evicted = 0
+
+    def observe(self, device_id, user_id, epoch):
+        with self._lock:
+            users = self.devices.get(device_id)
+            if users is None:
+                users = self.devices[device_id] = {}
+            else:
+                self.devices.move_to_end(device_id)
+            features = device_features(users, user_id, epoch, self.window, self.half_life)
+
+            users[user_id] = bumped(users.get(user_id), epoch, self.half_life)
+            since = epoch - self.window
+            for uid in stale_users(users, since, self.max_users):
+                del users[uid]
+            self._evict(since)
+            return features
+
+    # the oldest devices go when over capacity; a couple more per call
+    # once everything they hold is out of the window
+    def _evict(self, since):
+        while len(self.devices) > self.max_devices:
+            self.devices.popitem(last=False)
+            self.evicted += 1
+        for _ in range(2):
+            device_id, users = next(iter(self.devices.items()))
+            if max(e[0] for e in users.values()) > since:
+                break
+            del self.devices[device_id]
+            self.evicted += 1
+
+    # rebuilt from (device_id, user_id, epoch) in time order, e.g. recent
+    # history at startup
+    def warm(self, rows):
+        with self._lock:
+            self.devices.clear()
+        n = 0
+        for device_id, user_id, epoch in rows:
+            self.observe(device_id, user_id, epoch)
+            n += 1
+        return n
+
+    def close(self):
+        pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                "backend": "memory",
+                "devices": len(self.devices),
+                "entries": sum(len(u) for u in self.devices.values()),
+                "evicted_devices": self.evicted
+            }
+
+
+# offline (bulk_score.py, retrain.py): the features of every row when the
+# rows are observed in `order`, as a len(rows) x len(SHARED_DEVICE_KEYS) array
+def replay(devices, users, epochs, order, half_life, max_devices, max_users):
+    index = DeviceIndex(half_life, max_devices, max_users)
+    out = np.zeros((len(devices), len(SHARED_DEVICE_KEYS)))
+    for i in order:
+        f = index.observe(devices[i], users[i], epochs[i])
+        out[i] = [f[k] for k in SHARED_DEVICE_KEYS]
+    return out
+
+
+# -------------------------------
+# Shared (SQLite) device index
+# -------------------------------
+# The same index as rows of the store's device_users table, for several
+# worker processes: each observe() reads the device's rows and upserts
+# this user's one (the (device_id, user_id) primary key keeps both to an
+# index range). Rows past the window are deleted every prune_interval_s
+# (by every worker; the DELETE is idempotent). Two workers updating the same (device, user) at the same
+# instant can lose one increment of its weight, which the decay forgets.
+class SqliteDeviceIndex:
+    def __init__(self, store, half_life=3600.0, max_users=64, window=DEVICE_INDEX_WINDOW,
+                 prune_interval_s=60.0):
+        self.store = store
+        self.half_life = half_life
+        self.max_users = max_users
+        self.window = window
+        self._stop = threading.Event()
+        self._thread = None
+        if prune_interval_s > 0:
+            self._thread = threading.Thread(
+                target=self._prune_loop, args=(prune_interval_s,),
+                name="device-index-prune", daemon=True
+            )
+            self._thread.start()
+
+    def observe(self, device_id, user_id, epoch):
+        users = self.store.device_users(device_id)
+        features = device_features(users, user_id, epoch, self.window, self.half_life)
+        users[user_id] = bumped(users.get(user_id), epoch, self.half_life)
+        drop = stale_users(users, epoch - self.window, self.max_users)
+        self.store.put_device_user(device_id, user_id, *users[user_id], drop=drop)
+        return features
+
+    def _prune_loop(self, interval):
+        while not self._stop.wait(interval):
+            self.store.prune_device_users(time.time() - self.window)
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def stats(self):
+        return {"backend": "sqlite", **self.store.device_index_stats()}
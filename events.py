@@ -0,0 +1,118 @@
+import asyncio, json, os, threading
+from collections import deque
+
+# -------------------------------
+# Pending review events
+# -------------------------------
+# An in-process feed of changes to the pending queue, for the SSE stream
+# in app.py. The request threads that change the queue publish:
+#
+#   pending_add      a transaction was held for review (a /pending item)
+#   pending_verify   its OTP was verified
+#   pending_resolve  it left the queue: decision APPROVE, REJECT or TIMEOUT
+#
+# Events are numbered and the last `capacity` are kept, so a client can
+# resume from the cursor "<generation>.<seq>" of the last event it saw. A
+# cursor this bus can't continue from (evicted, or from another process
+# or an earlier run) gets a reset instead: the client reloads /pending and
+# applies events from the reset's cursor. Every event is keyed by
+# transaction id and applying one twice is harmless, so the overlap
+# between a reload and the events around it doesn't matter.
+#
+# Subscribers are asyncio tasks (one per open stream): they wait on an
+# asyncio.Event that publish() sets through their loop, so an idle
+# stream doesn't hold a threadpool thread.
+class EventBus:
+    def __init__(self, capacity=10000):
+        self.generation = os.urandom(4).hex()
+        self._events = deque(maxlen=capacity)
+        self._seq = 0
+        self._lock = threading.Lock()
+        self._waiters = set()
+        self._closed = False
+        self.published = {}
+
+    def publish(self, kind, data):
+        with self._lock:
+            self._seq += 1
+            self._events.append((self._seq, kind, data))
+            self.published[kind] = self.published.get(kind, 0) + 1
+            waiters = list(self._waiters)
+        for loop, event in waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # the subscriber's loop has closed
+                pass
+
+    def cursor(self):
+        with self._lock:
+            return f"{self.generation}.{self._seq}"
+
+    # (events after `cursor`, None), or ([], reset cursor) when `cursor`
+    # can't be continued from here
+    def since(self, cursor):
+        generation, _, seq = (cursor or "").partition(".")
+        with self._lock:
+            current = f"{self.generation}.{self._seq}"
+            if generation != self.generation or not seq.isdigit():
+                return [], current
+            seq = int(seq)
+            first = self._events[0][0] if self._events else self._seq + 1
+            if seq > self._seq or seq < first - 1:
+                return [], current
+            # the newest events are at the end, so count back from there
+            n = len(self._events)
+            return [self._events[i] for i in range(n - (self._seq - seq), n)], None
+
+    # like since(), but waits up to `timeout` seconds for an event
+    async def next_events(self, cursor, timeout):
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self._lock:
+            self._waiters.add(waiter)
+        try:
+            events, reset = self.since(cursor)
+            if events or reset or self._closed:
+                return events, reset
+            try:
+                await asyncio.wait_for(waiter[1].wait(), timeout)
+            except asyncio.TimeoutError:
+                return [], None
+            return self.since(cursor)
+        finally:
+            with self._lock:
+                self._waiters.discard(waiter)
+
+    # wakes every subscriber; streams end once they see `closed`
+    def close(self):
+        with self._lock:
+            self._closed = True
+            waiters = list(self._waiters)
+        for loop, event in waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                pass
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def stats(self):
+        with self._lock:
+            return {
+                "cursor": f"{self.generation}.{self._seq}",
+                "buffered": len(self._events),
+                "capacity": self._events.maxlen,
+                "waiting_streams": len(self._waiters),
+                "published": dict(self.published)
+            }
+
+
+def format_sse(kind, data, event_id=None):
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {kind}")
+    lines.append("data: " + json.dumps(data, separators=(",", ":")))
+    return "\n".join(lines) + "\n\n"
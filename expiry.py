@@ -0,0 +1,130 @@
+import logging, math, threading, time
+
+log = logging.getLogger(__name__)
+
+# -------------------------------
+# Hashed timer wheel
+# -------------------------------
+# `slots` buckets of `tick` seconds. A deadline hashes to the bucket of
+# the tick it falls due in, so schedule and cancel are O(1) dict
+# operations. advance() visits only the buckets whose ticks have passed
+# and fires the entries that are due; an entry more than one rotation
+# (tick x slots) away shares its bucket with nearer ones and is simply
+# skipped until its own tick comes round. Not thread-safe on its own.
+class TimerWheel:
+    def __init__(self, tick=1.0, slots=1024, now=None):
+        self.tick = tick
+        self.slots = [{} for _ in range(slots)]
+        # key -> bucket index, for cancel
+        self.where = {}
+        # last tick advance() has processed
+        self.current = int((time.time() if now is None else now) // tick)
+
+    def schedule(self, key, deadline, value):
+        self.cancel(key)
+        # due on the first tick at or after the deadline; overdue entries
+        # fire on the next advance
+        due = max(math.ceil(deadline / self.tick), self.current + 1)
+        i = due % len(self.slots)
+        self.slots[i][key] = (due, value)
+        self.where[key] = i
+
+    def cancel(self, key):
+        i = self.where.pop(key, None)
+        if i is None:
+            return None
+        return self.slots[i].pop(key)[1]
+
+    # (key, value) for every entry due by `now`
+    def advance(self, now):
+        target = int(now // self.tick)
+        if target <= self.current:
+            return []
+        # a gap of a full rotation or more visits every bucket once
+        ticks = range(self.current + 1, target + 1)[-len(self.slots):]
+        fired = []
+        for t in ticks:
+            bucket = self.slots[t % len(self.slots)]
+            if not bucket:
+                continue
+            for key in [k for k, (due, _) in bucket.items() if due <= target]:
+                fired.append((key, bucket.pop(key)[1]))
+                del self.where[key]
+        self.current = target
+        return fired
+
+    def __len__(self):
+        return len(self.where)
+
+# -------------------------------
+# Pending transaction expiry
+# -------------------------------
+# Every OTP transaction put in pending is tracked with its deadline
+# (created + the TTL for its risk flag) and untracked when a reviewer
+# decides it. A thread advances the wheel once per tick and hands each
+# expired transaction to `expire(user_id, txn_id)`, which pops it from
+# the store and records the timeout (see app.expire_pending); it returns
+# False when someone else already decided the transaction, e.g. another
+# worker process.
+class PendingExpiry:
+    def __init__(self, ttls, expire, tick_s=1.0, slots=1024):
+        self.ttls = ttls
+        self.expire = expire
+        self.wheel = TimerWheel(tick_s, slots)
+        self._lock = threading.Lock()
+        self._expired = 0
+        self._gone = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="pending-expiry", daemon=True)
+        self._thread.start()
+
+    # epoch seconds the transaction expires at, None when its flag has no TTL
+    def deadline(self, risk_flag, created):
+        ttl = self.ttls.get(risk_flag)
+        return None if ttl is None else created + ttl
+
+    def track(self, user_id, txn_id, expires_at):
+        if expires_at is None:
+            return
+        with self._lock:
+            self.wheel.schedule(txn_id, expires_at, user_id)
+
+    def untrack(self, txn_id):
+        with self._lock:
+            self.wheel.cancel(txn_id)
+
+    # pending entries already in the store at startup; entries written
+    # before TTLs existed get a full TTL from now
+    def track_existing(self, pending):
+        now = time.time()
+        for user_id, txn_id, entry in pending:
+            expires_at = entry.get("expires_at")
+            if expires_at is None:
+                expires_at = self.deadline(entry["risk_flag"], now)
+            self.track(user_id, txn_id, expires_at)
+
+    def _run(self):
+        while not self._stop.wait(self.wheel.tick):
+            with self._lock:
+                due = self.wheel.advance(time.time())
+            for txn_id, user_id in due:
+                try:
+                    if self.expire(user_id, txn_id):
+                        self._expired += 1
+                    else:
+                        self._gone += 1
+                except Exception:
+                    log.exception("failed to expire pending transaction %s", txn_id)
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+
+    def stats(self):
+        with self._lock:
+            tracked = len(self.wheel)
+        return {
+            "tracked": tracked,
+            "expired": self._expired,
+            "already_decided": self._gone
+        }
@@ -1,35 +1,283 @@
-from datetime import datetime
+import math
+from datetime import datetime, timezone
+import numpy as np
+
+from crossuser import NO_SHARING, SHARED_DEVICE_KEYS
+from history import CODES, DEVICES, History
 
 # -------------------------------
 # Account limits by type
 # -------------------------------
+# The defaults; the risk policy (policy.py) passes its own. Keys are
+# lowercase and a profile's account_type is matched case-insensitively
+# ("default" covers types that aren't listed).
 ACCOUNT_LIMITS = {
-    "SAVINGS": 50000,
-    "CURRENT": 200000,
-    "PREMIUM": 500000,
-    "STUDENT": 20000
+    "default": 50000,
+    "savings": 50000,
+    "current": 200000,
+    "premium": 500000,
+    "student": 20000
 }
 
-def extract_features(transaction, user):
-    history = user.get("history", [])
-    profile = user.get("profile", {})
+def account_limit(account_type, limits=None):
+    limits = limits or ACCOUNT_LIMITS
+    return limits.get(str(account_type).lower(), limits["default"])
+
+# Model input order (rf_model columns)
+FEATURE_KEYS = [
+    "amount",
+    "txn_velocity",
+    "device_change",
+    "location_change",
+    "amount_ratio",
+    "account_amount_flag",
+    "rapid_txn",
+    "txn_count_1m",
+    "amount_sum_1m",
+    "txn_count_1h",
+    "amount_sum_1h",
+    "txn_count_24h",
+    "amount_sum_24h",
+    "distinct_devices_24h",
+    "device_users_24h",
+    "device_new_shared",
+    "device_shared_activity"
+]
+
+# smoothing for the inter-arrival EWMA
+INTERARRIVAL_ALPHA = 0.3
+
+# sliding velocity windows: (suffix, span in seconds, ring buffer buckets)
+VELOCITY_WINDOWS = [
+    ("1m", 60, 12),
+    ("1h", 3600, 60),
+    ("24h", 86400, 48)
+]
+DEVICE_WINDOW = 86400
+# history older than this before a user's latest transaction no longer
+# affects any window or the device map
+STATE_HORIZON = max(
+    [span + span / buckets for _, span, buckets in VELOCITY_WINDOWS] + [DEVICE_WINDOW]
+)
+
+WINDOW_KEYS = [
+    k for suffix, _, _ in VELOCITY_WINDOWS
+    for k in (f"txn_count_{suffix}", f"amount_sum_{suffix}")
+] + ["distinct_devices_24h"]
+
+# -------------------------------
+# Timestamps
+# -------------------------------
+# Naive ISO timestamps (what the service writes) are UTC.
+def to_epoch(ts):
+    if isinstance(ts, str):
+        ts = datetime.fromisoformat(ts)
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return ts.timestamp()
+
+# -------------------------------
+# Time-bucketed ring buffer
+# -------------------------------
+# Transaction count and amount sum over the last `span` seconds, kept in
+# `buckets` slots of span/buckets seconds each. A slot is recycled when a
+# newer bucket maps onto it, so add and totals are O(buckets) and the
+# window edge is accurate to one bucket.
+class WindowCounter:
+    __slots__ = ("width", "n", "ids", "counts", "sums")
+
+    def __init__(self, span, buckets):
+        self.width = span / buckets
+        self.n = buckets
+        self.ids = [-1] * buckets
+        self.counts = [0] * buckets
+        self.sums = [0.0] * buckets
+
+    def add(self, epoch, amount):
+        b = int(epoch // self.width)
+        slot = b % self.n
+        if b > self.ids[slot]:
+            self.ids[slot] = b
+            self.counts[slot] = 0
+            self.sums[slot] = 0.0
+        elif b < self.ids[slot]:
+            # older than anything the window still covers
+            return
+        self.counts[slot] += 1
+        self.sums[slot] += amount
+
+    def totals(self, epoch):
+        b = int(epoch // self.width)
+        count = 0
+        total = 0.0
+        for i, c, s in zip(self.ids, self.counts, self.sums):
+            if b - self.n < i <= b:
+                count += c
+                total += s
+        return count, total
+
+# -------------------------------
+# Per-user feature state
+# -------------------------------
+# Everything extract_features needs about a user's past, updated in O(1)
+# each time a transaction is committed to history. The amount statistics
+# skip transactions labelled fraud so a blocked attempt doesn't drag the
+# user's baseline up, and OTP transactions that expired undecided
+# (decision TIMEOUT, no label), which nobody vouched for either.
+TIMEOUT = "TIMEOUT"
+
+def in_baseline(transaction):
+    return transaction.get("fraud", 0) != 1 and transaction.get("decision") != TIMEOUT
+
+class FeatureState:
+    __slots__ = (
+        "count", "last_ts", "last_device", "last_location",
+        "amount_n", "amount_mean", "amount_m2", "interarrival_ewma",
+        "windows", "devices"
+    )
+
+    def __init__(self):
+        self.count = 0
+        self.last_ts = None
+        self.last_device = None
+        self.last_location = None
+        self.amount_n = 0
+        self.amount_mean = 0.0
+        self.amount_m2 = 0.0
+        self.interarrival_ewma = None
+        self.windows = [WindowCounter(span, buckets) for _, span, buckets in VELOCITY_WINDOWS]
+        # device_id -> last seen epoch, pruned to DEVICE_WINDOW
+        self.devices = {}
+
+    # Rebuilt from a user's stored history (a history.History, or any
+    # iterable of history dicts) with column arithmetic instead of one
+    # update() per row: count, amount statistics and the inter-arrival
+    # EWMA come from whole columns, and only rows inside STATE_HORIZON of
+    # the latest one are replayed into the windows and the device map,
+    # since nothing older is still counted.
+    @classmethod
+    def from_history(cls, history):
+        if not isinstance(history, History):
+            history = History(history)
+        state = cls()
+        n = len(history)
+        if not n:
+            return state
+
+        epochs = history.epochs()
+        amounts = history.amounts()
+        state.count = n
+        state.last_ts = float(epochs[-1])
+        last = history.row(n - 1)
+        state.last_device = last["device_id"]
+        state.last_location = last["location"]
+
+        if n > 1:
+            gaps = np.diff(epochs)
+            decay = (1 - INTERARRIVAL_ALPHA) ** np.arange(n - 2, -1, -1)
+            weights = INTERARRIVAL_ALPHA * decay
+            weights[0] = decay[0]
+            state.interarrival_ewma = float(gaps @ weights)
+
+        keep = history.fraud_labels() != 1
+        timeout = CODES.ids.get(TIMEOUT)
+        if timeout is not None:
+            keep &= history.decision_codes() != timeout
+        clean = amounts[keep]
+        if len(clean):
+            state.amount_n = len(clean)
+            state.amount_mean = float(clean.mean())
+            state.amount_m2 = float(((clean - state.amount_mean) ** 2).sum())
+
+        start = int(np.searchsorted(epochs, state.last_ts - STATE_HORIZON, side="right"))
+        tail = zip(
+            epochs[start:].tolist(), amounts[start:].tolist(), history.device_ids()[start:].tolist()
+        )
+        for epoch, amount, device in tail:
+            for w in state.windows:
+                w.add(epoch, amount)
+            d = DEVICES.values[device]
+            state.devices[d] = max(epoch, state.devices.get(d, epoch))
+        cutoff = state.last_ts - DEVICE_WINDOW
+        state.devices = {d: seen for d, seen in state.devices.items() if seen > cutoff}
+        return state
+
+    def update(self, transaction, epoch=None):
+        if epoch is None:
+            epoch = to_epoch(transaction["timestamp"])
+
+        self.count += 1
+
+        # "last" is the latest by timestamp, matching history order, so a
+        # pending transaction decided later doesn't move it backwards
+        if self.last_ts is None or epoch >= self.last_ts:
+            if self.last_ts is not None:
+                gap = epoch - self.last_ts
+                if self.interarrival_ewma is None:
+                    self.interarrival_ewma = gap
+                else:
+                    self.interarrival_ewma += INTERARRIVAL_ALPHA * (gap - self.interarrival_ewma)
+
+            self.last_ts = epoch
+            self.last_device = transaction["device_id"]
+            self.last_location = transaction["location"]
+
+        for w in self.windows:
+            w.add(epoch, transaction["amount"])
+
+        device_id = transaction["device_id"]
+        self.devices[device_id] = max(epoch, self.devices.get(device_id, epoch))
+        cutoff = self.last_ts - DEVICE_WINDOW
+        for d in [d for d, seen in self.devices.items() if seen <= cutoff]:
+            del self.devices[d]
+
+        if in_baseline(transaction):
+            # Welford running mean / variance
+            self.amount_n += 1
+            delta = transaction["amount"] - self.amount_mean
+            self.amount_mean += delta / self.amount_n
+            self.amount_m2 += delta * (transaction["amount"] - self.amount_mean)
+
+    @property
+    def amount_std(self):
+        return math.sqrt(self.amount_m2 / self.amount_n) if self.amount_n > 1 else 0.0
+
+    # activity before `epoch`, not counting the transaction being scored
+    def window_features(self, epoch):
+        out = {}
+        for (suffix, _, _), w in zip(VELOCITY_WINDOWS, self.windows):
+            out[f"txn_count_{suffix}"], out[f"amount_sum_{suffix}"] = w.totals(epoch)
 
+        cutoff = epoch - DEVICE_WINDOW
+        out["distinct_devices_24h"] = sum(1 for seen in self.devices.values() if seen > cutoff)
+        return out
+
+    def avg_amount(self, profile, default):
+        if self.amount_n:
+            return self.amount_mean
+        return profile.get("avg_amount", default)
+
+# -------------------------------
+# Feature extraction
+# -------------------------------
+# `shared` is the device's cross-user features (crossuser.py), observed
+# by the caller; without them the device counts as used by no one else.
+# `limits` are the policy's account limits (default ACCOUNT_LIMITS).
+def extract_features(transaction, profile, state, epoch, shared=None, limits=None):
     account_type = profile.get("account_type", "SAVINGS")
-    limit = ACCOUNT_LIMITS.get(account_type, 50000)
+    limit = account_limit(account_type, limits)
 
     amount = transaction["amount"]
     device_id = transaction["device_id"]
     location = transaction["location"]
-    timestamp = datetime.fromisoformat(transaction["timestamp"])
 
     # -------------------------------
     # Velocity
     # -------------------------------
     txn_velocity = 0
     rapid_txn = 0
-    if history:
-        last_time = datetime.fromisoformat(history[-1]["timestamp"])
-        diff = (timestamp - last_time).total_seconds()
+    if state.count:
+        diff = epoch - state.last_ts
         txn_velocity = diff
         rapid_txn = 1 if diff < 60 else 0
 
@@ -37,20 +285,20 @@ def extract_features(transaction, user):
     # Device change
     # -------------------------------
     device_change = 0
-    if history:
-        device_change = 1 if history[-1]["device_id"] != device_id else 0
+    if state.count:
+        device_change = 1 if state.last_device != device_id else 0
 
     # -------------------------------
     # Location change
     # -------------------------------
     location_change = 0
-    if history:
-        location_change = 1 if history[-1]["location"] != location else 0
+    if state.count:
+        location_change = 1 if state.last_location != location else 0
 
     # -------------------------------
     # Amount ratio
     # -------------------------------
-    avg_amount = profile.get("avg_amount", amount)
+    avg_amount = state.avg_amount(profile, amount)
     amount_ratio = amount / avg_amount if avg_amount > 0 else 1
 
     # -------------------------------
@@ -66,9 +314,104 @@ def extract_features(transaction, user):
         "amount_ratio": amount_ratio,
         "rapid_txn": rapid_txn,
         "account_amount_flag": account_amount_exceeded,
+        **state.window_features(epoch),
+        **(shared or NO_SHARING),
 
         "_meta": {
             "account_type": account_type,
-            "account_limit": limit
+            "account_limit": limit,
+            "avg_amount": avg_amount
         }
     }
+
+# -------------------------------
+# Batch version
+# -------------------------------
+# Same features as extract_features for N (transaction, profile, state)
+# rows at once, as an N x len(FEATURE_KEYS) matrix.
+def extract_features_batch(transactions, profiles, states, epochs, shared=None, limits=None):
+    n = len(transactions)
+    has_prev = np.array([s.count > 0 for s in states], dtype=bool)
+
+    amount = np.array([t["amount"] for t in transactions], dtype=float)
+    epoch = np.asarray(epochs, dtype=float)
+    device = np.array([t["device_id"] for t in transactions], dtype=object)
+    location = np.array([t["location"] for t in transactions], dtype=object)
+
+    # rows without history compare against themselves -> no change
+    prev_epoch = np.where(
+        has_prev, np.array([s.last_ts if s.count else 0.0 for s in states], dtype=float), epoch
+    )
+    prev_device = np.array([
+        s.last_device if s.count else t["device_id"] for s, t in zip(states, transactions)
+    ], dtype=object)
+    prev_location = np.array([
+        s.last_location if s.count else t["location"] for s, t in zip(states, transactions)
+    ], dtype=object)
+
+    # -------------------------------
+    # Velocity / change flags
+    # -------------------------------
+    txn_velocity = epoch - prev_epoch
+    rapid_txn = has_prev & (txn_velocity < 60)
+    device_change = device != prev_device
+    location_change = location != prev_location
+
+    # -------------------------------
+    # Amount ratio / hard limit
+    # -------------------------------
+    avg_amount = np.array([
+        s.avg_amount(p, t["amount"]) for s, p, t in zip(states, profiles, transactions)
+    ], dtype=float)
+    amount_ratio = np.ones(n)
+    np.divide(amount, avg_amount, out=amount_ratio, where=avg_amount > 0)
+
+    account_types = [p.get("account_type", "SAVINGS") for p in profiles]
+    limit = np.array([account_limit(a, limits) for a in account_types], dtype=float)
+    account_amount_flag = amount > limit
+
+    # -------------------------------
+    # Sliding windows
+    # -------------------------------
+    windows = [s.window_features(e) for s, e in zip(states, epoch)]
+    shared = shared or [NO_SHARING] * n
+
+    columns = {
+        "amount": amount,
+        "txn_velocity": txn_velocity,
+        "device_change": device_change,
+        "location_change": location_change,
+        "amount_ratio": amount_ratio,
+        "account_amount_flag": account_amount_flag,
+        "rapid_txn": rapid_txn,
+        **{k: np.array([w[k] for w in windows], dtype=float) for k in WINDOW_KEYS},
+        **{k: np.array([d[k] for d in shared], dtype=float) for k in SHARED_DEVICE_KEYS}
+    }
+    X = np.column_stack([columns[k].astype(float) for k in FEATURE_KEYS])
+
+    metas = [
+        {"account_type": a, "account_limit": int(l), "avg_amount": float(avg)}
+        for a, l, avg in zip(account_types, limit, avg_amount)
+    ]
+    return X, metas
+
+def features_from_row(row, meta, amount):
+    f = dict(zip(FEATURE_KEYS, (float(v) for v in row)))
+    return {
+        "amount": amount,
+        "txn_velocity": f["txn_velocity"],
+        "device_change": int(f["device_change"]),
+        "location_change": int(f["location_change"]),
+        "amount_ratio": f["amount_ratio"],
+        "rapid_txn": int(f["rapid_txn"]),
+        "account_amount_flag": int(f["account_amount_flag"]),
+        **{
+            k: f[k] if k.startswith("amount_sum") else int(f[k])
+            for k in WINDOW_KEYS
+        },
+        "device_users_24h": int(f["device_users_24h"]),
+        "device_new_shared": int(f["device_new_shared"]),
+        "device_shared_activity": f["device_shared_activity"],
+
+        "_meta": meta
+    }
@@ -0,0 +1,167 @@
+import json, os, time
+import numpy as np
+
+# -------------------------------
+# Compiled RandomForest evaluator
+# -------------------------------
+# All trees of a fitted RandomForestClassifier flattened into contiguous
+# node arrays (child indices are absolute, leaves have feature == -1).
+# Traversal advances every (row, tree) pair one level per step, so a
+# prediction is max_depth vectorized steps with no per-call validation
+# or joblib dispatch.
+#
+# Probabilities are bit-identical to sklearn: inputs are compared as
+# float32 like sklearn's tree code, leaf class counts are normalized the
+# same way, and trees are summed in estimator order (cumsum, not the
+# pairwise np.sum) before dividing by the number of trees.
+class CompiledForest:
+    def __init__(self, feature, threshold, left, right, proba, roots, max_depth, classes):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.proba = proba
+        self.roots = roots
+        self.max_depth = max_depth
+        self.classes_ = classes
+
+    @classmethod
+    def from_sklearn(cls, rf):
+        feature, threshold, left, right, proba, roots = [], [], [], [], [], []
+        offset = 0
+        max_depth = 0
+        n_classes = len(rf.classes_)
+
+        for est in rf.estimators_:
+            t = est.tree_
+            is_leaf = t.children_left < 0
+
+            feature.append(np.where(is_leaf, -1, t.feature))
+            threshold.append(t.threshold)
+            left.append(np.where(is_leaf, -1, t.children_left + offset))
+            right.append(np.where(is_leaf, -1, t.children_right + offset))
+
+            value = t.value[:, 0, :n_classes].astype(np.float64)
+            normalizer = value.sum(axis=1, keepdims=True)
+            normalizer[normalizer == 0.0] = 1.0
+            proba.append(value / normalizer)
+
+            roots.append(offset)
+            offset += t.node_count
+            max_depth = max(max_depth, t.max_depth)
+
+        return cls(
+            feature=np.ascontiguousarray(np.concatenate(feature), dtype=np.intp),
+            threshold=np.ascontiguousarray(np.concatenate(threshold), dtype=np.float64),
+            left=np.ascontiguousarray(np.concatenate(left), dtype=np.intp),
+            right=np.ascontiguousarray(np.concatenate(right), dtype=np.intp),
+            proba=np.ascontiguousarray(np.concatenate(proba)),
+            roots=np.array(roots, dtype=np.intp),
+            max_depth=max_depth,
+            classes=rf.classes_
+        )
+
+    # ---------- persistence ----------
+    # One .npy per array; load() memory-maps them, so startup reads no
+    # tree data and processes loading the same snapshot share its pages.
+    ARRAYS = ("feature", "threshold", "left", "right", "proba", "roots", "classes_")
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        for name in self.ARRAYS:
+            np.save(os.path.join(path, f"{name}.npy"), getattr(self, name))
+        with open(os.path.join(path, "forest.json"), "w") as f:
+            json.dump({"max_depth": int(self.max_depth)}, f)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        arrays = {
+            name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r" if mmap else None)
+            for name in cls.ARRAYS
+        }
+        with open(os.path.join(path, "forest.json")) as f:
+            meta = json.load(f)
+        return cls(
+            feature=arrays["feature"],
+            threshold=arrays["threshold"],
+            left=arrays["left"],
+            right=arrays["right"],
+            proba=arrays["proba"],
+            roots=arrays["roots"],
+            max_depth=meta["max_depth"],
+            classes=arrays["classes_"]
+        )
+
+    def apply(self, X):
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+
+        n = X.shape[0]
+        rows = np.repeat(np.arange(n), len(self.roots)).reshape(n, -1)
+        node = np.broadcast_to(self.roots, rows.shape).copy()
+
+        for _ in range(self.max_depth):
+            f = self.feature[node]
+            leaf = f < 0
+            if leaf.all():
+                break
+            go_left = X[rows, np.where(leaf, 0, f)] <= self.threshold[node]
+            node = np.where(leaf, node, np.where(go_left, self.left[node], self.right[node]))
+        return node
+
+    def predict_proba(self, X):
+        leaves = self.apply(X)
+        # (n, trees, classes) summed over trees in order
+        total = np.cumsum(self.proba[leaves], axis=1)[:, -1, :]
+        return total / len(self.roots)
+
+    def predict(self, X):
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
+
+# -------------------------------
+# Parity check + microbenchmark
+# -------------------------------
+# python forest.py
+def check_parity(rf, X):
+    compiled = CompiledForest.from_sklearn(rf)
+    expected = rf.predict_proba(X)
+    got = compiled.predict_proba(X)
+    return bool(np.array_equal(expected, got)), compiled
+
+
+def _time_per_call(fn, X, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(X)
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+if __name__ == "__main__":
+    from model import X_init, y_init, train_forest
+    rf_model = train_forest(X_init, y_init)
+
+    rng = np.random.default_rng(0)
+    lo, hi = X_init.min(axis=0), X_init.max(axis=0)
+    X = rng.uniform(lo - (hi - lo), hi + (hi - lo), size=(10000, X_init.shape[1]))
+    X = np.vstack([X, X_init])
+
+    ok, compiled = check_parity(rf_model, X)
+    print(f"parity on {len(X)} rows: {'OK' if ok else 'MISMATCH'}")
+
+    # the serving forest is shallow; also check deep trees
+    from sklearn.ensemble import RandomForestClassifier
+    y = (X[:, 0] * rng.uniform(size=len(X)) > np.median(X[:, 0])).astype(int)
+    deep = RandomForestClassifier(n_estimators=50, random_state=0).fit(X, y)
+    deep_ok, _ = check_parity(deep, rng.uniform(lo - (hi - lo), hi + (hi - lo), size=(5000, X.shape[1])))
+    print(f"parity on deep forest: {'OK' if deep_ok else 'MISMATCH'}")
+    ok = ok and deep_ok
+
+    for n in (1, 64, 1024):
+        batch = X[:n]
+        sk = _time_per_call(rf_model.predict_proba, batch, 200)
+        cf = _time_per_call(compiled.predict_proba, batch, 200)
+        print(f"rows={n:5d}  sklearn {sk:9.1f} us  compiled {cf:9.1f} us  speedup {sk / cf:5.1f}x")
+
+    if not ok:
+        raise SystemExit(1)
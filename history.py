@@ -0,0 +1,264 @@
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+# -------------------------------
+# Timestamps
+# -------------------------------
+# History is ordered and stored by integer microseconds since the epoch.
+# Naive ISO timestamps (what the service writes) are UTC, as in
+# features.to_epoch.
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+EPOCH_NAIVE = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+
+def to_micros(ts):
+    dt = datetime.fromisoformat(ts)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return (dt - EPOCH) // MICROSECOND
+
+def from_micros(us):
+    return (EPOCH_NAIVE + timedelta(microseconds=us)).isoformat()
+
+# -------------------------------
+# String interning
+# -------------------------------
+# Devices, locations and decision strings repeat across every user's
+# history; each distinct value is stored once per process and history
+# rows keep its small-int id. Id 0 means "key absent".
+class Interner:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.values = [None]
+        self.ids = {}
+
+    def id(self, value):
+        i = self.ids.get(value)
+        if i is None:
+            with self._lock:
+                i = self.ids.get(value)
+                if i is None:
+                    i = len(self.values)
+                    self.values.append(value)
+                    self.ids[value] = i
+        return i
+
+    def __len__(self):
+        return len(self.values) - 1
+
+DEVICES = Interner()
+LOCATIONS = Interner()
+CODES = Interner()
+
+# -------------------------------
+# Compact per-user history
+# -------------------------------
+# One typed array per field instead of one dict per transaction:
+#
+#   ts        int64   microseconds since epoch (the sort key)
+#   amount    float64
+#   device    int32   DEVICES id         location  int32   LOCATIONS id
+#   fraud     int8    0 / 1, -1 = absent
+#   verified  int8    otp_verified 0 / 1, -1 = absent
+#   decision  uint8   CODES id           reason    uint8   CODES id (block_reason)
+#   flags     uint8   FLAG_INT_AMOUNT: amount was an int
+#
+# Rows are rebuilt into the original dicts on read, so /history and the
+# JSON files keep their shape. Anything the columns can't reproduce
+# exactly (a timestamp not in the service's isoformat, an unknown key, an
+# unexpected type) is kept verbatim in the sparse `extra` dict by row.
+FLAG_INT_AMOUNT = 1
+MAX_CODES = 255
+
+class History:
+    __slots__ = (
+        "ts", "amount", "device", "location", "fraud",
+        "verified", "decision", "reason", "flags", "extra"
+    )
+
+    def __init__(self, rows=()):
+        self.ts = array("q")
+        self.amount = array("d")
+        self.device = array("i")
+        self.location = array("i")
+        self.fraud = array("b")
+        self.verified = array("b")
+        self.decision = array("B")
+        self.reason = array("B")
+        self.flags = array("B")
+        self.extra = {}
+        for t in rows:
+            self.insert(t)
+
+    def _columns(self):
+        return (
+            self.ts, self.amount, self.device, self.location, self.fraud,
+            self.verified, self.decision, self.reason, self.flags
+        )
+
+    # ---------- encode ----------
+    def _encode(self, t):
+        extra = {}
+        for k, v in t.items():
+            if k not in ENCODERS:
+                extra[k] = v
+
+        ts = t["timestamp"]
+        us = to_micros(ts)
+        if from_micros(us) != ts:
+            extra["timestamp"] = ts
+
+        amount = t.get("amount")
+        flags = 0
+        if type(amount) is int and abs(amount) < 2 ** 53:
+            flags |= FLAG_INT_AMOUNT
+        elif type(amount) is not float:
+            extra["amount"] = amount
+            amount = 0.0
+
+        values = [us, float(amount)]
+        for key, encode in ENCODERS_AFTER_AMOUNT:
+            if key not in t:
+                values.append(encode.absent)
+                continue
+            code = encode(t[key])
+            if code is None:
+                extra[key] = t[key]
+                code = encode.absent
+            values.append(code)
+        values.append(flags)
+        return values, extra
+
+    def insert(self, t):
+        values, extra = self._encode(t)
+        i = bisect_right(self.ts, values[0])
+        if i == len(self.ts):
+            for column, v in zip(self._columns(), values):
+                column.append(v)
+        else:
+            for column, v in zip(self._columns(), values):
+                column.insert(i, v)
+            if self.extra:
+                self.extra = {(j + 1 if j >= i else j): e for j, e in self.extra.items()}
+        if extra:
+            self.extra[i] = extra
+
+    # ---------- decode ----------
+    def row(self, i):
+        extra = self.extra.get(i)
+        amount = self.amount[i]
+        t = {"amount": int(amount) if self.flags[i] & FLAG_INT_AMOUNT else amount}
+        if self.device[i]:
+            t["device_id"] = DEVICES.values[self.device[i]]
+        if self.location[i]:
+            t["location"] = LOCATIONS.values[self.location[i]]
+        t["timestamp"] = from_micros(self.ts[i])
+        if self.fraud[i] >= 0:
+            t["fraud"] = self.fraud[i]
+        if self.reason[i]:
+            t["block_reason"] = CODES.values[self.reason[i]]
+        if self.decision[i]:
+            t["decision"] = CODES.values[self.decision[i]]
+        if self.verified[i] >= 0:
+            t["otp_verified"] = bool(self.verified[i])
+        if extra:
+            # known keys keep their place, unknown ones go last
+            t.update(extra)
+        return t
+
+    def __len__(self):
+        return len(self.ts)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.row(j) for j in range(*i.indices(len(self.ts)))]
+        if i < 0:
+            i += len(self.ts)
+        if not 0 <= i < len(self.ts):
+            raise IndexError(i)
+        return self.row(i)
+
+    def __iter__(self):
+        for i in range(len(self.ts)):
+            yield self.row(i)
+
+    # json.dumps(default=...) hook for the stores' files
+    def to_json(self):
+        return list(self)
+
+    # ---------- search ----------
+    # first row strictly after / at-or-after an ISO timestamp
+    def after(self, ts):
+        return bisect_right(self.ts, to_micros(ts))
+
+    def before(self, ts):
+        return bisect_left(self.ts, to_micros(ts))
+
+    # ---------- vectorized reads ----------
+    # numpy copies (a view would pin the arrays against resizing)
+    def epochs(self):
+        return np.array(self.ts, dtype=np.int64) / 1e6
+
+    def amounts(self):
+        return np.array(self.amount, dtype=float)
+
+    def fraud_labels(self):
+        return np.array(self.fraud, dtype=np.int8)
+
+    def device_ids(self):
+        return np.array(self.device, dtype=np.int32)
+
+    def location_ids(self):
+        return np.array(self.location, dtype=np.int32)
+
+    def decision_codes(self):
+        return np.array(self.decision, dtype=np.uint8)
+
+    def nbytes(self):
+        return sum(c.itemsize * len(c) for c in self._columns())
+
+
+class _Code:
+    def __init__(self, interner, limit=None):
+        self.interner = interner
+        self.limit = limit
+        self.absent = 0
+
+    def __call__(self, value):
+        if type(value) is not str:
+            return None
+        i = self.interner.id(value)
+        if self.limit is not None and i > self.limit:
+            return None
+        return i
+
+class _Flag:
+    absent = -1
+
+    def __init__(self, kind):
+        self.kind = kind
+
+    def __call__(self, value):
+        if type(value) is not self.kind or value not in (0, 1):
+            return None
+        return int(value)
+
+# column order after ts, amount; must match History._columns
+ENCODERS_AFTER_AMOUNT = [
+    ("device_id", _Code(DEVICES)),
+    ("location", _Code(LOCATIONS)),
+    ("fraud", _Flag(int)),
+    ("otp_verified", _Flag(bool)),
+    ("decision", _Code(CODES, MAX_CODES)),
+    ("block_reason", _Code(CODES, MAX_CODES))
+]
+ENCODERS = {"timestamp", "amount"} | {k for k, _ in ENCODERS_AFTER_AMOUNT}
+
+def encode_json(obj):
+    if isinstance(obj, History):
+        return obj.to_json()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
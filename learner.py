@@ -0,0 +1,124 @@
+import copy, logging, threading, time
+from collections import deque
+
+log = logging.getLogger(__name__)
+
+# -------------------------------
+# Background online learner
+# -------------------------------
+# /decision hands trusted labels to submit() and returns immediately. A
+# dedicated thread drains them in mini-batches (up to `max_batch`, or
+# whatever arrived within `interval_s`), applies them to a private copy
+# of the published online model and publishes the copy as a new version.
+# Scorers always hold a complete model: the one they read is never
+# mutated after it was published.
+#
+# Labels are applied with learn_one in arrival order rather than
+# learn_many: River's StandardScaler.learn_many can drive a variance
+# slightly negative on near-constant columns, and per-row updates keep
+# the model identical to what the synchronous path would produce.
+class OnlineLearner:
+    def __init__(self, registry, max_batch=256, interval_s=1.0):
+        self.registry = registry
+        self.max_batch = max_batch
+        self.interval = interval_s
+
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._busy = False
+        self._closed = False
+
+        self._applied = 0
+        self._batches = 0
+        self._last_publish = None
+        self._last_batch_ms = 0.0
+        self._last_lag = 0.0
+
+        self._thread = threading.Thread(target=self._run, name="online-learner", daemon=True)
+        self._thread.start()
+
+    # seq: position in the shared label queue (multi-worker mode), recorded
+    # with the published model so a snapshot knows which labels it covers;
+    # w: sample weight (below 1 for weak labels such as OTP timeouts)
+    def submit(self, x, y, seq=None, w=1.0):
+        with self._cond:
+            self._queue.append((time.time(), x, y, seq, w))
+            # wake the worker to start a batch, or to cut it short when full
+            if len(self._queue) == 1 or len(self._queue) >= self.max_batch:
+                self._cond.notify_all()
+
+    # ---------- worker ----------
+    def _take_batch(self):
+        with self._cond:
+            while not self._queue and not self._closed:
+                self._cond.wait()
+            if not self._queue:
+                return None
+
+            # give the batch until the oldest label is interval_s old
+            deadline = self._queue[0][0] + self.interval
+            while len(self._queue) < self.max_batch and not self._closed:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            n = min(self.max_batch, len(self._queue))
+            self._busy = True
+            return [self._queue.popleft() for _ in range(n)]
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if batch is None:
+                return
+
+            start = time.perf_counter()
+            try:
+                shadow = copy.deepcopy(self.registry.online_model)
+                for _, x, y, _, w in batch:
+                    shadow.learn_one(x, y, w=w)
+                self.registry.publish_online(shadow, label_seq=batch[-1][3])
+            except Exception:
+                log.exception("online learner dropped a batch of %d labels", len(batch))
+            finally:
+                with self._cond:
+                    self._busy = False
+                    self._applied += len(batch)
+                    self._batches += 1
+                    self._last_publish = time.time()
+                    self._last_batch_ms = (time.perf_counter() - start) * 1000
+                    self._last_lag = self._last_publish - batch[0][0]
+                    self._cond.notify_all()
+
+    # ---------- control ----------
+    def flush(self, timeout=None):
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            self._cond.notify_all()
+            while self._queue or self._busy:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+
+    def stats(self):
+        with self._cond:
+            oldest = self._queue[0][0] if self._queue else None
+            return {
+                "queued_labels": len(self._queue),
+                # how far the published model trails the oldest unapplied label
+                "lag_seconds": round(time.time() - oldest, 3) if oldest else 0.0,
+                "last_batch_lag_seconds": round(self._last_lag, 3),
+                "labels_applied": self._applied,
+                "batches": self._batches,
+                "last_batch_ms": round(self._last_batch_ms, 3),
+                "last_publish": self._last_publish
+            }
@@ -0,0 +1,186 @@
+import threading, time
+from bisect import bisect_left
+
+# -------------------------------
+# Prometheus metrics
+# -------------------------------
+# Just enough of the Prometheus data model for /metrics: counters and
+# histograms updated on the request path (one short lock each), and
+# gauges computed by a callback at scrape time. render() produces the
+# text exposition format.
+LATENCY_BUCKETS = (
+    0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+    0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5
+)
+
+def _escape(v):
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+def _num(v):
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, *values, amount=1):
+        with self._lock:
+            self._values[values] = self._values.get(values, 0) + amount
+
+    def values(self):
+        with self._lock:
+            return dict(self._values)
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for values, v in items:
+            yield self.name, _labels(self.labels, values), v
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        # label values -> [per-bucket counts..., +Inf count, sum]
+        self._values = {}
+
+    def observe(self, value, *values):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            row = self._values.get(values)
+            if row is None:
+                row = self._values[values] = [0] * (len(self.buckets) + 1) + [0.0]
+            row[i] += 1
+            row[-1] += value
+
+    def time(self, *values):
+        return _Timer(self, values)
+
+    # (count, sum) per label values, for callers that want totals
+    def totals(self):
+        with self._lock:
+            return {k: (sum(row[:-1]), row[-1]) for k, row in self._values.items()}
+
+    def samples(self):
+        with self._lock:
+            items = sorted((k, list(row)) for k, row in self._values.items())
+        names = self.labels + ("le",)
+        for values, row in items:
+            cumulative = 0
+            for le, n in zip(self.buckets + (float("inf"),), row[:-1]):
+                cumulative += n
+                yield self.name + "_bucket", _labels(names, values + (_num(le),)), cumulative
+            yield self.name + "_sum", _labels(self.labels, values), row[-1]
+            yield self.name + "_count", _labels(self.labels, values), cumulative
+
+
+class _Timer:
+    __slots__ = ("hist", "values", "start")
+
+    def __init__(self, hist, values):
+        self.hist = hist
+        self.values = values
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.hist.observe(time.perf_counter() - self.start, *self.values)
+
+
+# fn() returns a number, or {label values tuple: number}
+class Gauge:
+    kind = "gauge"
+
+    def __init__(self, name, help, fn, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.fn = fn
+
+    def samples(self):
+        value = self.fn()
+        if isinstance(value, dict):
+            for values, v in sorted(value.items()):
+                yield self.name, _labels(self.labels, values), v
+        elif value is not None:
+            yield self.name, "", value
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def gauge(self, name, help, fn, labels=()):
+        return self.register(Gauge(name, help, fn, labels))
+
+    def render(self):
+        lines = []
+        for m in self.metrics:
+            lines.append(f"# HELP {m.name} {m.help}")
+            lines.append(f"# TYPE {m.name} {m.kind}")
+            for name, labels, value in m.samples():
+                lines.append(f"{name}{labels} {_num(value)}")
+        return "\n".join(lines) + "\n"
+
+# -------------------------------
+# Request timing middleware
+# -------------------------------
+# Plain ASGI (no BaseHTTPMiddleware task overhead). Requests are labelled
+# with the route's path template, so /history/{user_id} is one series.
+class RequestMetrics:
+    def __init__(self, app, histogram, counter):
+        self.app = app
+        self.histogram = histogram
+        self.counter = counter
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status = [500]
+
+        async def send_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            self.histogram.observe(time.perf_counter() - start, scope["method"], path)
+            self.counter.inc(scope["method"], path, str(status[0]))
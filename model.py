@@ -1,19 +1,346 @@
+import fcntl, json, os, pickle, shutil, threading, time
+from contextlib import contextmanager
 import numpy as np
+import joblib
 from sklearn.ensemble import RandomForestClassifier
 
 from river import preprocessing, linear_model
 
-rf_model = RandomForestClassifier(n_estimators=50, random_state=42)
+from config import RF_ENGINE, MODEL_DIR, MODEL_SNAPSHOT_KEEP
+from features import FEATURE_KEYS
+from forest import CompiledForest
 
+# columns follow features.FEATURE_KEYS: the 7 base features, then
+# count / amount sum over 1m, 1h, 24h and distinct devices in 24h, then
+# the cross-user device features (other users, new-but-shared, activity)
 X_init = np.array([
-    [300, 1, 0, 0, 0.25, 0, 0],     # student normal
-    [12000, 3, 0, 0, 0.8, 0, 0],    # salary normal
-    [5000, 3, 1, 1, 4.0, 1, 1],     # student fraud
-    [60000, 8, 1, 1, 3.0, 1, 1]     # business fraud
+    [300, 1, 0, 0, 0.25, 0, 0,   0, 0, 1, 450, 2, 750, 1,              0, 0, 0],      # student normal
+    [12000, 3, 0, 0, 0.8, 0, 0,  0, 0, 0, 0, 1, 12000, 1,              0, 0, 0],      # salary normal
+    [5000, 3, 1, 1, 4.0, 1, 1,   3, 1500, 6, 4000, 8, 6000, 3,         3, 1, 4.5],    # student fraud
+    [60000, 8, 1, 1, 3.0, 1, 1,  4, 120000, 9, 200000, 12, 260000, 4,  6, 1, 9.0]     # business fraud
 ])
 
 y_init = np.array([0, 0, 1, 1])
 
-rf_model.fit(X_init, y_init)
+def train_forest(X, y, n_estimators=50, n_jobs=None):
+    rf = RandomForestClassifier(n_estimators=n_estimators, n_jobs=n_jobs, random_state=42)
+    rf.fit(X, y)
+    return rf
 
-online_model = preprocessing.StandardScaler() | linear_model.LogisticRegression()
+def new_online_model():
+    return preprocessing.StandardScaler() | linear_model.LogisticRegression()
+
+# -------------------------------
+# Snapshots
+# -------------------------------
+# MODEL_DIR/
+#   CURRENT            name of the latest complete snapshot
+#   v000001/
+#     meta.json        version, feature keys, creation time, label_seq
+#     forest/*.npy     CompiledForest arrays (memory-mapped on load)
+#     rf.joblib        the sklearn forest (only loaded for RF_ENGINE=sklearn)
+#     online.pkl       the River pipeline
+#
+# A snapshot is written to a temp directory and renamed into place before
+# CURRENT is switched, so readers only ever see complete snapshots. When
+# the forest hasn't changed since `base`, its files are hard-linked from
+# there instead of being written again. label_seq is the last shared
+# label (storage labels table) the online model has learned.
+@contextmanager
+def _dir_lock(root):
+    os.makedirs(root, exist_ok=True)
+    with open(os.path.join(root, ".lock"), "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def _snapshot_name(version):
+    return f"v{version:06d}"
+
+def _list_snapshots(root):
+    if not os.path.isdir(root):
+        return []
+    return sorted(
+        int(name[1:]) for name in os.listdir(root)
+        if name.startswith("v") and name[1:].isdigit()
+    )
+
+def latest_snapshot(root):
+    try:
+        with open(os.path.join(root, "CURRENT")) as f:
+            name = f.read().strip()
+        if os.path.isdir(os.path.join(root, name)):
+            return int(name[1:]), os.path.join(root, name)
+    except (OSError, ValueError):
+        pass
+    versions = _list_snapshots(root)
+    if not versions:
+        return None
+    return versions[-1], os.path.join(root, _snapshot_name(versions[-1]))
+
+def _write_meta(path, version, label_seq):
+    with open(os.path.join(path, "meta.json"), "w") as f:
+        json.dump({
+            "version": version,
+            "feature_keys": FEATURE_KEYS,
+            "label_seq": label_seq,
+            "created": time.time()
+        }, f)
+
+def _link_forest(base, path):
+    os.makedirs(os.path.join(path, "forest"))
+    for name in os.listdir(os.path.join(base, "forest")):
+        os.link(os.path.join(base, "forest", name), os.path.join(path, "forest", name))
+    os.link(os.path.join(base, "rf.joblib"), os.path.join(path, "rf.joblib"))
+
+def write_snapshot(root, version, rf_model, online_model, compiled=None, base=None, label_seq=0):
+    os.makedirs(root, exist_ok=True)
+    tmp = os.path.join(root, f".tmp-{os.getpid()}-{threading.get_ident()}")
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+
+    if base is not None:
+        _link_forest(base, tmp)
+    else:
+        (compiled or CompiledForest.from_sklearn(rf_model)).save(os.path.join(tmp, "forest"))
+        joblib.dump(rf_model, os.path.join(tmp, "rf.joblib"))
+    with open(os.path.join(tmp, "online.pkl"), "wb") as f:
+        pickle.dump(online_model, f, protocol=pickle.HIGHEST_PROTOCOL)
+    _write_meta(tmp, version, label_seq)
+
+    # another process may have taken this version number; move up
+    while True:
+        final = os.path.join(root, _snapshot_name(version))
+        try:
+            os.rename(tmp, final)
+            break
+        except OSError:
+            if not os.path.exists(final):
+                raise
+            version += 1
+            _write_meta(tmp, version, label_seq)
+
+    pointer = os.path.join(root, "CURRENT.tmp")
+    with open(pointer, "w") as f:
+        f.write(_snapshot_name(version))
+    os.replace(pointer, os.path.join(root, "CURRENT"))
+    return final
+
+def prune_snapshots(root, keep):
+    for v in _list_snapshots(root)[:-keep]:
+        shutil.rmtree(os.path.join(root, _snapshot_name(v)), ignore_errors=True)
+
+# -------------------------------
+# Model registry
+# -------------------------------
+# Holds the models the scoring path uses. Nothing is trained or read at
+# import: the first access loads the latest snapshot (forest arrays are
+# memory-mapped, so this is cheap) and only bootstraps from X_init when
+# no usable snapshot exists (under a directory lock, so workers starting
+# together bootstrap once). Online learning marks the registry dirty;
+# save() writes a new snapshot version, periodically and on shutdown.
+# refresh() picks up a newer snapshot written by another process.
+class ModelRegistry:
+    def __init__(self, root, engine=RF_ENGINE, keep=MODEL_SNAPSHOT_KEEP):
+        if engine not in ("sklearn", "compiled"):
+            raise ValueError(f"Unknown RF engine: {engine}")
+        self.root = root
+        self.engine = engine
+        self.keep = keep
+
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._dirty = False
+        self._version = 0
+        self._online_version = 0
+        self._label_seq = 0
+        # snapshot the current forest was read from / written to
+        self._forest_path = None
+        self._rf_model = None
+        self._rf_engine = None
+        self._online_model = None
+
+        self._autosave_stop = threading.Event()
+        self._autosave = None
+
+    # ---------- loading ----------
+    def _ensure(self):
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self._load()
+                    self._loaded = True
+
+    def _load(self):
+        if self._load_latest():
+            return
+
+        # no snapshot (or one for a different feature set): bootstrap
+        with _dir_lock(self.root):
+            if self._load_latest():
+                return
+            self._rf_model = train_forest(X_init, y_init)
+            self._rf_engine = (
+                CompiledForest.from_sklearn(self._rf_model)
+                if self.engine == "compiled" else self._rf_model
+            )
+            self._online_model = new_online_model()
+            self._dirty = True
+            self.save()
+
+    def _load_latest(self, newer_than=0):
+        found = latest_snapshot(self.root)
+        if found is None or found[0] <= newer_than:
+            return False
+        version, path = found
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        if meta.get("feature_keys") != FEATURE_KEYS:
+            return False
+
+        if self.engine == "compiled":
+            self._rf_engine = CompiledForest.load(os.path.join(path, "forest"))
+            self._rf_model = None
+        else:
+            self._rf_model = joblib.load(os.path.join(path, "rf.joblib"))
+            self._rf_engine = self._rf_model
+        with open(os.path.join(path, "online.pkl"), "rb") as f:
+            self._online_model = pickle.load(f)
+        self._version = version
+        self._label_seq = meta.get("label_seq", 0)
+        self._forest_path = path
+        self._online_version += 1
+        return True
+
+    # load a snapshot another process wrote since ours; True if one was found
+    def refresh(self):
+        self._ensure()
+        with self._lock:
+            return self._load_latest(newer_than=self._version)
+
+    @property
+    def version(self):
+        self._ensure()
+        return self._version
+
+    @property
+    def rf_engine(self):
+        self._ensure()
+        return self._rf_engine
+
+    # the sklearn estimator; with the compiled engine it is only read from
+    # the snapshot when something (a save, retraining) actually needs it
+    @property
+    def rf_model(self):
+        self._ensure()
+        return self._sklearn_forest()
+
+    def _sklearn_forest(self):
+        if self._rf_model is None:
+            path = os.path.join(self.root, _snapshot_name(self._version))
+            self._rf_model = joblib.load(os.path.join(path, "rf.joblib"))
+        return self._rf_model
+
+    @property
+    def online_model(self):
+        self._ensure()
+        return self._online_model
+
+    # bumped on every online-model update since this process started
+    @property
+    def online_version(self):
+        return self._online_version
+
+    @property
+    def label_seq(self):
+        self._ensure()
+        return self._label_seq
+
+    # ---------- learning ----------
+    # synchronous path: updates the live model in place
+    def learn_one(self, x, y, w=1.0):
+        self._ensure()
+        with self._lock:
+            self._online_model.learn_one(x, y, w=w)
+            self._online_version += 1
+            self._dirty = True
+
+    # background path (learner.OnlineLearner): swap in an updated copy
+    def publish_online(self, model, label_seq=None):
+        self._ensure()
+        with self._lock:
+            self._online_model = model
+            self._online_version += 1
+            if label_seq is not None:
+                self._label_seq = label_seq
+            self._dirty = True
+
+    # ---------- retraining ----------
+    # snapshot directory the current forest's files live in
+    @property
+    def forest_path(self):
+        self._ensure()
+        return self._forest_path
+
+    # swap in a forest trained elsewhere (retrain.py): `path` holds forest/
+    # and rf.joblib laid out like a snapshot. It is read before the lock
+    # is taken, so scoring keeps the old forest until the swap, and the
+    # snapshot written here hard-links the new files from `path`.
+    def install_forest(self, path):
+        self._ensure()
+        if self.engine == "compiled":
+            rf_model, rf_engine = None, CompiledForest.load(os.path.join(path, "forest"))
+        else:
+            rf_model = joblib.load(os.path.join(path, "rf.joblib"))
+            rf_engine = rf_model
+        with self._lock:
+            self._rf_model = rf_model
+            self._rf_engine = rf_engine
+            self._forest_path = path
+            self._dirty = True
+            return self.save()
+
+    # ---------- saving ----------
+    def save(self, force=False):
+        with self._lock:
+            if not (self._dirty or force):
+                return self._version
+            if self._forest_path is not None and os.path.isdir(self._forest_path):
+                path = write_snapshot(
+                    self.root, self._version + 1, None, self._online_model,
+                    base=self._forest_path, label_seq=self._label_seq
+                )
+            else:
+                compiled = self._rf_engine if self.engine == "compiled" else None
+                path = write_snapshot(
+                    self.root, self._version + 1, self._sklearn_forest(), self._online_model,
+                    compiled, label_seq=self._label_seq
+                )
+            self._version = int(os.path.basename(path)[1:])
+            self._forest_path = path
+            self._dirty = False
+            prune_snapshots(self.root, self.keep)
+            return self._version
+
+    def start_autosave(self, interval):
+        if interval <= 0 or self._autosave is not None:
+            return
+
+        def loop():
+            while not self._autosave_stop.wait(interval):
+                self.save()
+
+        self._autosave = threading.Thread(target=loop, name="model-autosave", daemon=True)
+        self._autosave.start()
+
+    def close(self):
+        self._autosave_stop.set()
+        if self._autosave is not None:
+            self._autosave.join()
+        if self._loaded:
+            self.save()
+
+
+models = ModelRegistry(MODEL_DIR)
@@ -0,0 +1,495 @@
+import argparse, ast, hashlib, json, logging, os, sys, threading, time
+from datetime import datetime
+
+import numpy as np
+
+from features import ACCOUNT_LIMITS, FEATURE_KEYS
+
+log = logging.getLogger(__name__)
+
+# -------------------------------
+# Risk policy
+# -------------------------------
+# Everything that turns model outputs into a decision, read from a JSON
+# file (FRAUD_POLICY_FILE, policy.json) instead of code:
+#
+#   weights         score = 100 x (online x online_prob + rf x rf_prob)
+#   rules           {"name", "when", "add"}: `add` points when `when` holds
+#   flags           upper bound (inclusive) of each flag's score range;
+#                   above CRITICAL's is SEVERE
+#   actions         what the service does with each flag
+#   account_limits  hard block above these amounts, by account type
+#                   (lowercase; "default" for types not listed)
+#
+# A key left out of the file keeps its value from DEFAULT_POLICY. The
+# score is capped at 100 and rounded to 2 decimals before it's flagged.
+#
+# `when` is an expression over the feature columns (FEATURE_KEYS) and
+# avg_amount, e.g. "amount > avg_amount * 3 and device_change == 1", with
+# + - * / %, comparisons, and/or/not and numbers. It is parsed once at
+# load into a tree of numpy operations over whole columns, so one row and
+# a batch go through the same code. Rules can't see the model outputs:
+# the score then only grows with rf_prob, which the cascade's bound needs.
+RISK_FLAGS = np.array(["LOW", "MEDIUM", "HIGH", "CRITICAL", "SEVERE"])
+ACTIONS = ("AUTO_APPROVE", "APPROVE_MONITOR", "OTP_REQUIRED", "BLOCK")
+MAX_SCORE = 100
+
+DEFAULT_POLICY = {
+    "weights": {"online": 0.6, "rf": 0.4},
+    "rules": [
+        {"name": "amount_over_3x_average", "when": "amount > avg_amount * 3", "add": 10},
+        {"name": "non_round_amount", "when": "amount % 10 != 0", "add": 5},
+        {"name": "location_change", "when": "location_change == 1", "add": 10}
+    ],
+    "flags": {"LOW": 20, "MEDIUM": 40, "HIGH": 60, "CRITICAL": 80},
+    "actions": {
+        "LOW": "AUTO_APPROVE",
+        "MEDIUM": "APPROVE_MONITOR",
+        "HIGH": "OTP_REQUIRED",
+        "CRITICAL": "OTP_REQUIRED",
+        "SEVERE": "BLOCK"
+    },
+    "account_limits": ACCOUNT_LIMITS
+}
+
+# -------------------------------
+# Rule expressions
+# -------------------------------
+RULE_VARIABLES = FEATURE_KEYS + ["avg_amount"]
+
+_BINOPS = {
+    ast.Add: np.add, ast.Sub: np.subtract, ast.Mult: np.multiply,
+    ast.Div: np.true_divide, ast.Mod: np.mod
+}
+_COMPARE = {
+    ast.Lt: np.less, ast.LtE: np.less_equal, ast.Gt: np.greater,
+    ast.GtE: np.greater_equal, ast.Eq: np.equal, ast.NotEq: np.not_equal
+}
+
+# (function of a {name: column} dict, names it reads)
+def compile_rule(expr):
+    try:
+        tree = ast.parse(expr, mode="eval")
+    except SyntaxError as e:
+        raise ValueError(f"rule {expr!r}: {e.msg}") from None
+    names = set()
+    return _compile(tree.body, names, expr), names
+
+def _compile(node, names, expr):
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+        value = float(node.value)
+        return lambda c: value
+    if isinstance(node, ast.Name):
+        if node.id not in RULE_VARIABLES:
+            raise ValueError(f"rule {expr!r}: unknown variable {node.id!r}")
+        names.add(node.id)
+        key = node.id
+        return lambda c: c[key]
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.Not, ast.USub)):
+        f = _compile(node.operand, names, expr)
+        op = np.logical_not if isinstance(node.op, ast.Not) else np.negative
+        return lambda c: op(f(c))
+    if isinstance(node, ast.BinOp) and type(node.op) in _BINOPS:
+        op = _BINOPS[type(node.op)]
+        a = _compile(node.left, names, expr)
+        b = _compile(node.right, names, expr)
+        return lambda c: op(a(c), b(c))
+    if isinstance(node, ast.BoolOp):
+        op = np.logical_and if isinstance(node.op, ast.And) else np.logical_or
+        parts = [_compile(v, names, expr) for v in node.values]
+
+        def combined(c):
+            out = parts[0](c)
+            for f in parts[1:]:
+                out = op(out, f(c))
+            return out
+        return combined
+    if isinstance(node, ast.Compare) and all(type(o) in _COMPARE for o in node.ops):
+        # a < b < c is (a < b) and (b < c), each operand evaluated once
+        operands = [_compile(v, names, expr) for v in [node.left] + node.comparators]
+        ops = [_COMPARE[type(o)] for o in node.ops]
+        if len(ops) == 1:
+            op, a, b = ops[0], operands[0], operands[1]
+            return lambda c: op(a(c), b(c))
+
+        def chained(c):
+            values = [f(c) for f in operands]
+            out = ops[0](values[0], values[1])
+            for k in range(1, len(ops)):
+                out = np.logical_and(out, ops[k](values[k], values[k + 1]))
+            return out
+        return chained
+    raise ValueError(f"rule {expr!r}: unsupported expression {ast.unparse(node)!r}")
+
+# -------------------------------
+# Compiled policy
+# -------------------------------
+class Policy:
+    def __init__(self, spec, source="built-in"):
+        unknown = set(spec) - set(DEFAULT_POLICY)
+        if unknown:
+            raise ValueError(f"unknown policy keys: {sorted(unknown)}")
+        spec = {**DEFAULT_POLICY, **spec}
+        self.spec = spec
+        self.source = source
+        self.digest = hashlib.sha256(json.dumps(spec, sort_keys=True).encode()).hexdigest()[:12]
+
+        # the cascade's bound needs the score to grow with rf_prob
+        self.w_online = float(spec["weights"]["online"])
+        self.w_rf = float(spec["weights"]["rf"])
+        if self.w_online < 0 or self.w_rf < 0:
+            raise ValueError("policy weights must be >= 0")
+
+        self.rules = []
+        used = set()
+        for rule in spec["rules"]:
+            name = rule["name"]
+            if any(name == r[0] for r in self.rules):
+                raise ValueError(f"duplicate rule name {name!r}")
+            predicate, names = compile_rule(rule["when"])
+            self.rules.append((name, predicate, float(rule["add"])))
+            used |= names
+        self._columns = [(k, FEATURE_KEYS.index(k)) for k in sorted(used) if k in FEATURE_KEYS]
+
+        flags = spec["flags"]
+        if set(flags) != set(RISK_FLAGS[:-1]):
+            raise ValueError(f"policy flags must be exactly {RISK_FLAGS[:-1].tolist()}")
+        self.bounds = np.array([float(flags[f]) for f in RISK_FLAGS[:-1]])
+        if (np.diff(self.bounds) <= 0).any():
+            raise ValueError("policy flag bounds must increase from LOW to CRITICAL")
+
+        actions = spec["actions"]
+        if set(actions) != set(RISK_FLAGS):
+            raise ValueError(f"policy actions must cover exactly {RISK_FLAGS.tolist()}")
+        bad = {f: a for f, a in actions.items() if a not in ACTIONS}
+        if bad:
+            raise ValueError(f"unknown policy actions {bad}; expected one of {list(ACTIONS)}")
+        self.actions = dict(actions)
+        self.flag_actions = np.array([actions[f] for f in RISK_FLAGS])
+
+        self.account_limits = {str(k).lower(): v for k, v in spec["account_limits"].items()}
+        if any(isinstance(v, bool) or not isinstance(v, (int, float)) for v in self.account_limits.values()):
+            raise ValueError("policy account_limits must be numbers")
+        if "default" not in self.account_limits:
+            raise ValueError('policy account_limits need a "default"')
+
+        # fail at load, not on the first transaction
+        self.raw_scores(np.zeros((1, len(FEATURE_KEYS))), np.zeros(1), np.zeros(1), np.ones(1))
+
+    # {rule name: bool mask}
+    def rule_hits(self, X, avg_amounts):
+        X = np.asarray(X, dtype=float)
+        columns = {k: X[:, i] for k, i in self._columns}
+        columns["avg_amount"] = np.asarray(avg_amounts, dtype=float)
+        out = {}
+        # x / 0 in a rule is inf or nan, which compares false, as in Python
+        with np.errstate(divide="ignore", invalid="ignore"):
+            for name, predicate, _ in self.rules:
+                mask = predicate(columns)
+                # a rule over constants only is a scalar
+                out[name] = mask.astype(bool, copy=False) if np.ndim(mask) else np.full(len(X), bool(mask))
+        return out
+
+    # before the cap and rounding (both monotone, so a bound on this is a
+    # bound on the final score; see cascade.py)
+    def raw_scores(self, X, rf_probs, online_probs, avg_amounts):
+        rf_probs = np.asarray(rf_probs, dtype=float)
+        online_probs = np.asarray(online_probs, dtype=float)
+        scores = (self.w_online * online_probs + self.w_rf * rf_probs) * 100
+        hits = self.rule_hits(X, avg_amounts)
+        for name, _, add in self.rules:
+            scores = scores + np.where(hits[name], add, 0.0)
+        return scores
+
+    def scores(self, X, rf_probs, online_probs, avg_amounts):
+        return np.round(np.minimum(self.raw_scores(X, rf_probs, online_probs, avg_amounts), MAX_SCORE), 2)
+
+    def flags(self, scores):
+        return RISK_FLAGS[np.digitize(scores, self.bounds, right=True)]
+
+    # the highest score still flagged LOW
+    @property
+    def low_bound(self):
+        return float(self.bounds[0])
+
+    # (scores, flags, actions) for N scored rows
+    def evaluate(self, X, rf_probs, online_probs, avg_amounts):
+        scores = self.scores(X, rf_probs, online_probs, avg_amounts)
+        index = np.digitize(scores, self.bounds, right=True)
+        return scores, RISK_FLAGS[index], self.flag_actions[index]
+
+    def describe(self):
+        return {"source": self.source, "digest": self.digest, **self.spec}
+
+
+# a missing file is the built-in DEFAULT_POLICY
+def load_policy(path):
+    if not path or not os.path.exists(path):
+        return Policy({})
+    with open(path) as f:
+        spec = json.load(f)
+    if not isinstance(spec, dict):
+        raise ValueError(f"{path}: expected a JSON object")
+    return Policy(spec, path)
+
+# -------------------------------
+# Hot reload
+# -------------------------------
+# `current` is swapped whole, so a request that reads it once scores with
+# one policy throughout. Every interval_s seconds (0 = only on reload())
+# the file's mtime/size/inode is compared with the one loaded; a changed
+# file is loaded and compiled off the request path. A file that fails to
+# load is logged and counted (on_reload / on_failure are called for each
+# load and failure) and the running policy stays. Each worker
+# process watches the file on its own, so workers converge within one
+# interval.
+class PolicyFile:
+    def __init__(self, path, interval_s=2.0, on_reload=None, on_failure=None):
+        self.path = path
+        self.interval = interval_s
+        self.on_reload = on_reload
+        self.on_failure = on_failure
+        self._lock = threading.Lock()
+        self._key = self._stat()
+        # a broken file at startup is a configuration error
+        self.current = load_policy(path)
+        self.loaded_at = time.time()
+        self.reloads = 0
+        self.failures = 0
+        self.last_error = None
+        self._stop = threading.Event()
+        self._thread = None
+        if path and interval_s > 0:
+            self._thread = threading.Thread(target=self._run, name="policy-reload", daemon=True)
+            self._thread.start()
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+        except (FileNotFoundError, TypeError):
+            return None
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.reload()
+
+    # True when a changed (or, with force, any) file was loaded
+    def reload(self, force=False):
+        with self._lock:
+            key = self._stat()
+            if key == self._key and not force:
+                return False
+            # a broken file isn't retried until it changes again
+            self._key = key
+            try:
+                policy = load_policy(self.path)
+            except Exception as e:
+                self.failures += 1
+                self.last_error = f"{type(e).__name__}: {e}"
+                log.error("risk policy %s not loaded: %s", self.path, self.last_error)
+                if self.on_failure is not None:
+                    self.on_failure()
+                return False
+            self.current = policy
+            self.loaded_at = time.time()
+            self.reloads += 1
+            self.last_error = None
+            log.info("risk policy %s loaded from %s", policy.digest, policy.source)
+            if self.on_reload is not None:
+                self.on_reload()
+            return True
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def stats(self):
+        policy = self.current
+        return {
+            "path": self.path,
+            "source": policy.source,
+            "digest": policy.digest,
+            "loaded_at": self.loaded_at,
+            "reload_interval_s": self.interval,
+            "reloads": self.reloads,
+            "failures": self.failures,
+            "last_error": self.last_error
+        }
+
+# -------------------------------
+# Dry run
+# -------------------------------
+# python policy.py dry-run candidate.json [--current policy.json]
+#
+# Replays the stored history (FRAUD_STORAGE's store, read without
+# changing it) and decides every row under the current and the candidate
+# policy, with the latest model snapshot. Rows keep the features they had
+# when they were scored, so a row's state doesn't depend on how either
+# policy would have decided the rows before it. Reports decision counts,
+# flag and action transitions, rule hit counts, how each policy treats the
+# rows a reviewer labelled, and the changed rows that moved most.
+def _decide(policy, df, profiles, rf_engine, online_proba, cache):
+    from retrain import replay_features
+
+    key = json.dumps(policy.account_limits, sort_keys=True)
+    if key not in cache:
+        sorted_df, X, avg = replay_features(df.copy(), profiles, policy.account_limits)
+        blocked = X[:, FEATURE_KEYS.index("account_amount_flag")] == 1
+        rf = np.zeros(len(X))
+        online = np.zeros(len(X))
+        if (~blocked).any():
+            rf[~blocked] = rf_engine.predict_proba(X[~blocked])[:, 1]
+            online[~blocked] = online_proba(X[~blocked])
+        cache[key] = (sorted_df, X, avg, blocked, rf, online)
+    sorted_df, X, avg, blocked, rf, online = cache[key]
+
+    scores = np.full(len(X), 100.0)
+    flags = np.full(len(X), "SEVERE", dtype=RISK_FLAGS.dtype)
+    actions = np.full(len(X), "BLOCK", dtype=policy.flag_actions.dtype)
+    scored = ~blocked
+    if scored.any():
+        scores[scored], flags[scored], actions[scored] = policy.evaluate(
+            X[scored], rf[scored], online[scored], avg[scored]
+        )
+    hits = {name: int((mask & scored).sum()) for name, mask in policy.rule_hits(X, avg).items()}
+    return sorted_df, scores, flags, actions, blocked, hits
+
+def _counts(values):
+    keys, counts = np.unique(values, return_counts=True)
+    return {str(k): int(c) for k, c in zip(keys, counts)}
+
+def _transitions(a, b):
+    changed = a != b
+    pairs = np.char.add(np.char.add(a[changed].astype(str), "->"), b[changed].astype(str))
+    return dict(sorted(_counts(pairs).items(), key=lambda kv: -kv[1]))
+
+def dry_run(df, profiles, current, candidate, rf_engine, online_proba, examples=20):
+    from retrain import is_reviewed
+
+    cache = {}
+    out = {"rows": len(df)}
+    decided = {}
+    for label, policy in (("current", current), ("candidate", candidate)):
+        sorted_df, scores, flags, actions, blocked, hits = _decide(
+            policy, df, profiles, rf_engine, online_proba, cache
+        )
+        decided[label] = (scores, flags, actions)
+        out[label] = {
+            "source": policy.source,
+            "digest": policy.digest,
+            "hard_blocks": int(blocked.sum()),
+            "flags": _counts(flags),
+            "actions": _counts(actions),
+            "rule_hits": hits
+        }
+    if not len(df):
+        return out
+
+    (s0, f0, a0), (s1, f1, a1) = decided["current"], decided["candidate"]
+    out["changed"] = {
+        "flags": int((f0 != f1).sum()),
+        "actions": int((a0 != a1).sum()),
+        "score_mean_diff": round(float((s1 - s0).mean()), 4),
+        "flag_changes": _transitions(f0, f1),
+        "action_changes": _transitions(a0, a1)
+    }
+
+    # the rows replay in the same order under both policies; "reviewed" is
+    # the same approve/reject predicate retraining uses, so TIMEOUT rows
+    # are left out
+    fraud = sorted_df["fraud"].to_numpy(dtype=int)
+    reviewed = is_reviewed(sorted_df["decision"].to_numpy()) & (fraud >= 0)
+    if reviewed.any():
+        out["reviewed"] = {"rows": int(reviewed.sum()), "fraud": int(fraud[reviewed].sum())}
+        for label, actions in (("current", a0), ("candidate", a1)):
+            held = np.isin(actions, ("OTP_REQUIRED", "BLOCK"))
+            out["reviewed"][label] = {
+                "fraud_held": int((reviewed & held & (fraud == 1)).sum()),
+                "fraud_passed": int((reviewed & ~held & (fraud == 1)).sum()),
+                "legit_held": int((reviewed & held & (fraud == 0)).sum())
+            }
+
+    changed = np.flatnonzero(a0 != a1)
+    changed = changed[np.argsort(-np.abs(s1[changed] - s0[changed]), kind="stable")][:examples]
+    users = sorted_df["user_id"].to_numpy()
+    epochs = sorted_df["epoch"].to_numpy(dtype=float)
+    amounts = sorted_df["amount"].to_numpy(dtype=float)
+    out["examples"] = [{
+        "user_id": str(users[i]),
+        "timestamp": datetime.utcfromtimestamp(epochs[i]).isoformat(),
+        "amount": float(amounts[i]),
+        "current": {"risk_score": float(s0[i]), "risk_flag": str(f0[i]), "action": str(a0[i])},
+        "candidate": {"risk_score": float(s1[i]), "risk_flag": str(f1[i]), "action": str(a1[i])}
+    } for i in changed]
+    return out
+
+# the configured store's history, read without changing it
+def read_stored_history():
+    from config import DATA_FILE, LOG_FILE, SNAPSHOT_FILE, SQLITE_FILE, STORAGE_BACKEND
+    from retrain import read_history
+    from storage import JsonStore, LogStore, SqliteStore
+
+    if STORAGE_BACKEND == "sqlite":
+        if not os.path.exists(SQLITE_FILE):
+            raise SystemExit(f"no sqlite store at {SQLITE_FILE}")
+        store = SqliteStore(SQLITE_FILE)
+    elif STORAGE_BACKEND == "log":
+        store = LogStore(DATA_FILE, LOG_FILE, SNAPSHOT_FILE)
+        store.load(read_only=True)
+    elif STORAGE_BACKEND == "json":
+        store = JsonStore(DATA_FILE)
+        store.load()
+    else:
+        raise ValueError(f"Unknown storage backend: {STORAGE_BACKEND}")
+    try:
+        return read_history(store)
+    finally:
+        store.close()
+
+def main():
+    from config import POLICY_FILE
+
+    p = argparse.ArgumentParser(description="Risk policy files")
+    sub = p.add_subparsers(dest="cmd", required=True)
+    c = sub.add_parser("check", help="load and compile a policy file")
+    c.add_argument("path")
+    d = sub.add_parser("dry-run", help="re-decide stored history under a candidate policy")
+    d.add_argument("candidate")
+    d.add_argument("--current", default=POLICY_FILE,
+                   help="policy to compare against (default FRAUD_POLICY_FILE)")
+    d.add_argument("--engine", choices=["sklearn", "compiled"], default="compiled")
+    d.add_argument("--examples", type=int, default=20, help="changed rows to list")
+    args = p.parse_args()
+
+    if args.cmd == "check":
+        if not os.path.exists(args.path):
+            raise SystemExit(f"no policy file at {args.path}")
+        json.dump(load_policy(args.path).describe(), sys.stdout, indent=2)
+        print()
+        return
+
+    from config import MODEL_DIR
+    from model import ModelRegistry
+    from scoring import freeze_online, online_proba_many
+
+    if not os.path.exists(args.candidate):
+        raise SystemExit(f"no policy file at {args.candidate}")
+    candidate = load_policy(args.candidate)
+    current = load_policy(args.current)
+    registry = ModelRegistry(MODEL_DIR, engine=args.engine)
+    online_model = registry.online_model
+    online_proba = freeze_online(online_model) or (lambda X: online_proba_many(online_model, X))
+
+    start = time.perf_counter()
+    df, profiles = read_stored_history()
+    out = dry_run(df, profiles, current, candidate, registry.rf_engine, online_proba, args.examples)
+    out["model_snapshot"] = registry.version
+    out["seconds"] = round(time.perf_counter() - start, 3)
+    json.dump(out, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
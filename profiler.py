@@ -0,0 +1,90 @@
+import os, sys, threading, time
+
+# -------------------------------
+# Sampling profiler
+# -------------------------------
+# Off by default; /debug/profiler/start turns it on in a running process.
+# While on, a thread snapshots every other thread's stack each
+# `interval_ms` (sys._current_frames, no tracing hooks, so the request
+# path runs unmodified) and counts identical stacks. Threads parked in
+# the threadpool, a lock or a condition wait are skipped, so the report
+# shows where busy threads spend time. report() returns the collapsed
+# "frame;frame;frame count" format flamegraph tools read.
+IDLE_FILES = ("threading.py", "selectors.py", "queue.py", "thread.py")
+
+class SamplingProfiler:
+    def __init__(self, max_depth=64):
+        self.max_depth = max_depth
+        self._lock = threading.Lock()
+        self._stacks = {}
+        self._samples = 0
+        self._thread = None
+        self._stop = threading.Event()
+        self.interval = None
+        self.started = None
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self, interval_ms=5.0, reset=True):
+        with self._lock:
+            if self._thread is not None:
+                return False
+            if reset:
+                self._stacks = {}
+                self._samples = 0
+            self.interval = interval_ms / 1000.0
+            self.started = time.time()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is None:
+            return False
+        self._stop.set()
+        thread.join()
+        return True
+
+    def _collapse(self, frame):
+        names = []
+        while frame is not None and len(names) < self.max_depth:
+            code = frame.f_code
+            names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+            frame = frame.f_back
+        return ";".join(reversed(names))
+
+    def _run(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            stacks = [
+                self._collapse(f) for tid, f in frames.items()
+                if tid != me and os.path.basename(f.f_code.co_filename) not in IDLE_FILES
+            ]
+            del frames
+            with self._lock:
+                self._samples += 1
+                for s in stacks:
+                    self._stacks[s] = self._stacks.get(s, 0) + 1
+
+    def report(self, limit=None):
+        with self._lock:
+            items = sorted(self._stacks.items(), key=lambda kv: -kv[1])
+        if limit:
+            items = items[:limit]
+        return "".join(f"{stack} {n}\n" for stack, n in items)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "running": self._thread is not None,
+                "interval_ms": None if self.interval is None else self.interval * 1000,
+                "started": self.started,
+                "samples": self._samples,
+                "distinct_stacks": len(self._stacks)
+            }
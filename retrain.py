@@ -0,0 +1,403 @@
+import logging, os, pickle, shutil, tempfile, threading, time
+from multiprocessing import get_context
+
+import numpy as np
+import pandas as pd
+
+log = logging.getLogger(__name__)
+
+# -------------------------------
+# Forest retraining
+# -------------------------------
+# The forest starts from the four X_init rows; history accumulates the
+# outcomes (fraud 0/1) of every committed transaction. A retraining run:
+#
+#   1. gets the history to a child process: the sqlite store is read by the
+#      child itself; the json and log stores hold it in this process, so
+#      their columns are copied user by user into a spill file first
+#   2. the child (spawned, at lower CPU priority) replays every user's
+#      history through FeatureState in timestamp order, so each row gets
+#      the features it had when it was scored (the shared-device features
+#      from one pass over all rows), and trains a forest with n_jobs
+#   3. the newest `holdout` fraction of the rows (by timestamp) is held
+#      out; the new forest replaces the current one only if its ROC AUC
+#      there is at least the current forest's plus min_auc_gain
+#   4. the accepted forest is written next to the snapshots and swapped in
+#      by ModelRegistry.install_forest, which also snapshots it
+#
+# Serving only pays for the spill copy (json/log) and the final swap.
+# Rows the hard account limit blocked (under the current risk policy's
+# limits) are never scored, so they are left out; labels="reviewed" also
+# leaves out rows nobody reviewed, whose label is the policy's own output.
+
+# A reviewer's call on a pending transaction. TIMEOUT (expired undecided)
+# is a decision too, but nobody reviewed it.
+REVIEW_DECISIONS = ["APPROVE", "REJECT"]
+
+def is_reviewed(decisions):
+    return np.isin(np.asarray(decisions, dtype=object), REVIEW_DECISIONS)
+
+# Every row of `df` with the features it had when it was scored, and the
+# avg_amount it was scored against. `limits` are the policy's account limits.
+def replay_features(df, profiles, limits=None):
+    from config import (
+        DEVICE_INDEX_HALF_LIFE_S, DEVICE_INDEX_MAX_DEVICES, DEVICE_INDEX_MAX_USERS
+    )
+    from crossuser import SHARED_DEVICE_KEYS, replay
+    from features import FEATURE_KEYS, FeatureState, extract_features_batch
+
+    if not len(df):
+        return df, np.zeros((0, len(FEATURE_KEYS))), np.zeros(0)
+
+    # seq is the load order: ties in timestamp keep it
+    df["seq"] = np.arange(len(df))
+    df = df.sort_values(["user_id", "epoch", "seq"], kind="stable", ignore_index=True)
+    users = df["user_id"].to_numpy()
+    devices = df["device_id"].to_numpy()
+    epochs = df["epoch"].to_numpy(dtype=float)
+    shared = replay(
+        devices, users, epochs, np.lexsort((df["seq"].to_numpy(), epochs)),
+        DEVICE_INDEX_HALF_LIFE_S, DEVICE_INDEX_MAX_DEVICES, DEVICE_INDEX_MAX_USERS
+    )
+    rank = df.groupby("user_id", sort=False).cumcount().to_numpy()
+
+    amounts = df["amount"].to_numpy(dtype=float)
+    locations = df["location"].to_numpy()
+    fraud = df["fraud"].to_numpy(dtype=int)
+    decisions = df["decision"].to_numpy()
+    # a user without a stored profile gets the one the service would
+    # create: avg_amount = their first amount
+    states, first = {}, {}
+    for i in np.flatnonzero(rank == 0):
+        states[users[i]] = FeatureState()
+        first[users[i]] = profiles.get(users[i]) or {"avg_amount": amounts[i]}
+    profiles = first
+
+    X = np.zeros((len(df), len(FEATURE_KEYS)))
+    avg_amounts = np.zeros(len(df))
+    by_rank = np.argsort(rank, kind="stable")
+    bounds = np.searchsorted(rank[by_rank], np.arange(rank.max() + 2))
+    for k in range(len(bounds) - 1):
+        rows = by_rank[bounds[k]:bounds[k + 1]]
+        transactions = [
+            {"amount": amounts[i], "device_id": devices[i], "location": locations[i]}
+            for i in rows
+        ]
+        X[rows], metas = extract_features_batch(
+            transactions,
+            [profiles[users[i]] for i in rows],
+            [states[users[i]] for i in rows],
+            epochs[rows],
+            [dict(zip(SHARED_DEVICE_KEYS, shared[i])) for i in rows],
+            limits
+        )
+        avg_amounts[rows] = [m["avg_amount"] for m in metas]
+        for t, i in zip(transactions, rows):
+            if fraud[i] >= 0:
+                t["fraud"] = int(fraud[i])
+            if isinstance(decisions[i], str):
+                t["decision"] = decisions[i]
+            states[users[i]].update(t, epochs[i])
+    return df, X, avg_amounts
+
+def _featurize(df, profiles, labels, limits=None):
+    from features import FEATURE_KEYS
+
+    if not len(df):
+        return np.zeros((0, len(FEATURE_KEYS))), np.zeros(0, dtype=int), np.zeros(0)
+
+    df, X, _ = replay_features(df, profiles, limits)
+    fraud = df["fraud"].to_numpy(dtype=int)
+    keep = (fraud >= 0) & (X[:, FEATURE_KEYS.index("account_amount_flag")] == 0)
+    if labels == "reviewed":
+        keep &= is_reviewed(df["decision"].to_numpy())
+    return X[keep], fraud[keep].astype(int), df["epoch"].to_numpy(dtype=float)[keep]
+
+# ---------- history sources ----------
+SPILL_ROWS = 50000
+
+def _read_spill(path):
+    chunks, profiles = [], {}
+    with open(path, "rb") as f:
+        while True:
+            try:
+                kind, value = pickle.load(f)
+            except EOFError:
+                break
+            if kind == "rows":
+                chunks.append(value)
+            elif kind == "profiles":
+                profiles = value
+            else:
+                devices, locations, codes = (np.array(v, dtype=object) for v in value)
+    columns = {
+        k: np.concatenate([c[k] for c in chunks]) if chunks else np.array([])
+        for k in ("user_id", "epoch", "amount", "device", "location", "fraud", "decision")
+    }
+    return pd.DataFrame({
+        "user_id": columns["user_id"],
+        "epoch": columns["epoch"],
+        "amount": columns["amount"],
+        "device_id": devices[columns["device"].astype(int)],
+        "location": locations[columns["location"].astype(int)],
+        "fraud": columns["fraud"],
+        "decision": codes[columns["decision"].astype(int)]
+    }), profiles
+
+# the in-memory stores' history, copied out one user at a time and
+# written in chunks of about SPILL_ROWS rows
+def write_spill(store, path):
+    from history import CODES, DEVICES, LOCATIONS
+    with open(path, "wb") as f:
+        pickle.dump(("profiles", {
+            u["user_id"]: u["profile"] for u in store.list_users() if u["profile"]
+        }), f)
+        batch, rows = [], 0
+        for uid, columns in store.history_arrays():
+            columns["user_id"] = np.full(len(columns["epoch"]), uid, dtype=object)
+            batch.append(columns)
+            rows += len(columns["epoch"])
+            if rows >= SPILL_ROWS:
+                _dump_rows(f, batch)
+                batch, rows = [], 0
+        if batch:
+            _dump_rows(f, batch)
+        # ids only grow, so values read last cover every id written above
+        pickle.dump(("interned", (
+            list(DEVICES.values), list(LOCATIONS.values), list(CODES.values)
+        )), f)
+
+def _dump_rows(f, batch):
+    chunk = {k: np.concatenate([c[k] for c in batch]) for k in batch[0]}
+    pickle.dump(("rows", chunk), f, protocol=pickle.HIGHEST_PROTOCOL)
+
+# the whole history of `store` read in this process
+def read_history(store):
+    if hasattr(store, "iter_all_history"):
+        return _read_sqlite(store.path)
+    with tempfile.TemporaryDirectory() as work:
+        path = os.path.join(work, "history.pkl")
+        write_spill(store, path)
+        return _read_spill(path)
+
+def _read_sqlite(path):
+    from features import to_epoch
+    from storage import SqliteStore
+    store = SqliteStore(path)
+    try:
+        columns = {k: [] for k in ("user_id", "epoch", "amount", "device_id", "location",
+                                   "fraud", "decision")}
+        for uid, t in store.iter_all_history():
+            columns["user_id"].append(uid)
+            columns["epoch"].append(to_epoch(t["timestamp"]))
+            columns["amount"].append(t.get("amount", 0.0))
+            columns["device_id"].append(t.get("device_id"))
+            columns["location"].append(t.get("location"))
+            columns["fraud"].append(t["fraud"] if t.get("fraud") in (0, 1) else -1)
+            columns["decision"].append(t.get("decision"))
+        profiles = {u["user_id"]: u["profile"] for u in store.list_users() if u["profile"]}
+    finally:
+        store.close()
+    return pd.DataFrame(columns), profiles
+
+# ---------- child process ----------
+def train_job(source, current, staging, params):
+    from forest import CompiledForest
+    from model import train_forest
+    from sklearn.metrics import roc_auc_score
+    import joblib
+
+    os.nice(params["nice"])
+    start = time.perf_counter()
+    kind, path = source
+    df, profiles = _read_spill(path) if kind == "spill" else _read_sqlite(path)
+    X, y, epochs = _featurize(df, profiles, params["labels"], params.get("account_limits"))
+    report = {
+        "history_rows": len(df),
+        "training_rows": len(y),
+        "fraud_rows": int(y.sum()),
+        "accepted": False
+    }
+
+    order = np.argsort(epochs, kind="stable")
+    X, y = X[order], y[order]
+    split = len(y) - int(len(y) * params["holdout"])
+    if len(y) < params["min_rows"] or len(set(y[:split])) < 2 or len(set(y[split:])) < 2:
+        report["skipped"] = True
+        report["reason"] = "not enough labelled rows of both classes"
+        report["seconds"] = round(time.perf_counter() - start, 3)
+        return report
+
+    forest = train_forest(X[:split], y[:split], params["n_estimators"], params["n_jobs"])
+    candidate = roc_auc_score(y[split:], forest.predict_proba(X[split:])[:, 1])
+    baseline = CompiledForest.load(os.path.join(current, "forest"))
+    incumbent = roc_auc_score(y[split:], baseline.predict_proba(X[split:])[:, 1])
+    report.update({
+        "train_rows": split,
+        "holdout_rows": len(y) - split,
+        "candidate_auc": round(float(candidate), 6),
+        "current_auc": round(float(incumbent), 6)
+    })
+
+    if candidate >= incumbent + params["min_auc_gain"]:
+        os.makedirs(staging)
+        CompiledForest.from_sklearn(forest).save(os.path.join(staging, "forest"))
+        joblib.dump(forest, os.path.join(staging, "rf.joblib"))
+        report["accepted"] = True
+    else:
+        report["reason"] = "candidate did not beat the current forest on the holdout"
+    report["seconds"] = round(time.perf_counter() - start, 3)
+    return report
+
+# the child's entry point: sends (True, report) or (False, error) back
+def _train_main(conn, *args):
+    try:
+        conn.send((True, train_job(*args)))
+    except BaseException as e:
+        log.exception("forest training job failed")
+        conn.send((False, f"{type(e).__name__}: {e}"))
+
+# ---------- scheduler ----------
+class ForestRetrainer:
+    def __init__(self, registry, store, interval_s=3600.0, should_run=None,
+                 n_estimators=100, n_jobs=-1, holdout=0.2, min_rows=200,
+                 min_auc_gain=0.0, labels="reviewed", nice=10, on_result=None, policies=None):
+        if labels not in ("all", "reviewed"):
+            raise ValueError(f"Unknown retraining labels: {labels}")
+        self.registry = registry
+        self.store = store
+        self.interval = interval_s
+        self.should_run = should_run or (lambda: True)
+        self.on_result = on_result
+        self.policies = policies
+        self.params = {
+            "n_estimators": n_estimators, "n_jobs": n_jobs, "holdout": holdout,
+            "min_rows": min_rows, "min_auc_gain": min_auc_gain, "labels": labels, "nice": nice
+        }
+        self._running = threading.Lock()
+        # held while a forest is installed; close() takes it after setting
+        # _stop, so no install starts or is still running once it returns
+        self._install = threading.Lock()
+        self._stop = threading.Event()
+        self._child = None
+        self.runs = 0
+        self.last = None
+        self._thread = None
+        self._now = None
+        if interval_s > 0:
+            self._thread = threading.Thread(target=self._run, name="forest-retrain", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            if self.should_run():
+                self.run_once()
+
+    # False when a run is already in progress
+    def start(self):
+        if self._running.locked():
+            return False
+        self._now = threading.Thread(target=self.run_once, name="forest-retrain-now", daemon=True)
+        self._now.start()
+        return True
+
+    def run_once(self):
+        if not self._running.acquire(blocking=False):
+            return None
+        work = os.path.join(self.registry.root, f".train-{os.getpid()}")
+        candidate = os.path.join(work, "candidate")
+        started = time.time()
+        try:
+            shutil.rmtree(work, ignore_errors=True)
+            os.makedirs(work)
+            report = None
+            # close() may have started already; don't read a closing store
+            if not self._stop.is_set():
+                source = self._source(work)
+                params = dict(self.params)
+                if self.policies is not None:
+                    params["account_limits"] = self.policies.current.account_limits
+                report = self._train(source, candidate, params)
+            with self._install:
+                if report is None:
+                    report = {"accepted": False, "cancelled": True}
+                elif self._stop.is_set():
+                    report["accepted"] = False
+                    report["cancelled"] = True
+                elif report["accepted"]:
+                    report["snapshot_version"] = self.registry.install_forest(candidate)
+            report["result"] = (
+                "cancelled" if report.get("cancelled") else
+                "accepted" if report["accepted"] else
+                "skipped" if report.get("skipped") else "rejected"
+            )
+        except Exception as e:
+            log.exception("forest retraining failed")
+            report = {"result": "failed", "error": str(e)}
+        finally:
+            shutil.rmtree(work, ignore_errors=True)
+            self._running.release()
+        report["started"] = started
+        self.runs += 1
+        self.last = report
+        if self.on_result is not None:
+            self.on_result(report["result"])
+        return report
+
+    # the training child's report, or None when close() killed it
+    def _train(self, source, candidate, params):
+        ctx = get_context("spawn")
+        with self._install:
+            if self._stop.is_set():
+                return None
+            recv, send = ctx.Pipe(duplex=False)
+            child = ctx.Process(
+                target=_train_main, name="forest-train",
+                args=(send, source, self.registry.forest_path, candidate, params)
+            )
+            child.start()
+            self._child = child
+        send.close()
+        try:
+            ok, result = recv.recv()
+        except EOFError:
+            ok, result = None, None
+        finally:
+            recv.close()
+            child.join()
+            self._child = None
+        if ok is None:
+            # the child died without answering: terminated by close(), or crashed
+            if self._stop.is_set():
+                return None
+            raise RuntimeError(f"forest training exited with code {child.exitcode}")
+        if not ok:
+            raise RuntimeError(result)
+        return result
+
+    def _source(self, work):
+        if hasattr(self.store, "iter_all_history"):
+            return "sqlite", self.store.path
+        path = os.path.join(work, "history.pkl")
+        write_spill(self.store, path)
+        return "spill", path
+
+    # a training child still running is terminated, so shutdown never
+    # waits out a whole run
+    def close(self):
+        self._stop.set()
+        with self._install:
+            if self._child is not None:
+                self._child.terminate()
+        for thread in (self._thread, self._now):
+            if thread is not None:
+                thread.join()
+
+    def stats(self):
+        return {
+            "interval_s": self.interval,
+            "running": self._running.locked(),
+            "runs": self.runs,
+            "last": self.last,
+            **self.params
+        }
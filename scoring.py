@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+
+from features import FEATURE_KEYS
+
+# -------------------------------
+# Scoring
+# -------------------------------
+# Model outputs, shared by the service (app.py) and offline scoring
+# (bulk_score.py); the risk policy that turns them into a score, flag and
+# action is in policy.py.
+def online_proba_many(online_model, X):
+    probs = online_model.predict_proba_many(pd.DataFrame(X, columns=FEATURE_KEYS))
+    if True not in probs.columns:
+        return np.zeros(len(X))
+    return probs[True].to_numpy(dtype=float)
+
+# For a model that won't change while it's used (bulk_score.py): the
+# StandardScaler | LogisticRegression pipeline reduced to numpy arrays,
+# which avoids River's per-call DataFrame conversion on small batches.
+# Returns None for any other pipeline shape; use online_proba_many then.
+def freeze_online(online_model):
+    steps = list(getattr(online_model, "steps", {}).values())
+    if [type(s).__name__ for s in steps] != ["StandardScaler", "LogisticRegression"]:
+        return None
+    scaler, lr = steps
+    if scaler.window_size is not None or not scaler.with_std:
+        return None
+
+    means = np.array([scaler.means.get(k, 0.0) for k in FEATURE_KEYS], dtype=float)
+    var = np.array([scaler.vars.get(k, 0.0) for k in FEATURE_KEYS], dtype=float)
+    # zero (or float-drifted negative) variance scales to 0, as River does
+    inv_std = np.zeros(len(FEATURE_KEYS))
+    np.divide(1.0, np.sqrt(var, where=var > 0, out=np.ones_like(var)), out=inv_std, where=var > 0)
+    weights = np.array([lr._weights.get(k, 0.0) for k in FEATURE_KEYS], dtype=float)
+    intercept = float(lr.intercept)
+
+    def predict(X):
+        logits = ((X - means) * inv_std) @ weights + intercept
+        return 1.0 / (1.0 + np.exp(-np.clip(logits, -30, 30)))
+    return predict
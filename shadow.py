@@ -0,0 +1,343 @@
+import argparse, glob, json, logging, os, pickle, sys, threading, time
+from collections import deque
+
+import numpy as np
+
+from features import FEATURE_KEYS
+from policy import DEFAULT_POLICY, RISK_FLAGS, PolicyFile
+from scoring import freeze_online, online_proba_many
+
+log = logging.getLogger(__name__)
+
+# -------------------------------
+# Shadow (challenger) models
+# -------------------------------
+# A challenger is a model directory laid out like a snapshot (model.py):
+# forest/ (or rf.joblib) and/or online.pkl, or a model root whose CURRENT
+# names one. A part it doesn't have is taken from the live champion, so
+# a directory holding only online.pkl tries a new online learner against
+# the champion's forest. Challengers score with the live risk policy
+# (policy.py) at the time their batch runs.
+#
+# The request path only appends (features, champion outputs) to a
+# bounded queue; when the queue is full the row is dropped and counted,
+# never waited for. A worker thread scores queued rows in batches with
+# every challenger and buffers the results as columns, which are written
+# every flush_rows rows / flush_s seconds as one compressed .npz segment
+# (np.savez_compressed; no extra dependency) under log_dir:
+#
+#   ts, user_id, txn_id, avg_amount          per row
+#   champion_rf, champion_online,            champion outputs (rf is NaN when
+#   champion_score, champion_flag,           the cascade skipped the forest;
+#   champion_model_ms                        flag is an index into RISK_FLAGS)
+#   <name>_rf, <name>_online, <name>_score,  per challenger (model_ms is the
+#   <name>_flag, <name>_model_ms             batch time divided by its rows)
+#
+# `python shadow.py report shadow/` summarizes the segments.
+FLAG_INDEX = {f: i for i, f in enumerate(RISK_FLAGS)}
+
+class Challenger:
+    def __init__(self, name, path):
+        from forest import CompiledForest
+        from model import latest_snapshot
+        import joblib
+
+        if os.path.exists(os.path.join(path, "CURRENT")):
+            path = latest_snapshot(path)[1]
+        self.name = name
+        self.path = path
+
+        # the compiled forest gives the sklearn forest's output, faster
+        self.rf_engine = None
+        if os.path.isdir(os.path.join(path, "forest")):
+            self.rf_engine = CompiledForest.load(os.path.join(path, "forest"))
+        elif os.path.exists(os.path.join(path, "rf.joblib")):
+            self.rf_engine = joblib.load(os.path.join(path, "rf.joblib"))
+
+        self.online_model = None
+        self._online_proba = None
+        if os.path.exists(os.path.join(path, "online.pkl")):
+            with open(os.path.join(path, "online.pkl"), "rb") as f:
+                self.online_model = pickle.load(f)
+            # challengers don't learn, so the pipeline can be frozen
+            model = self.online_model
+            self._online_proba = freeze_online(model) or (lambda X: online_proba_many(model, X))
+
+        if self.rf_engine is None and self.online_model is None:
+            raise ValueError(f"shadow model {name}: no forest or online.pkl in {path}")
+
+    def score(self, X, avg_amounts, champion, policy):
+        rf_engine = self.rf_engine or champion.rf_engine
+        rf = rf_engine.predict_proba(X)[:, 1]
+        if self._online_proba is not None:
+            online = self._online_proba(X)
+        else:
+            online = online_proba_many(champion.online_model, X)
+        scores = policy.scores(X, rf, online, avg_amounts)
+        return rf, online, scores, policy.flags(scores)
+
+
+# "name=path,name=path"
+def parse_challengers(spec):
+    out = []
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        name, sep, path = item.partition("=")
+        if not sep or not name.strip().isidentifier():
+            raise ValueError(f"FRAUD_SHADOW_MODELS: expected name=path, got {item!r}")
+        out.append((name.strip(), path.strip()))
+    return out
+
+
+class ShadowRunner:
+    def __init__(self, challengers, champion, log_dir, max_queue=10000, max_batch=256,
+                 flush_rows=50000, flush_s=60.0, policies=None, on_drop=None):
+        self.challengers = challengers
+        self.champion = champion
+        self.policies = policies or PolicyFile(None)
+        self.log_dir = log_dir
+        self.max_queue = max_queue
+        self.max_batch = max_batch
+        self.flush_rows = flush_rows
+        self.flush_s = flush_s
+        self.on_drop = on_drop
+
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._closed = False
+
+        self.queued = 0
+        self.dropped = 0
+        self.scored = 0
+        self.failed = 0
+        self.segments = 0
+        self._columns = self._empty()
+        self._rows = 0
+        self._dropped_at_flush = 0
+        self._last_flush = time.monotonic()
+
+        os.makedirs(log_dir, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name="shadow-models", daemon=True)
+        self._thread.start()
+
+    # ---------- request path ----------
+    # never blocks on the challengers: a full queue drops the row
+    def submit(self, user_id, txn_id, x, avg_amount, rf_prob, online_prob, risk_score,
+               risk_flag, model_seconds):
+        item = (
+            time.time(), user_id, txn_id, x, avg_amount,
+            np.nan if rf_prob is None else rf_prob, online_prob, risk_score,
+            FLAG_INDEX[risk_flag], model_seconds * 1000
+        )
+        with self._cond:
+            if len(self._queue) >= self.max_queue or self._closed:
+                self.dropped += 1
+                if self.on_drop is not None:
+                    self.on_drop()
+                return False
+            self._queue.append(item)
+            self.queued += 1
+            if len(self._queue) == 1:
+                self._cond.notify()
+        return True
+
+    # ---------- worker ----------
+    def _empty(self):
+        keys = [
+            "ts", "user_id", "txn_id", "avg_amount", "champion_rf", "champion_online",
+            "champion_score", "champion_flag", "champion_model_ms"
+        ]
+        for c in self.challengers:
+            keys += [f"{c.name}_{k}" for k in ("rf", "online", "score", "flag", "model_ms")]
+        return {k: [] for k in keys}
+
+    def _take_batch(self):
+        with self._cond:
+            while not self._queue and not self._closed:
+                if not self._cond.wait(self.flush_s):
+                    return []
+            n = min(self.max_batch, len(self._queue))
+            return [self._queue.popleft() for _ in range(n)]
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if batch:
+                try:
+                    self._score(batch)
+                except Exception:
+                    self.failed += len(batch)
+                    log.exception("shadow scoring failed")
+            if self._rows >= self.flush_rows or (
+                self._rows and time.monotonic() - self._last_flush >= self.flush_s
+            ):
+                self.flush()
+            with self._cond:
+                if self._closed and not self._queue:
+                    break
+        self.flush()
+
+    def _score(self, batch):
+        ts, users, txns, xs, avg, rf, online, score, flag, ms = zip(*batch)
+        X = np.array(xs, dtype=float)
+        avg = np.array(avg, dtype=float)
+        policy = self.policies.current
+        out = {
+            "ts": ts, "user_id": users, "txn_id": txns, "avg_amount": avg,
+            "champion_rf": rf, "champion_online": online, "champion_score": score,
+            "champion_flag": flag, "champion_model_ms": ms
+        }
+        for c in self.challengers:
+            start = time.perf_counter()
+            c_rf, c_online, c_score, c_flag = c.score(X, avg, self.champion, policy)
+            per_row = (time.perf_counter() - start) * 1000 / len(batch)
+            out[f"{c.name}_rf"] = c_rf
+            out[f"{c.name}_online"] = c_online
+            out[f"{c.name}_score"] = c_score
+            out[f"{c.name}_flag"] = [FLAG_INDEX[f] for f in c_flag]
+            out[f"{c.name}_model_ms"] = [per_row] * len(batch)
+        for k, values in out.items():
+            self._columns[k].extend(values)
+        self._rows += len(batch)
+        self.scored += len(batch)
+
+    def flush(self):
+        if not self._rows:
+            return None
+        columns = {}
+        for k, values in self._columns.items():
+            if k in ("user_id", "txn_id"):
+                columns[k] = np.array(values, dtype=str)
+            elif k.endswith("_flag"):
+                columns[k] = np.array(values, dtype=np.uint8)
+            elif k == "ts":
+                columns[k] = np.array(values, dtype=np.float64)
+            else:
+                columns[k] = np.array(values, dtype=np.float32)
+        meta = {
+            "challengers": {c.name: c.path for c in self.challengers},
+            "feature_keys": FEATURE_KEYS,
+            "actions": self.policies.current.actions,
+            "dropped": self.dropped - self._dropped_at_flush
+        }
+        # written under a dot name, which the report's glob skips, then renamed
+        name = f"shadow-{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}-{self.segments:05d}.npz"
+        path = os.path.join(self.log_dir, name)
+        tmp = os.path.join(self.log_dir, "." + name)
+        np.savez_compressed(tmp, _meta=np.array(json.dumps(meta)), **columns)
+        os.replace(tmp, path)
+        self.segments += 1
+        self._dropped_at_flush = self.dropped
+        self._columns = self._empty()
+        self._rows = 0
+        self._last_flush = time.monotonic()
+        return path
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+
+    def stats(self):
+        with self._cond:
+            depth = len(self._queue)
+        return {
+            "challengers": {c.name: c.path for c in self.challengers},
+            "queue_depth": depth,
+            "max_queue": self.max_queue,
+            "queued": self.queued,
+            "dropped": self.dropped,
+            "scored": self.scored,
+            "failed": self.failed,
+            "buffered_rows": self._rows,
+            "segments_written": self.segments,
+            "log_dir": self.log_dir
+        }
+
+# -------------------------------
+# Report
+# -------------------------------
+# the policy actions are the first segment's
+def load_segments(paths):
+    columns, dropped, names, actions = {}, 0, None, None
+    for path in paths:
+        with np.load(path) as seg:
+            meta = json.loads(str(seg["_meta"]))
+            if names is None:
+                names = list(meta["challengers"])
+                actions = meta.get("actions")
+            if list(meta["challengers"]) != names:
+                log.warning("skipping %s: different challengers", path)
+                continue
+            dropped += meta["dropped"]
+            for k in seg.files:
+                if k != "_meta":
+                    columns.setdefault(k, []).append(seg[k])
+    return (
+        {k: np.concatenate(v) for k, v in columns.items()}, names or [], dropped,
+        actions or DEFAULT_POLICY["actions"]
+    )
+
+def _latency(ms):
+    ms = ms[~np.isnan(ms)]
+    if not len(ms):
+        return None
+    p50, p99 = np.percentile(ms, [50, 99])
+    return {"mean_ms": round(float(ms.mean()), 4), "p50_ms": round(float(p50), 4),
+            "p99_ms": round(float(p99), 4)}
+
+def report(columns, names, dropped, actions):
+    n = len(columns.get("ts", []))
+    out = {"rows": n, "dropped": dropped}
+    if not n:
+        return out
+    actions = np.array([actions[f] for f in RISK_FLAGS])
+    champion_flag = columns["champion_flag"]
+    champion_score = columns["champion_score"].astype(float)
+    out["champion"] = {
+        "flags": {str(RISK_FLAGS[i]): int(c) for i, c in zip(*np.unique(champion_flag, return_counts=True))},
+        "latency": _latency(columns["champion_model_ms"].astype(float))
+    }
+    for name in names:
+        flag = columns[f"{name}_flag"]
+        score = columns[f"{name}_score"].astype(float)
+        diff = score - champion_score
+        pairs = {}
+        for a, b in zip(champion_flag, flag):
+            if a != b:
+                key = f"{RISK_FLAGS[a]}->{RISK_FLAGS[b]}"
+                pairs[key] = pairs.get(key, 0) + 1
+        out[name] = {
+            "flag_agreement": round(float((flag == champion_flag).mean()), 4),
+            "action_agreement": round(float((actions[flag] == actions[champion_flag]).mean()), 4),
+            "score_mean_diff": round(float(diff.mean()), 4),
+            "score_mean_abs_diff": round(float(np.abs(diff).mean()), 4),
+            "score_corr": (
+                round(float(np.corrcoef(score, champion_score)[0, 1]), 4)
+                if score.std() > 0 and champion_score.std() > 0 else None
+            ),
+            "flag_changes": dict(sorted(pairs.items(), key=lambda kv: -kv[1])),
+            "latency": _latency(columns[f"{name}_model_ms"].astype(float))
+        }
+    return out
+
+def main():
+    p = argparse.ArgumentParser(description="Shadow model logs")
+    sub = p.add_subparsers(dest="cmd", required=True)
+    r = sub.add_parser("report", help="agreement and latency of each challenger vs the champion")
+    r.add_argument("paths", nargs="+", help="segment files or directories")
+    args = p.parse_args()
+
+    files = []
+    for path in args.paths:
+        files += sorted(glob.glob(os.path.join(path, "shadow-*.npz"))) if os.path.isdir(path) else [path]
+    if not files:
+        raise SystemExit("no shadow segments found")
+    json.dump(report(*load_segments(files)), sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -1 +1 @@
-uvicorn app:app --host 0.0.0.0 --port 10000
+uvicorn app:app --host 0.0.0.0 --port 10000 --workers "${FRAUD_WORKERS:-1}"
@@ -0,0 +1,1048 @@
+import base64, glob, heapq, json, os, sqlite3, threading, time
+from bisect import bisect_left, bisect_right, insort
+
+from history import History, encode_json
+
+# -------------------------------
+# Mutation records
+# -------------------------------
+# Every change the service makes to user state is one of these records.
+# The stores apply them to the in-memory users and persist them; the log
+# store also replays them on startup.
+
+# the in-memory stores keep each user's history as a history.History
+EMPTY_HISTORY = History()
+
+
+def apply_record(users, record):
+    op = record["op"]
+    user = users[record["user_id"]]
+
+    if op == "profile":
+        user["profile"] = record["profile"]
+    elif op == "history":
+        # history stays in timestamp order; a pending transaction decided
+        # later slots in where it happened (normally this is an append).
+        # Compaction replays onto plain rows read from the file.
+        history = user.get("history")
+        if not isinstance(history, History):
+            history = user["history"] = History(history or ())
+        history.insert(record["transaction"])
+    elif op == "pending_add":
+        user.setdefault("pending", {})[record["txn_id"]] = record["entry"]
+    elif op == "pending_verify":
+        user["pending"][record["txn_id"]]["otp_verified"] = True
+    elif op == "pending_pop":
+        user.get("pending", {}).pop(record["txn_id"], None)
+    else:
+        raise ValueError(f"Unknown record op: {op}")
+
+
+# -------------------------------
+# Versions
+# -------------------------------
+# Change counters for cached reads (app.py): every mutation bumps its
+# user's scope, profile changes also bump USERS_SCOPE and pending changes
+# PENDING_SCOPE. A counter only ever grows while a store's `generation`
+# is the same; the in-memory stores start from zero with a new
+# generation on every load, the sqlite store keeps both in the database.
+USERS_SCOPE = "users"
+PENDING_SCOPE = "pending"
+
+def user_scope(user_id):
+    return "user:" + user_id
+
+def record_scopes(record):
+    op = record["op"]
+    scopes = [user_scope(record["user_id"])]
+    if op == "profile":
+        scopes.append(USERS_SCOPE)
+    elif op.startswith("pending_"):
+        scopes.append(PENDING_SCOPE)
+    return scopes
+
+# -------------------------------
+# Pending review index
+# -------------------------------
+# Reviewer order is highest risk_score first, then oldest, then txn id.
+# Keys are kept in one sorted list per (risk_flag, otp_verified) bucket,
+# so a filtered page merges only the matching buckets from the cursor
+# position and costs O(page size x log buckets), not a walk over users.
+def pending_key(txn_id, entry):
+    return (-entry["risk_score"], entry["transaction"]["timestamp"], txn_id)
+
+def encode_cursor(key):
+    raw = json.dumps([-key[0], key[1], key[2]], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor):
+    try:
+        score, created, txn_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+    return (-score, created, txn_id)
+
+
+def _iter_from(keys, start):
+    for i in range(start, len(keys)):
+        yield keys[i]
+
+
+class PendingIndex:
+    def __init__(self):
+        self._buckets = {}
+        self._entries = {}
+
+    def add(self, user_id, txn_id, entry):
+        key = pending_key(txn_id, entry)
+        bucket = (entry["risk_flag"], bool(entry.get("otp_verified", False)))
+        insort(self._buckets.setdefault(bucket, []), key)
+        self._entries[txn_id] = (key, bucket, user_id)
+
+    def remove(self, txn_id):
+        found = self._entries.pop(txn_id, None)
+        if found is None:
+            return None
+        key, bucket, user_id = found
+        keys = self._buckets[bucket]
+        del keys[bisect_left(keys, key)]
+        return key, bucket, user_id
+
+    def set_verified(self, txn_id):
+        found = self.remove(txn_id)
+        if found is None:
+            return
+        key, (flag, _), user_id = found
+        insort(self._buckets.setdefault((flag, True), []), key)
+        self._entries[txn_id] = (key, (flag, True), user_id)
+
+    def rebuild(self, users):
+        self._buckets = {}
+        self._entries = {}
+        for uid, u in users.items():
+            for tid, t in u.get("pending", {}).items():
+                self.add(uid, tid, t)
+
+    def page(self, risk_flag=None, otp_verified=None, limit=50, after=None):
+        streams = []
+        for (flag, verified), keys in self._buckets.items():
+            if risk_flag is not None and flag != risk_flag:
+                continue
+            if otp_verified is not None and verified != otp_verified:
+                continue
+            start = bisect_right(keys, after) if after is not None else 0
+            streams.append(_iter_from(keys, start))
+
+        out = []
+        for key in heapq.merge(*streams):
+            if len(out) == limit:
+                return out, out[-1][2]
+            out.append((self._entries[key[2]][2], key[2], key))
+        return out, None
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def _fsync_dir(path):
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _file_bytes(paths):
+    total = 0
+    for path in paths:
+        try:
+            total += os.path.getsize(path)
+        except OSError:
+            pass
+    return total
+
+
+def _write_atomic(path, chunks):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        f.writelines(chunks)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    _fsync_dir(path)
+
+# The log store's snapshot, one user per encode: a single json.dumps over
+# everything would hold the GIL (and stall request threads) for the whole
+# dump. Compact separators keep json on its C encoder.
+def _snapshot_chunks(data, seq):
+    dumps = lambda obj: json.dumps(obj, separators=(",", ":"), default=encode_json)
+    yield '{"_log_seq":%d' % seq
+    for key, value in data.items():
+        if key != "users":
+            yield f",{dumps(key)}:{dumps(value)}"
+    yield ',"users":['
+    for i, user in enumerate(data["users"]):
+        yield ("," if i else "") + dumps(user)
+    yield "]}"
+
+# -------------------------------
+# In-memory store base
+# -------------------------------
+class MemoryStore:
+    def __init__(self):
+        self.data = {"users": []}
+        self.users = {}
+        self.pending_index = PendingIndex()
+        self._lock = threading.Lock()
+        self.generation = os.urandom(4).hex()
+        self.versions = {}
+
+    def _index(self, data):
+        self.data = data
+        self.users = {u["user_id"]: u for u in data["users"]}
+        for u in data["users"]:
+            if "history" in u:
+                u["history"] = History(u["history"])
+
+    def _apply(self, record):
+        apply_record(self.users, record)
+
+        op = record["op"]
+        if op == "pending_add":
+            self.pending_index.add(record["user_id"], record["txn_id"], record["entry"])
+        elif op == "pending_verify":
+            self.pending_index.set_verified(record["txn_id"])
+        elif op == "pending_pop":
+            self.pending_index.remove(record["txn_id"])
+
+        # after the change, so a reader that sees the new version (it reads
+        # the version first) also sees the change
+        for scope in record_scopes(record):
+            self.versions[scope] = self.versions.get(scope, 0) + 1
+
+    def _persist(self, record):
+        raise NotImplementedError
+
+    # ---------- reads ----------
+    def version(self, scope):
+        return self.versions.get(scope, 0)
+
+    # get_user returns the user's id and profile; history is read through
+    # iter_history
+    def get_user(self, user_id):
+        user = self.users[user_id]
+        view = {"user_id": user_id}
+        if "profile" in user:
+            view["profile"] = user["profile"]
+        return view
+
+    def list_users(self):
+        for u in self.users.values():
+            yield {"user_id": u["user_id"], "profile": u.get("profile", {})}
+
+    def count_transactions(self, user_id):
+        user = self.users[user_id]
+        return len(user.get("history", EMPTY_HISTORY)) + len(user.get("pending", {}))
+
+    # the user's History itself, for whole-column reads (feature rebuild)
+    def history(self, user_id):
+        return self.users[user_id].get("history", EMPTY_HISTORY)
+
+    # history in timestamp order, optionally strictly after/before an ISO
+    # timestamp; generated lazily so a stream never copies the whole list
+    def iter_history(self, user_id, after=None, before=None):
+        return self._iter_history(self.history(user_id), after, before)
+
+    # HISTORY_CHUNK rows are copied at a time under the lock, as list_history
+    # does. Writers may insert anywhere (History.insert keeps timestamp
+    # order), so each chunk is found again by the last timestamp sent plus
+    # how many rows with that timestamp were sent (equal timestamps insert
+    # after each other): an insert between chunks is neither repeated nor
+    # skipped.
+    def _iter_history(self, history, after, before):
+        last, same = None, 0
+        while True:
+            with self._lock:
+                if last is not None:
+                    i = history.before(last) + same
+                else:
+                    i = history.after(after) if after else 0
+                hi = history.before(before) if before else len(history)
+                rows = history[i:min(hi, i + HISTORY_CHUNK)]
+            for t in rows:
+                yield t
+                if t["timestamp"] == last:
+                    same += 1
+                else:
+                    last, same = t["timestamp"], 1
+            if len(rows) < HISTORY_CHUNK:
+                return
+
+    # one page: the first `limit` entries after `after`, otherwise the last
+    # `limit` entries before `before` (or the most recent ones)
+    def list_history(self, user_id, after=None, before=None, limit=None):
+        with self._lock:
+            history = self.history(user_id)
+            lo = history.after(after) if after else 0
+            hi = history.before(before) if before else len(history)
+            if limit is not None:
+                if after:
+                    hi = min(hi, lo + limit)
+                else:
+                    lo = max(lo, hi - limit)
+            return history[lo:hi]
+
+    # (user_id, numpy columns) of every user's history, for retraining;
+    # each user is copied under the lock, so the columns line up
+    def history_arrays(self):
+        for uid in list(self.users):
+            with self._lock:
+                h = self.history(uid)
+                if not len(h):
+                    continue
+                columns = {
+                    "epoch": h.epochs(),
+                    "amount": h.amounts(),
+                    "device": h.device_ids(),
+                    "location": h.location_ids(),
+                    "fraud": h.fraud_labels(),
+                    "decision": h.decision_codes()
+                }
+            yield uid, columns
+
+    def get_pending(self, user_id, txn_id):
+        user = self.users.get(user_id)
+        if user is None:
+            return None
+        return user.get("pending", {}).get(txn_id)
+
+    def iter_pending(self):
+        for uid, u in list(self.users.items()):
+            for tid, t in list(u.get("pending", {}).items()):
+                yield uid, tid, t
+
+    # one page of pending transactions in reviewer order, plus the cursor
+    # for the next page (None when this is the last one)
+    def list_pending(self, risk_flag=None, otp_verified=None, limit=50, cursor=None):
+        after = decode_cursor(cursor) if cursor else None
+        with self._lock:
+            keys, next_key = self.pending_index.page(risk_flag, otp_verified, limit, after)
+            rows = [(uid, tid, self.users[uid]["pending"][tid]) for uid, tid, _ in keys]
+        return rows, encode_cursor(next_key) if next_key else None
+
+    # ---------- writes ----------
+    def mutate(self, record):
+        with self._lock:
+            self._apply(record)
+            self._persist(record)
+
+    def set_profile(self, user_id, profile):
+        self.mutate({"op": "profile", "user_id": user_id, "profile": profile})
+
+    def append_history(self, user_id, transaction):
+        self.mutate({"op": "history", "user_id": user_id, "transaction": transaction})
+
+    def add_pending(self, user_id, txn_id, entry):
+        self.mutate({"op": "pending_add", "user_id": user_id, "txn_id": txn_id, "entry": entry})
+
+    def verify_pending(self, user_id, txn_id):
+        self.mutate({"op": "pending_verify", "user_id": user_id, "txn_id": txn_id})
+
+    def pop_pending(self, user_id, txn_id):
+        with self._lock:
+            entry = self.users[user_id].get("pending", {}).get(txn_id)
+        if entry is not None:
+            self.mutate({"op": "pending_pop", "user_id": user_id, "txn_id": txn_id})
+        return entry
+
+    # sizes for /metrics
+    def stats(self):
+        with self._lock:
+            return {
+                "users": len(self.users),
+                "pending": len(self.pending_index),
+                "history_rows": sum(len(u.get("history", EMPTY_HISTORY)) for u in self.users.values()),
+                "file_bytes": _file_bytes(self._files())
+            }
+
+    def _files(self):
+        return []
+
+    def close(self):
+        pass
+
+# -------------------------------
+# Full-file JSON store (original behaviour)
+# -------------------------------
+class JsonStore(MemoryStore):
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+
+    def load(self):
+        with open(self.path) as f:
+            self._index(json.load(f))
+        self.pending_index.rebuild(self.users)
+        return self.data
+
+    def _persist(self, record):
+        _write_atomic(self.path, [json.dumps(self.data, indent=2, default=encode_json)])
+
+    def _files(self):
+        return [self.path]
+
+# -------------------------------
+# Append-only log + snapshots
+# -------------------------------
+# Layout on disk:
+#   snapshot_path      full state as of "_log_seq" (falls back to seed_path)
+#   log_path           records appended since the last rotation
+#   log_path.<seq>     rotated segments not yet folded into a snapshot
+#
+# Each record carries a monotonically increasing "seq", so replay skips
+# anything a snapshot already contains and a crash at any point of a
+# compaction is safe to recover from.
+class LogStore(MemoryStore):
+    def __init__(self, seed_path, log_path, snapshot_path,
+                 commit_window_ms=2.0, compact_every=10000):
+        super().__init__()
+        self.seed_path = seed_path
+        self.log_path = log_path
+        self.snapshot_path = snapshot_path
+        self.commit_window = commit_window_ms / 1000.0
+        self.compact_every = compact_every
+
+        self._cond = threading.Condition(self._lock)
+        self._sync_lock = threading.Lock()
+        self._compact_lock = threading.Lock()
+        self._seq = 0
+        self._written = 0
+        self._synced = 0
+        self._log_records = 0
+        self._log = None
+        self._closed = False
+        self._compacting = False
+        self._committer = None
+
+    # ---------- startup ----------
+    def _segments(self):
+        out = []
+        for path in glob.glob(self.log_path + ".*"):
+            suffix = path[len(self.log_path) + 1:]
+            if suffix.isdigit():
+                out.append((int(suffix), path))
+        return [p for _, p in sorted(out)]
+
+    def _files(self):
+        return [self.snapshot_path, self.log_path] + self._segments()
+
+    def _segment_seq(self, path):
+        return int(path[len(self.log_path) + 1:])
+
+    # the last snapshot (or the seed) and the log seq it covers
+    def _read_base(self):
+        path = self.snapshot_path if os.path.exists(self.snapshot_path) else self.seed_path
+        with open(path) as f:
+            data = json.load(f)
+        return data, data.pop("_log_seq", 0)
+
+    # applies the records after `seq` to `users`; returns (last seq, count)
+    def _replay(self, path, users, seq, truncate_torn=False):
+        good = 0
+        count = 0
+        with open(path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                good += len(line)
+                if record["seq"] > seq:
+                    apply_record(users, record)
+                    seq = record["seq"]
+                    count += 1
+        if truncate_torn and good < os.path.getsize(path):
+            # a crash left a partial last record; drop it so new appends
+            # don't land behind garbage
+            with open(path, "r+b") as f:
+                f.truncate(good)
+        return seq, count
+
+    # read_only: replay without touching the files or starting the
+    # committer (for offline readers, e.g. policy.py's dry run)
+    def load(self, read_only=False):
+        data, self._seq = self._read_base()
+        self._index(data)
+
+        for segment in self._segments():
+            self._seq, count = self._replay(segment, self.users, self._seq)
+            self._log_records += count
+        if os.path.exists(self.log_path):
+            self._seq, count = self._replay(
+                self.log_path, self.users, self._seq, truncate_torn=not read_only
+            )
+            self._log_records += count
+
+        self.pending_index.rebuild(self.users)
+        if read_only:
+            return self.data
+
+        self._written = self._synced = self._seq
+        self._log = open(self.log_path, "a")
+        self._committer = threading.Thread(
+            target=self._commit_loop, name="txn-log-commit", daemon=True
+        )
+        self._committer.start()
+        return self.data
+
+    # ---------- writes ----------
+    def mutate(self, record):
+        with self._cond:
+            seq = self._seq + 1
+            record = dict(record, seq=seq)
+            line = json.dumps(record, separators=(",", ":")) + "\n"
+            self._apply(record)
+            self._log.write(line)
+            self._seq = self._written = seq
+            self._log_records += 1
+            self._cond.notify_all()
+
+            if self._log_records >= self.compact_every and not self._compacting:
+                self._compacting = True
+                threading.Thread(
+                    target=self._compact_background, name="txn-log-compact", daemon=True
+                ).start()
+
+            # group commit: wait for whichever fsync covers our record
+            while self._synced < seq:
+                self._cond.wait()
+
+    def _commit_loop(self):
+        while True:
+            with self._cond:
+                while self._synced >= self._written and not self._closed:
+                    self._cond.wait()
+                if self._closed and self._synced >= self._written:
+                    return
+
+            # let concurrent writers pile onto this fsync
+            if self.commit_window > 0:
+                time.sleep(self.commit_window)
+
+            with self._sync_lock:
+                with self._cond:
+                    target = self._written
+                    self._log.flush()
+                    fd = self._log.fileno()
+                os.fsync(fd)
+                with self._cond:
+                    self._synced = max(self._synced, target)
+                    self._cond.notify_all()
+
+    # ---------- compaction ----------
+    # Only the rotation (rename + reopen) holds the store lock. The new
+    # snapshot is the previous one with the rotated segments replayed over
+    # it, built from the files while writers carry on against the new log.
+    def compact(self):
+        with self._compact_lock:
+            with self._sync_lock:
+                with self._cond:
+                    self._log.flush()
+                    old = self._log
+                    seq = self._seq
+                    os.replace(self.log_path, f"{self.log_path}.{seq}")
+                    self._log = open(self.log_path, "a")
+                    self._log_records = 0
+                # the committer waits on _sync_lock, so this fsync covers
+                # everything written before the rotation
+                os.fsync(old.fileno())
+                old.close()
+                with self._cond:
+                    self._synced = max(self._synced, seq)
+                    self._cond.notify_all()
+
+            data, last = self._read_base()
+            users = {u["user_id"]: u for u in data["users"]}
+            for segment in self._segments():
+                if self._segment_seq(segment) <= seq:
+                    last, _ = self._replay(segment, users, last)
+            _write_atomic(self.snapshot_path, _snapshot_chunks(data, seq))
+
+            for segment in self._segments():
+                if self._segment_seq(segment) <= seq:
+                    os.remove(segment)
+
+    def _compact_background(self):
+        try:
+            self.compact()
+        finally:
+            with self._cond:
+                self._compacting = False
+
+    def close(self):
+        if self._log is None:
+            return
+        self.compact()
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._committer.join()
+        self._log.close()
+        self._log = None
+
+# -------------------------------
+# SQLite store
+# -------------------------------
+# Users, history and pending live in indexed tables, so nothing is held in
+# memory and every change is a row-sized write. One connection per thread
+# (FastAPI runs sync endpoints on a threadpool); the fixed SQL strings below
+# are compiled once per connection through sqlite3's statement cache.
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id TEXT PRIMARY KEY,
+    profile TEXT
+);
+CREATE TABLE IF NOT EXISTS history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    body TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS history_user_ts ON history (user_id, timestamp);
+CREATE TABLE IF NOT EXISTS pending (
+    txn_id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    risk_flag TEXT NOT NULL,
+    risk_score REAL NOT NULL,
+    otp_verified INTEGER NOT NULL DEFAULT 0,
+    created TEXT NOT NULL DEFAULT '',
+    body TEXT NOT NULL,
+    neg_score REAL GENERATED ALWAYS AS (-risk_score) VIRTUAL
+);
+CREATE TABLE IF NOT EXISTS labels (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    features TEXT NOT NULL,
+    label INTEGER NOT NULL,
+    weight REAL NOT NULL DEFAULT 1
+);
+CREATE TABLE IF NOT EXISTS device_users (
+    device_id TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    last_seen REAL NOT NULL,
+    weight REAL NOT NULL,
+    PRIMARY KEY (device_id, user_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS versions (
+    scope TEXT PRIMARY KEY,
+    version INTEGER NOT NULL
+) WITHOUT ROWID;
+"""
+
+# the version counters (see record_scopes), bumped by triggers in the
+# writing statement's own transaction, so every process's writes count
+def _version_trigger(table, event, scopes):
+    row = "OLD" if event == "DELETE" else "NEW"
+    bumps = "".join(
+        f"    INSERT INTO versions (scope, version) VALUES ({scope}, 1)\n"
+        f"    ON CONFLICT (scope) DO UPDATE SET version = version + 1;\n"
+        for scope in [f"'user:' || {row}.user_id"] + [f"'{s}'" for s in scopes]
+    )
+    return (
+        f"CREATE TRIGGER IF NOT EXISTS {table}_{event.lower()}_version "
+        f"AFTER {event} ON {table} BEGIN\n{bumps}END;\n"
+    )
+
+SQLITE_TRIGGERS = "".join(
+    _version_trigger(table, event, scopes)
+    for table, scopes in (("users", [USERS_SCOPE]), ("history", []), ("pending", [PENDING_SCOPE]))
+    for event in ("INSERT", "UPDATE", "DELETE")
+)
+
+# created after the tables so older databases get their new columns first
+SQLITE_INDEXES = """
+DROP INDEX IF EXISTS pending_flag_score;
+DROP INDEX IF EXISTS pending_order;
+CREATE INDEX IF NOT EXISTS pending_user ON pending (user_id);
+CREATE INDEX IF NOT EXISTS pending_page ON pending (neg_score, created, txn_id);
+CREATE INDEX IF NOT EXISTS pending_page_flag ON pending (risk_flag, neg_score, created, txn_id);
+CREATE INDEX IF NOT EXISTS pending_page_verified
+    ON pending (otp_verified, neg_score, created, txn_id);
+CREATE INDEX IF NOT EXISTS pending_page_flag_verified
+    ON pending (risk_flag, otp_verified, neg_score, created, txn_id);
+CREATE INDEX IF NOT EXISTS history_user_id ON history (user_id, id);
+CREATE INDEX IF NOT EXISTS device_users_seen ON device_users (last_seen);
+"""
+
+# (table, column, definition) added since the first schema
+SQLITE_MIGRATIONS = [
+    ("pending", "created", "TEXT NOT NULL DEFAULT ''"),
+    ("labels", "weight", "REAL NOT NULL DEFAULT 1"),
+    ("pending", "neg_score", "REAL GENERATED ALWAYS AS (-risk_score) VIRTUAL"),
+]
+
+SQL_GET_VERSION = "SELECT version FROM versions WHERE scope = ?"
+SQL_GET_USER = "SELECT profile FROM users WHERE user_id = ?"
+SQL_LIST_USERS = "SELECT user_id, profile FROM users ORDER BY rowid"
+SQL_SET_PROFILE = (
+    "INSERT INTO users (user_id, profile) VALUES (?, ?) "
+    "ON CONFLICT (user_id) DO UPDATE SET profile = excluded.profile"
+)
+# keyset pages over the (user_id, timestamp, id) index
+SQL_HISTORY_ASC = (
+    "SELECT id, timestamp, body FROM history "
+    "WHERE user_id = ? AND (timestamp, id) > (?, ?) AND timestamp < ? "
+    "ORDER BY timestamp, id LIMIT ?"
+)
+SQL_HISTORY_DESC = (
+    "SELECT id, timestamp, body FROM history "
+    "WHERE user_id = ? AND (timestamp, id) < (?, ?) AND timestamp > ? "
+    "ORDER BY timestamp DESC, id DESC LIMIT ?"
+)
+MAX_ROWID = 2 ** 63 - 1
+TS_MAX = "\U0010ffff"
+HISTORY_CHUNK = 500
+SQL_ADD_HISTORY = "INSERT INTO history (user_id, timestamp, body) VALUES (?, ?, ?)"
+# rows appended after a given id, in insertion order (feature catch-up)
+SQL_HISTORY_AFTER_ID = (
+    "SELECT id, body FROM history WHERE user_id = ? AND id > ? ORDER BY id LIMIT ?"
+)
+SQL_HISTORY_ALL = "SELECT id, user_id, body FROM history WHERE id > ? ORDER BY id LIMIT ?"
+SQL_COUNT_TXNS = (
+    "SELECT (SELECT COUNT(*) FROM history WHERE user_id = ?) + "
+    "(SELECT COUNT(*) FROM pending WHERE user_id = ?)"
+)
+SQL_GET_PENDING = (
+    "SELECT body, otp_verified FROM pending WHERE user_id = ? AND txn_id = ?"
+)
+SQL_ITER_PENDING = (
+    "SELECT user_id, txn_id, body, otp_verified FROM pending ORDER BY rowid"
+)
+SQL_ADD_PENDING = (
+    "INSERT INTO pending (txn_id, user_id, risk_flag, risk_score, otp_verified, created, body) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?)"
+)
+# Reviewer pages: one statement per (flag filter, verified filter, cursor)
+# so each is a seek into its pending_page* index. neg_score turns the
+# mixed-direction order into a plain row-value comparison; with optional
+# "? IS NULL OR" filters and an OR chain sqlite walked the index from the top.
+def _page_pending_sql(flag, verified, after):
+    where = [cond for cond, on in (
+        ("risk_flag = :flag", flag),
+        ("otp_verified = :verified", verified),
+        ("(neg_score, created, txn_id) > (:neg_score, :created, :txn_id)", after)
+    ) if on]
+    return (
+        "SELECT user_id, txn_id, body, otp_verified, neg_score, created FROM pending "
+        + ("WHERE " + " AND ".join(where) + " " if where else "")
+        + "ORDER BY neg_score, created, txn_id LIMIT :limit"
+    )
+
+SQL_PAGE_PENDING = {
+    (flag, verified, after): _page_pending_sql(flag, verified, after)
+    for flag in (False, True) for verified in (False, True) for after in (False, True)
+}
+SQL_VERIFY_PENDING = (
+    "UPDATE pending SET otp_verified = 1 WHERE user_id = ? AND txn_id = ?"
+)
+SQL_POP_PENDING = "DELETE FROM pending WHERE user_id = ? AND txn_id = ?"
+SQL_ADD_LABEL = "INSERT INTO labels (features, label, weight) VALUES (?, ?, ?)"
+SQL_LABELS_AFTER = (
+    "SELECT seq, features, label, weight FROM labels WHERE seq > ? ORDER BY seq LIMIT ?"
+)
+SQL_PRUNE_LABELS = "DELETE FROM labels WHERE seq <= ?"
+# cross-user device index (crossuser.SqliteDeviceIndex)
+SQL_DEVICE_USERS = "SELECT user_id, last_seen, weight FROM device_users WHERE device_id = ?"
+SQL_PUT_DEVICE_USER = (
+    "INSERT INTO device_users (device_id, user_id, last_seen, weight) VALUES (?, ?, ?, ?) "
+    "ON CONFLICT (device_id, user_id) DO UPDATE SET "
+    "last_seen = excluded.last_seen, weight = excluded.weight"
+)
+SQL_DROP_DEVICE_USER = "DELETE FROM device_users WHERE device_id = ? AND user_id = ?"
+SQL_PRUNE_DEVICE_USERS = "DELETE FROM device_users WHERE last_seen <= ?"
+SQL_DEVICE_INDEX_STATS = "SELECT COUNT(DISTINCT device_id), COUNT(*) FROM device_users"
+SQL_STATS = (
+    "SELECT (SELECT COUNT(*) FROM users), (SELECT COUNT(*) FROM pending), "
+    "(SELECT COUNT(*) FROM history)"
+)
+
+
+def _pending_entry(body, otp_verified):
+    entry = json.loads(body)
+    entry["otp_verified"] = bool(otp_verified)
+    return entry
+
+
+class SqliteStore:
+    def __init__(self, path, seed_path=None):
+        self.path = path
+        self.seed_path = seed_path
+        self._local = threading.local()
+        self._conns = []
+        self._conns_lock = threading.Lock()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(
+                self.path, isolation_level=None,
+                check_same_thread=False, cached_statements=256
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+            self._local.conn = conn
+            with self._conns_lock:
+                self._conns.append(conn)
+        return conn
+
+    def load(self):
+        conn = self._conn()
+        conn.executescript(SQLITE_SCHEMA)
+        for table, column, definition in SQLITE_MIGRATIONS:
+            # table_xinfo also lists generated columns
+            columns = [r[1] for r in conn.execute(f"PRAGMA table_xinfo({table})")]
+            if column not in columns:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+        conn.executescript(SQLITE_INDEXES)
+        conn.executescript(SQLITE_TRIGGERS)
+        # the generation is kept as a versions row that never changes (no
+        # scope starts with "~"), so a recreated database gets a new one
+        conn.execute(
+            "INSERT OR IGNORE INTO versions (scope, version) VALUES ('~generation', ?)",
+            (int.from_bytes(os.urandom(4), "big"),)
+        )
+        generation = conn.execute(SQL_GET_VERSION, ("~generation",)).fetchone()[0]
+        self.generation = format(generation, "08x")
+
+        empty = conn.execute("SELECT COUNT(*) FROM users").fetchone()[0] == 0
+        if empty and self.seed_path and os.path.exists(self.seed_path):
+            self._import_json(self.seed_path)
+        return self
+
+    def _import_json(self, path):
+        with open(path) as f:
+            data = json.load(f)
+
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for u in data["users"]:
+                uid = u["user_id"]
+                profile = u.get("profile")
+                conn.execute(SQL_SET_PROFILE, (uid, None if profile is None else json.dumps(profile)))
+                conn.executemany(SQL_ADD_HISTORY, [
+                    (uid, t["timestamp"], json.dumps(t)) for t in u.get("history", [])
+                ])
+                for tid, t in u.get("pending", {}).items():
+                    self._insert_pending(conn, uid, tid, t)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    # ---------- reads ----------
+    def version(self, scope):
+        row = self._conn().execute(SQL_GET_VERSION, (scope,)).fetchone()
+        return row[0] if row else 0
+
+    def get_user(self, user_id):
+        conn = self._conn()
+        row = conn.execute(SQL_GET_USER, (user_id,)).fetchone()
+        if row is None:
+            raise KeyError(user_id)
+
+        view = {"user_id": user_id}
+        if row[0] is not None:
+            view["profile"] = json.loads(row[0])
+        return view
+
+    def list_users(self):
+        for uid, profile in self._conn().execute(SQL_LIST_USERS):
+            yield {"user_id": uid, "profile": json.loads(profile) if profile else {}}
+
+    def count_transactions(self, user_id):
+        return self._conn().execute(SQL_COUNT_TXNS, (user_id, user_id)).fetchone()[0]
+
+    def _check_user(self, user_id):
+        if self._conn().execute(SQL_GET_USER, (user_id,)).fetchone() is None:
+            raise KeyError(user_id)
+
+    # streamed in short keyset queries, so no cursor stays open between
+    # chunks (a streaming response may resume on another thread)
+    def iter_history(self, user_id, after=None, before=None):
+        self._check_user(user_id)
+        return self._iter_history(user_id, after, before)
+
+    def _iter_history(self, user_id, after, before):
+        last = (after or "", MAX_ROWID)
+        while True:
+            rows = self._conn().execute(SQL_HISTORY_ASC, (
+                user_id, last[0], last[1], before or TS_MAX, HISTORY_CHUNK
+            )).fetchall()
+            for _, _, body in rows:
+                yield json.loads(body)
+            if len(rows) < HISTORY_CHUNK:
+                return
+            last = (rows[-1][1], rows[-1][0])
+
+    # (row id, transaction) for rows appended after `row_id`, in the order
+    # they were written by any process
+    def history_after(self, user_id, row_id=0, limit=HISTORY_CHUNK):
+        rows = self._conn().execute(SQL_HISTORY_AFTER_ID, (user_id, row_id, limit)).fetchall()
+        return [(rid, json.loads(body)) for rid, body in rows]
+
+    def history(self, user_id):
+        return History(self.iter_history(user_id))
+
+    # (user_id, transaction) for every history row in insertion order,
+    # for retraining; keyset pages over the primary key
+    def iter_all_history(self):
+        last = 0
+        while True:
+            rows = self._conn().execute(SQL_HISTORY_ALL, (last, HISTORY_CHUNK)).fetchall()
+            for _, uid, body in rows:
+                yield uid, json.loads(body)
+            if len(rows) < HISTORY_CHUNK:
+                return
+            last = rows[-1][0]
+
+    def list_history(self, user_id, after=None, before=None, limit=None):
+        self._check_user(user_id)
+        if limit is None:
+            return list(self._iter_history(user_id, after, before))
+
+        conn = self._conn()
+        if after:
+            rows = conn.execute(SQL_HISTORY_ASC, (
+                user_id, after, MAX_ROWID, before or TS_MAX, limit
+            )).fetchall()
+        else:
+            rows = conn.execute(SQL_HISTORY_DESC, (
+                user_id, before or TS_MAX, -1, "", limit
+            )).fetchall()[::-1]
+        return [json.loads(body) for _, _, body in rows]
+
+    def get_pending(self, user_id, txn_id):
+        row = self._conn().execute(SQL_GET_PENDING, (user_id, txn_id)).fetchone()
+        return _pending_entry(*row) if row else None
+
+    def iter_pending(self):
+        for uid, tid, body, verified in self._conn().execute(SQL_ITER_PENDING):
+            yield uid, tid, _pending_entry(body, verified)
+
+    def list_pending(self, risk_flag=None, otp_verified=None, limit=50, cursor=None):
+        neg_score = created = txn_id = None
+        if cursor:
+            neg_score, created, txn_id = decode_cursor(cursor)
+
+        sql = SQL_PAGE_PENDING[risk_flag is not None, otp_verified is not None, bool(cursor)]
+        found = self._conn().execute(sql, {
+            "flag": risk_flag,
+            "verified": None if otp_verified is None else int(otp_verified),
+            "neg_score": neg_score, "created": created, "txn_id": txn_id,
+            "limit": limit + 1
+        }).fetchall()
+
+        rows = [(uid, tid, _pending_entry(body, v)) for uid, tid, body, v, _, _ in found[:limit]]
+        next_cursor = None
+        if len(found) > limit:
+            last = found[limit - 1]
+            next_cursor = encode_cursor((last[4], last[5], last[1]))
+        return rows, next_cursor
+
+    # ---------- writes ----------
+    def _insert_pending(self, conn, user_id, txn_id, entry):
+        conn.execute(SQL_ADD_PENDING, (
+            txn_id, user_id, entry["risk_flag"], entry["risk_score"],
+            int(entry.get("otp_verified", False)),
+            entry["transaction"]["timestamp"], json.dumps(entry)
+        ))
+
+    def set_profile(self, user_id, profile):
+        self._conn().execute(SQL_SET_PROFILE, (user_id, json.dumps(profile)))
+
+    def append_history(self, user_id, transaction):
+        self._conn().execute(SQL_ADD_HISTORY, (
+            user_id, transaction["timestamp"], json.dumps(transaction)
+        ))
+
+    def add_pending(self, user_id, txn_id, entry):
+        self._insert_pending(self._conn(), user_id, txn_id, entry)
+
+    def verify_pending(self, user_id, txn_id):
+        self._conn().execute(SQL_VERIFY_PENDING, (user_id, txn_id))
+
+    def pop_pending(self, user_id, txn_id):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(SQL_GET_PENDING, (user_id, txn_id)).fetchone()
+            if row is not None:
+                conn.execute(SQL_POP_PENDING, (user_id, txn_id))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return _pending_entry(*row) if row else None
+
+    # ---------- online-learning labels ----------
+    # A queue shared by all worker processes: every worker appends, the
+    # model-sync leader reads past the sequence its last snapshot covers
+    # and prunes what has been snapshotted.
+    def add_label(self, features, label, weight=1.0):
+        self._conn().execute(SQL_ADD_LABEL, (json.dumps(features), int(label), weight))
+
+    def labels_after(self, seq, limit):
+        return [
+            (s, json.loads(features), label, weight)
+            for s, features, label, weight in self._conn().execute(SQL_LABELS_AFTER, (seq, limit))
+        ]
+
+    def prune_labels(self, seq):
+        self._conn().execute(SQL_PRUNE_LABELS, (seq,))
+
+    # ---------- cross-user device index ----------
+    def device_users(self, device_id):
+        return {
+            uid: (last_seen, weight)
+            for uid, last_seen, weight in self._conn().execute(SQL_DEVICE_USERS, (device_id,))
+        }
+
+    def put_device_user(self, device_id, user_id, last_seen, weight, drop=()):
+        conn = self._conn()
+        if drop:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.executemany(SQL_DROP_DEVICE_USER, [(device_id, uid) for uid in drop])
+                conn.execute(SQL_PUT_DEVICE_USER, (device_id, user_id, last_seen, weight))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        else:
+            conn.execute(SQL_PUT_DEVICE_USER, (device_id, user_id, last_seen, weight))
+
+    def prune_device_users(self, before):
+        self._conn().execute(SQL_PRUNE_DEVICE_USERS, (before,))
+
+    def device_index_stats(self):
+        devices, entries = self._conn().execute(SQL_DEVICE_INDEX_STATS).fetchone()
+        return {"devices": devices, "entries": entries}
+
+    def stats(self):
+        users, pending, history = self._conn().execute(SQL_STATS).fetchone()
+        return {
+            "users": users,
+            "pending": pending,
+            "history_rows": history,
+            "file_bytes": _file_bytes([self.path, self.path + "-wal", self.path + "-shm"])
+        }
+
+    def close(self):
+        with self._conns_lock:
+            for conn in self._conns:
+                conn.close()
+            self._conns = []
+        self._local = threading.local()
@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+from sklearn.ensemble import RandomForestClassifier
+
+from forest import CompiledForest, check_parity
+from model import X_init, y_init, train_forest
+
+# -------------------------------
+# CompiledForest vs sklearn
+# -------------------------------
+# Output must be bit-identical, not just close: scores, flags and the
+# cascade's bound are compared across engines.
+def _rows(n, seed=0):
+    rng = np.random.default_rng(seed)
+    lo, hi = X_init.min(axis=0), X_init.max(axis=0)
+    X = rng.uniform(lo - (hi - lo), hi + (hi - lo), size=(n, X_init.shape[1]))
+    return np.vstack([X, X_init])
+
+
+@pytest.fixture(scope="module")
+def deep_forest():
+    X = _rows(3000, seed=1)
+    rng = np.random.default_rng(1)
+    y = (X[:, 0] * rng.uniform(size=len(X)) > np.median(X[:, 0])).astype(int)
+    return RandomForestClassifier(n_estimators=30, random_state=0).fit(X, y)
+
+
+def test_serving_forest_parity():
+    ok, _ = check_parity(train_forest(X_init, y_init), _rows(5000))
+    assert ok
+
+
+def test_deep_forest_parity(deep_forest):
+    ok, _ = check_parity(deep_forest, _rows(2000, seed=2))
+    assert ok
+
+
+def test_single_row_matches_batch(deep_forest):
+    compiled = CompiledForest.from_sklearn(deep_forest)
+    X = _rows(50, seed=3)
+    batch = compiled.predict_proba(X)
+    for i in range(len(X)):
+        assert np.array_equal(compiled.predict_proba(X[i]), batch[i:i + 1])
+        assert np.array_equal(compiled.predict_proba(X[i]), deep_forest.predict_proba(X[i:i + 1]))
+
+
+def test_save_load_parity(deep_forest, tmp_path):
+    compiled = CompiledForest.from_sklearn(deep_forest)
+    compiled.save(str(tmp_path / "forest"))
+    X = _rows(1000, seed=4)
+    for mmap in (True, False):
+        loaded = CompiledForest.load(str(tmp_path / "forest"), mmap=mmap)
+        assert np.array_equal(loaded.predict_proba(X), deep_forest.predict_proba(X))
+        assert np.array_equal(loaded.predict(X), deep_forest.predict(X))
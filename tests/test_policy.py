@@ -0,0 +1,163 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from features import ACCOUNT_LIMITS, FEATURE_KEYS, account_limit
+from policy import DEFAULT_POLICY, RISK_FLAGS, Policy, compile_rule, load_policy
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# -------------------------------
+# Default policy vs the original hard-coded scoring
+# -------------------------------
+# The score, boosts and flag bounds app.py used before they moved into
+# policy.json, row by row in plain Python.
+def old_score(amount, location_change, avg_amount, online_prob, rf_prob):
+    score = (0.6 * online_prob + 0.4 * rf_prob) * 100
+    if amount > avg_amount * 3:
+        score += 10
+    if amount % 10 != 0:
+        score += 5
+    if location_change == 1:
+        score += 10
+    return round(min(score, 100), 2)
+
+def old_flag(score):
+    if score <= 20: return "LOW"
+    if score <= 40: return "MEDIUM"
+    if score <= 60: return "HIGH"
+    if score <= 80: return "CRITICAL"
+    return "SEVERE"
+
+OLD_ACTIONS = {
+    "LOW": "AUTO_APPROVE", "MEDIUM": "APPROVE_MONITOR", "HIGH": "OTP_REQUIRED",
+    "CRITICAL": "OTP_REQUIRED", "SEVERE": "BLOCK"
+}
+
+
+def _rows(n, seed=0):
+    rng = np.random.default_rng(seed)
+    X = np.zeros((n, len(FEATURE_KEYS)))
+    # half round amounts, half with cents
+    X[:, FEATURE_KEYS.index("amount")] = np.where(
+        rng.uniform(size=n) < 0.5,
+        rng.integers(1, 5000, n) * 10,
+        rng.uniform(1, 50000, n).round(2)
+    )
+    X[:, FEATURE_KEYS.index("location_change")] = rng.integers(0, 2, n)
+    X[:, FEATURE_KEYS.index("device_change")] = rng.integers(0, 2, n)
+    return X, rng.uniform(100, 10000, n), rng.uniform(size=n), rng.uniform(size=n)
+
+
+def test_shipped_file_is_the_default():
+    shipped = load_policy(os.path.join(ROOT, "policy.json"))
+    assert shipped.digest == Policy({}).digest
+    assert load_policy(os.path.join(ROOT, "missing.json")).digest == Policy({}).digest
+
+
+def test_default_policy_matches_old_scoring():
+    X, avg, rf, online = _rows(20000)
+    scores, flags, actions = Policy({}).evaluate(X, rf, online, avg)
+    amount = X[:, FEATURE_KEYS.index("amount")]
+    location_change = X[:, FEATURE_KEYS.index("location_change")]
+    for i in range(len(X)):
+        expected = old_score(amount[i], location_change[i], avg[i], online[i], rf[i])
+        assert scores[i] == expected
+        assert flags[i] == old_flag(expected)
+        assert actions[i] == OLD_ACTIONS[old_flag(expected)]
+
+
+def test_one_row_matches_batch():
+    X, avg, rf, online = _rows(200, seed=1)
+    policy = Policy({})
+    scores, flags, actions = policy.evaluate(X, rf, online, avg)
+    for i in range(len(X)):
+        s, f, a = policy.evaluate(X[i:i + 1], rf[i:i + 1], online[i:i + 1], avg[i:i + 1])
+        assert (s[0], f[0], a[0]) == (scores[i], flags[i], actions[i])
+
+
+def test_flag_bounds_are_inclusive():
+    policy = Policy({})
+    scores = np.array([0, 20, 20.01, 40, 40.01, 60, 60.01, 80, 80.01, 100])
+    assert policy.flags(scores).tolist() == [old_flag(s) for s in scores]
+    assert policy.low_bound == 20
+
+
+def test_rule_hits():
+    X, avg, rf, online = _rows(1000, seed=2)
+    hits = Policy({}).rule_hits(X, avg)
+    amount = X[:, FEATURE_KEYS.index("amount")]
+    assert np.array_equal(hits["amount_over_3x_average"], amount > avg * 3)
+    assert np.array_equal(hits["non_round_amount"], amount % 10 != 0)
+    assert np.array_equal(
+        hits["location_change"], X[:, FEATURE_KEYS.index("location_change")] == 1
+    )
+
+
+def test_account_limits():
+    policy = Policy({})
+    assert policy.account_limits == ACCOUNT_LIMITS
+    assert account_limit("STUDENT") == ACCOUNT_LIMITS["student"]
+    assert account_limit("unknown") == ACCOUNT_LIMITS["default"]
+    assert account_limit("savings", {"default": 7}) == 7
+
+# -------------------------------
+# Rule compiler
+# -------------------------------
+def test_rule_expressions():
+    columns = {
+        "amount": np.array([100.0, 250.0, 999.0]),
+        "avg_amount": np.array([50.0, 100.0, 0.0]),
+        "device_change": np.array([1.0, 0.0, 1.0])
+    }
+    rule, names = compile_rule("amount > avg_amount * 2 and not device_change == 0")
+    assert names == {"amount", "avg_amount", "device_change"}
+    assert rule(columns).tolist() == [False, False, True]
+    rule, _ = compile_rule("amount / avg_amount >= 2.5 or amount % 100 == 99")
+    with np.errstate(divide="ignore"):
+        assert rule(columns).tolist() == [False, True, True]
+
+
+@pytest.mark.parametrize("expr", [
+    "amount > limit",                   # unknown variable
+    "__import__('os').system('true')",  # calls
+    "amount.real > 1",                  # attributes
+    "amount >",                         # syntax
+    "'a' == 'a'",                       # strings
+])
+def test_rule_rejects(expr):
+    with pytest.raises(ValueError):
+        compile_rule(expr)
+
+
+@pytest.mark.parametrize("spec", [
+    {"weights": {"online": -1, "rf": 1}},
+    {"flags": {"LOW": 50, "MEDIUM": 40, "HIGH": 60, "CRITICAL": 80}},
+    {"actions": {**DEFAULT_POLICY["actions"], "LOW": "SHRUG"}},
+    {"account_limits": {"student": 1000}},
+    {"rules": [{"name": "a", "when": "amount > 1", "add": 1}] * 2},
+    {"colour": "red"},
+])
+def test_policy_rejects(spec):
+    with pytest.raises(ValueError):
+        Policy(spec)
+
+
+def test_custom_policy(tmp_path):
+    path = tmp_path / "policy.json"
+    path.write_text(json.dumps({
+        "weights": {"online": 0, "rf": 1},
+        "rules": [{"name": "big", "when": "amount > 1000", "add": 30}],
+        "flags": {"LOW": 10, "MEDIUM": 20, "HIGH": 30, "CRITICAL": 40},
+        "actions": {**DEFAULT_POLICY["actions"], "HIGH": "BLOCK"}
+    }))
+    policy = load_policy(str(path))
+    X = np.zeros((3, len(FEATURE_KEYS)))
+    X[:, FEATURE_KEYS.index("amount")] = [10, 5000, 5000]
+    scores, flags, actions = policy.evaluate(X, [0.05, 0.0, 0.5], [1, 1, 1], [1, 1, 1])
+    assert scores.tolist() == [5.0, 30.0, 80.0]
+    assert flags.tolist() == ["LOW", "HIGH", "SEVERE"]
+    assert actions.tolist() == ["AUTO_APPROVE", "BLOCK", "BLOCK"]
+    assert set(flags) <= set(RISK_FLAGS)
@@ -0,0 +1,217 @@
+import json
+import os
+import shutil
+import threading
+
+import pytest
+
+from storage import JsonStore, LogStore, SqliteStore
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKENDS = ["json", "log", "sqlite"]
+
+# -------------------------------
+# Round trips and restarts
+# -------------------------------
+# Every backend must hand back exactly what was written, and the same
+# again after a restart: history rows keep their keys and types (an int
+# amount stays an int, unknown keys survive), pending entries keep their
+# fields and OTP state.
+def open_store(kind, d):
+    seed = str(d / "user_transactions.json")
+    if kind == "json":
+        store = JsonStore(seed)
+    elif kind == "log":
+        store = LogStore(seed, seed + ".log", seed + ".snapshot", commit_window_ms=0)
+    else:
+        store = SqliteStore(str(d / "user_transactions.db"), seed_path=seed)
+    store.load()
+    return store
+
+
+def snapshot(store):
+    users = sorted(store.list_users(), key=lambda u: u["user_id"])
+    return {
+        "users": users,
+        "history": {u["user_id"]: list(store.iter_history(u["user_id"])) for u in users},
+        "pending": sorted(
+            (uid, tid, json.dumps(t, sort_keys=True)) for uid, tid, t in store.iter_pending()
+        )
+    }
+
+
+def pending_entry(amount, score, flag):
+    return {
+        "transaction": {
+            "amount": amount, "device_id": "mobile_9", "location": "Mumbai",
+            "timestamp": "2026-03-01T10:00:00.123456"
+        },
+        "features": {"amount": amount, "rapid_txn": 0, "_meta": {"avg_amount": 1200}},
+        "risk_score": score,
+        "risk_flag": flag,
+        "rf_probability": 0.25,
+        "online_probability": 0.5,
+        "otp": 123456,
+        "otp_verified": False
+    }
+
+NEW_HISTORY = [
+    {"amount": 500, "device_id": "mobile_1", "location": "Pune",
+     "timestamp": "2026-03-01T09:00:00", "fraud": 0},
+    {"amount": 99999.5, "device_id": "mobile_7", "location": "Delhi",
+     "timestamp": "2026-03-01T09:30:00.000001", "fraud": 1,
+     "block_reason": "AMOUNT_EXCEEDS_ACCOUNT_LIMIT"},
+    {"amount": 1234.56, "device_id": "mobile_9", "location": "Mumbai",
+     "timestamp": "2026-03-01T09:45:00", "decision": "TIMEOUT", "otp_verified": False},
+    {"amount": 20, "device_id": "mobile_1", "location": "Pune",
+     "timestamp": "2026-03-01T09:50:00+00:00", "note": "kept verbatim"},
+]
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    shutil.copy(os.path.join(ROOT, "user_transactions.json"), tmp_path)
+    return tmp_path
+
+
+def write_changes(store):
+    for t in NEW_HISTORY:
+        store.append_history("user_101", t)
+    store.add_pending("user_101", "user_101_a", pending_entry(1234.56, 66.2, "CRITICAL"))
+    store.add_pending("user_202", "user_202_b", pending_entry(4321, 45.0, "HIGH"))
+    store.add_pending("user_202", "user_202_c", pending_entry(77, 50.0, "HIGH"))
+    store.verify_pending("user_202", "user_202_b")
+    popped = store.pop_pending("user_202", "user_202_c")
+    assert popped["transaction"]["amount"] == 77
+    assert store.pop_pending("user_202", "user_202_c") is None
+    store.set_profile("user_101", {"account_type": "student", "avg_amount": 1300.5})
+
+
+@pytest.mark.parametrize("kind", BACKENDS)
+def test_seed_round_trip(kind, data_dir):
+    with open(data_dir / "user_transactions.json") as f:
+        seed = {u["user_id"]: u for u in json.load(f)["users"]}
+    store = open_store(kind, data_dir)
+    try:
+        for uid, u in seed.items():
+            assert list(store.iter_history(uid)) == u.get("history", [])
+            assert store.get_user(uid)["profile"] == u.get("profile", {})
+    finally:
+        store.close()
+
+
+@pytest.mark.parametrize("kind", BACKENDS)
+def test_writes_survive_restart(kind, data_dir):
+    store = open_store(kind, data_dir)
+    try:
+        before = list(store.iter_history("user_101"))
+        write_changes(store)
+        after = snapshot(store)
+    finally:
+        store.close()
+
+    history = after["history"]["user_101"]
+    assert history == sorted(before + NEW_HISTORY, key=lambda t: t["timestamp"][:26])
+    assert isinstance(history[-1]["amount"], int)
+    assert [uid for uid, _, _ in after["pending"]] == ["user_101", "user_202"]
+    entry = json.loads(after["pending"][1][2])
+    assert entry["otp_verified"] is True
+    assert entry["features"]["_meta"] == {"avg_amount": 1200}
+
+    store = open_store(kind, data_dir)
+    try:
+        assert snapshot(store) == after
+        assert store.get_user("user_101")["profile"]["avg_amount"] == 1300.5
+    finally:
+        store.close()
+
+
+def test_log_compaction_restart(data_dir):
+    store = open_store("log", data_dir)
+    try:
+        write_changes(store)
+        store.compact()
+        store.append_history("user_303", NEW_HISTORY[0])
+        expected = snapshot(store)
+    finally:
+        store.close()
+    store = open_store("log", data_dir)
+    try:
+        assert snapshot(store) == expected
+    finally:
+        store.close()
+
+
+def test_log_compaction_concurrent_writes(data_dir):
+    # the snapshot is rebuilt off the store lock; writes that land during
+    # compaction go to the new log and must survive the restart as well
+    store = open_store("log", data_dir)
+    try:
+        def writer(uid):
+            for i in range(200):
+                store.append_history(uid, dict(NEW_HISTORY[0], amount=i))
+        threads = [threading.Thread(target=writer, args=(uid,)) for uid in ("user_101", "user_202")]
+        for t in threads:
+            t.start()
+        for _ in range(5):
+            store.compact()
+        for t in threads:
+            t.join()
+        expected = snapshot(store)
+    finally:
+        store.close()
+    assert len(expected["history"]["user_101"]) >= 200
+    store = open_store("log", data_dir)
+    try:
+        assert snapshot(store) == expected
+    finally:
+        store.close()
+
+
+@pytest.mark.parametrize("kind", BACKENDS)
+def test_history_filters(kind, data_dir):
+    store = open_store(kind, data_dir)
+    try:
+        for t in NEW_HISTORY:
+            store.append_history("user_101", t)
+        rows = list(store.iter_history("user_101"))
+        middle = rows[len(rows) // 2]["timestamp"]
+        assert list(store.iter_history("user_101", after=middle)) == [
+            t for t in rows if t["timestamp"] > middle
+        ]
+        assert list(store.iter_history("user_101", before=middle)) == [
+            t for t in rows if t["timestamp"] < middle
+        ]
+        assert store.list_history("user_101", limit=2) == rows[-2:]
+    finally:
+        store.close()
+
+
+@pytest.mark.parametrize("kind", BACKENDS)
+def test_pending_pages(kind, data_dir):
+    # scores repeat so pages break inside ties on (score, created, txn id)
+    store = open_store(kind, data_dir)
+    try:
+        for i in range(40):
+            entry = pending_entry(100 + i, [45.0, 66.2, 90.0][i % 3], ["HIGH", "CRITICAL"][i % 2])
+            entry["transaction"]["timestamp"] = f"2026-03-01T10:00:{i % 7:02d}"
+            store.add_pending("user_101", f"txn_{i:02d}", entry)
+            if i % 4 == 0:
+                store.verify_pending("user_101", f"txn_{i:02d}")
+        everything = [(tid, t) for _, tid, t in store.iter_pending()]
+        for flag in (None, "HIGH", "CRITICAL"):
+            for verified in (None, True, False):
+                expected = sorted(
+                    (-t["risk_score"], t["transaction"]["timestamp"], tid)
+                    for tid, t in everything
+                    if flag in (None, t["risk_flag"]) and verified in (None, t["otp_verified"])
+                )
+                seen, cursor = [], None
+                while True:
+                    rows, cursor = store.list_pending(flag, verified, 7, cursor)
+                    seen += [(-t["risk_score"], t["transaction"]["timestamp"], tid) for _, tid, t in rows]
+                    if cursor is None:
+                        break
+                assert seen == expected
+    finally:
+        store.close()
@@ -1,9 +1,12 @@
 import streamlit as st
 import pandas as pd
 import requests
+import json
 
 # --- CONFIGURATION ---
 BACKEND_URL = "https://online-fraud-detection-jl8h.onrender.com"
+PENDING_PAGE_SIZE = 200
+HISTORY_PAGE_SIZE = 500
 
 st.set_page_config(
     page_title="XYZ Bank - Fraud Detection",
@@ -35,13 +38,91 @@ if "role" not in st.session_state: st.session_state.role = None
 if "user" not in st.session_state: st.session_state.user = None
 if "account_type" not in st.session_state: st.session_state.account_type = None
 if "otp_ok" not in st.session_state: st.session_state.otp_ok = False
+# one keep-alive connection pool per browser session
+if "http" not in st.session_state: st.session_state.http = requests.Session()
+# review queue kept up to date from /pending/events
+if "pending" not in st.session_state: st.session_state.pending = {}
+if "pending_cursor" not in st.session_state: st.session_state.pending_cursor = None
 
 # --- HELPERS ---
-@st.cache_data
+# Last response per URL with its ETag, shared by all sessions. Every rerun
+# revalidates with If-None-Match; the backend answers 304 until the data
+# changes, so a refresh is cheap and never stale.
+@st.cache_resource
+def etag_cache():
+    return {}
+
+def get_json(path, params=None):
+    key = (path, tuple(sorted((params or {}).items())))
+    cached = etag_cache().get(key)
+    r = st.session_state.http.get(
+        f"{BACKEND_URL}{path}", params=params,
+        headers={"If-None-Match": cached[0]} if cached else {}
+    )
+    if r.status_code == 304 and cached:
+        return cached[1]
+    body = r.json()
+    if r.status_code == 200 and "ETag" in r.headers:
+        etag_cache()[key] = (r.headers["ETag"], body)
+    return body
+
+# The review queue is loaded once, then each rerun applies the events since
+# the last one seen (a short /pending/events read that returns what is
+# buffered). A reset (backend restarted, another worker, too far behind)
+# reloads the first page. Items past the first page only show up once
+# they are added after the load.
+def load_pending():
+    r = st.session_state.http.get(f"{BACKEND_URL}/pending", params={"limit": PENDING_PAGE_SIZE})
+    st.session_state.pending = {t["transaction_id"]: t for t in r.json()["items"]}
+    st.session_state.pending_cursor = r.headers.get("X-Pending-Cursor")
+
+def read_events(lines):
+    event = {}
+    for line in lines:
+        if not line:
+            if "data" in event:
+                yield event
+            event = {}
+        elif line.startswith("id:"):
+            event["id"] = line[3:].strip()
+        elif line.startswith("event:"):
+            event["event"] = line[6:].strip()
+        elif line.startswith("data:"):
+            event["data"] = json.loads(line[5:])
+
+def sync_pending():
+    if st.session_state.pending_cursor is None:
+        load_pending()
+    else:
+        r = st.session_state.http.get(
+            f"{BACKEND_URL}/pending/events",
+            params={"cursor": st.session_state.pending_cursor, "max_s": 0}, stream=True
+        )
+        pending = st.session_state.pending
+        for e in read_events(r.iter_lines(decode_unicode=True)):
+            if e["event"] == "reset":
+                load_pending()
+                break
+            tid = e["data"]["transaction_id"]
+            if e["event"] == "pending_add":
+                pending[tid] = e["data"]
+            elif e["event"] == "pending_verify" and tid in pending:
+                pending[tid]["otp_verified"] = True
+            elif e["event"] == "pending_resolve":
+                pending.pop(tid, None)
+            st.session_state.pending_cursor = e["id"]
+        r.close()
+    # highest risk first, like /pending
+    items = sorted(
+        st.session_state.pending.values(),
+        key=lambda t: (-t["risk_score"], t["timestamp"], t["transaction_id"])
+    )
+    return items[:PENDING_PAGE_SIZE]
+
 def get_users_list():
     try:
-        r = requests.get(f"{BACKEND_URL}/debug/users")
-        return r.json() if r.status_code == 200 else []
+        users = get_json("/debug/users")
+        return users if isinstance(users, list) else []
     except:
         return []
 
@@ -127,13 +208,13 @@ elif st.session_state.page == "dashboard":
         # LEFT: HISTORY
         with left:
             st.subheader("Transaction History")
-            r = requests.get(f"{BACKEND_URL}/history/{st.session_state.user}")
-            history = r.json()
+            history = get_json(f"/history/{st.session_state.user}",
+                               params={"limit": HISTORY_PAGE_SIZE})
             
             if history:
                 df = pd.DataFrame(history)
                 m1, m2 = st.columns(2)
-                m1.metric("Total Transactions", len(df))
+                m1.metric("Recent Transactions", len(df))
                 m2.metric("Total Volume", f"{df['amount'].sum():,.2f}")
                 
                 st.dataframe(df, use_container_width=True, hide_index=True)
@@ -153,10 +234,10 @@ elif st.session_state.page == "dashboard":
                 submit = st.form_submit_button("Submit Transaction")
                 
                 if submit:
-                    r = requests.post(f"{BACKEND_URL}/transaction", 
-                                      json={"user_id": st.session_state.user, 
-                                            "amount": amount, 
-                                            "device_id": device})
+                    r = st.session_state.http.post(f"{BACKEND_URL}/transaction", 
+                                                   json={"user_id": st.session_state.user, 
+                                                         "amount": amount, 
+                                                         "device_id": device})
                     resp = r.json()
                     
                     if resp.get("action") == "BLOCK":
@@ -194,8 +275,8 @@ elif st.session_state.page == "dashboard":
             st.subheader(f"History for {monitor_user}")
             
             # Fetch history for the dynamically selected user, NOT the session user
-            r = requests.get(f"{BACKEND_URL}/history/{monitor_user}")
-            history = r.json()
+            history = get_json(f"/history/{monitor_user}",
+                               params={"limit": HISTORY_PAGE_SIZE})
             
             if history:
                 df_h = pd.DataFrame(history)
@@ -209,8 +290,7 @@ elif st.session_state.page == "dashboard":
         with tab_approvals:
             st.subheader("Pending Transaction Queue")
             
-            r = requests.get(f"{BACKEND_URL}/pending")
-            pending = r.json()
+            pending = sync_pending()
             
             if not pending:
                 st.success("No pending transactions requiring review.")
@@ -252,10 +332,10 @@ elif st.session_state.page == "dashboard":
                                 st.write("")
                                 st.write("") 
                                 if st.button("Verify OTP"):
-                                    v = requests.post(f"{BACKEND_URL}/verify-otp", 
-                                                      data={"user_id": txn["user_id"], 
-                                                            "transaction_id": txn_id, 
-                                                            "otp": otp_input})
+                                    v = st.session_state.http.post(f"{BACKEND_URL}/verify-otp", 
+                                                                   data={"user_id": txn["user_id"], 
+                                                                         "transaction_id": txn_id, 
+                                                                         "otp": otp_input})
                                     if v.json().get("verified"):
                                         st.session_state.otp_ok = True
                                         st.success("OTP Verified")
@@ -273,18 +353,18 @@ elif st.session_state.page == "dashboard":
                                 if not st.session_state.otp_ok:
                                     st.error("Cannot approve: OTP verification required.")
                                 else:
-                                    requests.post(f"{BACKEND_URL}/decision", 
-                                                  data={"user_id": txn["user_id"], 
-                                                        "transaction_id": txn_id, 
-                                                        "decision": "APPROVE"})
+                                    st.session_state.http.post(f"{BACKEND_URL}/decision", 
+                                                               data={"user_id": txn["user_id"], 
+                                                                     "transaction_id": txn_id, 
+                                                                     "decision": "APPROVE"})
                                     st.success("Transaction Approved")
                                     st.rerun()
                         
                         with btn_col2:
                             if st.button("Reject (Mark as Fraud)"):
-                                requests.post(f"{BACKEND_URL}/decision", 
-                                              data={"user_id": txn["user_id"], 
-                                                    "transaction_id": txn_id, 
-                                                    "decision": "REJECT"})
+                                st.session_state.http.post(f"{BACKEND_URL}/decision", 
+                                                           data={"user_id": txn["user_id"], 
+                                                                 "transaction_id": txn_id, 
+                                                                 "decision": "REJECT"})
                                 st.warning("Transaction Rejected")
                                 st.rerun()
\ No newline at end of file